@@ -0,0 +1,92 @@
+"""
+Headless HTTP API around the assistant.
+
+Run with:  uvicorn api:app --app-dir app --host 0.0.0.0 --port 8000
+LLM calls use the async Groq client; encoder, Chroma and SQLite work runs on
+a bounded thread pool (BLOCKING_WORKERS), so one process can keep many
+requests in flight.
+"""
+import os
+from contextlib import asynccontextmanager
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse, PlainTextResponse, JSONResponse
+from pydantic import BaseModel
+from dotenv import load_dotenv
+from assistant import aask, route_query
+from faq import afaq_chain
+from sql import asql_chain
+from chitchat import achitchat_chain
+from blocking import run_blocking
+import llm
+import registry
+from telemetry import render_prometheus
+
+load_dotenv()
+
+
+class Query(BaseModel):
+    query: str
+    stream: bool = False
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Models, router and FAQ collection load in the background; /ready reports when they are done
+    registry.warm_up()
+    yield
+
+
+app = FastAPI(title="ShopAssist API", lifespan=lifespan)
+
+
+async def respond(answer, stream):
+    if stream:
+        return StreamingResponse(answer, media_type="text/plain; charset=utf-8")
+    return {"answer": answer}
+
+
+@app.get("/health")
+async def health():
+    return {"status": "ok", "resources": registry.status(), "llm_breaker": llm.breaker.state}
+
+
+@app.get("/ready")
+async def ready():
+    body = {"ready": registry.is_ready(), "resources": registry.status(), "errors": registry.errors()}
+    return JSONResponse(body, status_code=200 if body["ready"] else 503)
+
+
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+@app.post("/route")
+async def route(body: Query):
+    route_name, _ = await run_blocking(route_query, body.query)
+    return {"route": route_name}
+
+
+@app.post("/ask")
+async def ask(body: Query):
+    return await respond(await aask(body.query, stream=body.stream), body.stream)
+
+
+@app.post("/faq")
+async def faq(body: Query):
+    return await respond(await afaq_chain(body.query, stream=body.stream), body.stream)
+
+
+@app.post("/sql")
+async def sql(body: Query):
+    return await respond(await asql_chain(body.query, stream=body.stream), body.stream)
+
+
+@app.post("/chitchat")
+async def chitchat(body: Query):
+    return await respond(await achitchat_chain(body.query, stream=body.stream), body.stream)
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host=os.getenv('API_HOST', '0.0.0.0'), port=int(os.getenv('API_PORT', '8000')))
@@ -0,0 +1,32 @@
+import os
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+API_URL = os.getenv('SHOPASSIST_API_URL', 'http://localhost:8000')
+
+_client = httpx.Client(base_url=API_URL, timeout=httpx.Timeout(60.0, connect=5.0))
+
+
+def _stream(query):
+    try:
+        with _client.stream("POST", "/ask", json={"query": query, "stream": True}) as response:
+            response.raise_for_status()
+            for chunk in response.iter_text():
+                if chunk:
+                    yield chunk
+    except httpx.HTTPError as e:
+        yield f"I encountered a slight hiccup: {str(e)}"
+
+
+def ask(query, stream=False):
+    """Same contract as assistant.ask, served by the API in api.py"""
+    if stream:
+        return _stream(query)
+    try:
+        response = _client.post("/ask", json={"query": query})
+        response.raise_for_status()
+        return response.json()["answer"]
+    except httpx.HTTPError as e:
+        return f"I encountered a slight hiccup: {str(e)}"
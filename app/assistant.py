@@ -0,0 +1,166 @@
+import os
+import asyncio
+from dotenv import load_dotenv
+from faq import faq_chain, afaq_chain, prepare_answer
+from sql import sql_chain, asql_chain, translate_question, atranslate_question
+from chitchat import chitchat_chain, achitchat_chain
+from router import get_router, get_route_index
+from embeddings import encode_query
+from llm import as_stream, aas_stream
+from blocking import submit, run_blocking
+from telemetry import logger, span, increment, start_trace
+
+load_dotenv()
+
+# Speculative mode starts FAQ retrieval and SQL translation alongside routing
+SPECULATIVE_ROUTING = os.getenv('SPECULATIVE_ROUTING', '0') == '1'
+# faq/sql scores closer than this are ambiguous; both paths are kept until retrieval settles it
+SPECULATIVE_MARGIN = float(os.getenv('SPECULATIVE_MARGIN', '0.05'))
+# An ambiguous query goes to the FAQ path if its closest FAQ is within this cosine distance
+FAQ_CONFIDENT_DISTANCE = float(os.getenv('FAQ_CONFIDENT_DISTANCE', '0.35'))
+
+
+def route_vector(query_embedding):
+    """Route an encoded query with the semantic router; None if no route matches"""
+    with span('route') as record:
+        route = get_router()(vector=query_embedding)
+        route_name = route.name if route is not None else None
+        record['route'] = route_name
+        record['score'] = route.similarity_score if route is not None else None
+    increment('shopassist_route_total', route=route_name or 'none')
+    return route_name
+
+
+def route_query(query):
+    """Encode a query and route it; returns (route_name, query_embedding)"""
+    # Encode once: the same vector drives routing and FAQ retrieval
+    with span('encode'):
+        query_embedding = encode_query(query)
+    return route_vector(query_embedding), query_embedding
+
+
+def choose_route(query_embedding):
+    """Route an encoded query for speculative mode
+
+    Returns (route_name, ambiguous). The route is the one route_query()
+    picks, from the same router. ambiguous is True when that route is faq
+    or sql, the two are the top routes in route_index.rank(), and their
+    scores are within SPECULATIVE_MARGIN.
+    """
+    route_name = route_vector(query_embedding)
+    if route_name not in ('faq', 'sql'):
+        return route_name, False
+    ranked = get_route_index().rank(query_embedding)
+    logger.debug("Route scores: %s", ranked)
+    (top, top_score), (second, second_score) = ranked[0], ranked[1]
+    ambiguous = {top, second} == {'faq', 'sql'} and top_score - second_score < SPECULATIVE_MARGIN
+    return route_name, ambiguous
+
+
+def settle_ambiguous(prepared):
+    """Resolve an ambiguous faq/sql decision from the FAQ retrieval result"""
+    distance = prepared[4]
+    return 'faq' if distance is not None and distance <= FAQ_CONFIDENT_DISTANCE else 'sql'
+
+
+def ask(query, stream=False):
+    """Route the query to appropriate handler
+
+    With stream=True, returns a generator of text chunks.
+    """
+    start_trace()
+    if SPECULATIVE_ROUTING:
+        return ask_speculative(query, stream)
+    try:
+        route_name, query_embedding = route_query(query)
+        if route_name == 'faq':
+            return faq_chain(query, query_embedding, stream=stream)
+        elif route_name == 'sql':
+            return sql_chain(query, stream=stream)
+        else:
+            # chitchat, and the fallback for unknown or unmatched routes
+            return chitchat_chain(query, stream=stream)
+    except Exception as e:
+        message = f"I encountered a slight hiccup: {str(e)}"
+        return as_stream(message) if stream else message
+
+
+def ask_speculative(query, stream=False):
+    """ask() with SQL translation and FAQ retrieval started before the route is known
+
+    SQL translation does not need the query vector, so it starts right away;
+    FAQ retrieval starts as soon as the query is encoded. The path that loses
+    is cancelled (or, if already running, its result is discarded).
+    """
+    sql_future = submit(translate_question, query)
+    faq_future = None
+    try:
+        with span('encode'):
+            query_embedding = encode_query(query)
+        faq_future = submit(prepare_answer, query, query_embedding)
+        route_name, ambiguous = choose_route(query_embedding)
+        if ambiguous:
+            route_name = settle_ambiguous(faq_future.result())
+            logger.debug("Ambiguous route settled by FAQ retrieval: %s", route_name)
+
+        if route_name == 'faq':
+            sql_future.cancel()
+            return faq_chain(query, query_embedding, stream=stream, prepared=faq_future.result())
+        faq_future.cancel()
+        if route_name == 'sql':
+            return sql_chain(query, stream=stream, translated=sql_future.result())
+        sql_future.cancel()
+        return chitchat_chain(query, stream=stream)
+    except Exception as e:
+        sql_future.cancel()
+        if faq_future is not None:
+            faq_future.cancel()
+        message = f"I encountered a slight hiccup: {str(e)}"
+        return as_stream(message) if stream else message
+
+
+async def aask(query, stream=False):
+    """Async version of ask; blocking encoder work runs on the shared worker pool"""
+    start_trace()
+    if SPECULATIVE_ROUTING:
+        return await aask_speculative(query, stream)
+    try:
+        route_name, query_embedding = await run_blocking(route_query, query)
+        if route_name == 'faq':
+            return await afaq_chain(query, query_embedding, stream=stream)
+        elif route_name == 'sql':
+            return await asql_chain(query, stream=stream)
+        else:
+            return await achitchat_chain(query, stream=stream)
+    except Exception as e:
+        message = f"I encountered a slight hiccup: {str(e)}"
+        return aas_stream(message) if stream else message
+
+
+async def aask_speculative(query, stream=False):
+    """Async version of ask_speculative; the losing path's task is cancelled"""
+    sql_task = asyncio.create_task(atranslate_question(query))
+    faq_task = None
+    try:
+        query_embedding = await run_blocking(encode_query, query)
+        faq_task = asyncio.create_task(run_blocking(prepare_answer, query, query_embedding))
+        route_name, ambiguous = await run_blocking(choose_route, query_embedding)
+        if ambiguous:
+            route_name = settle_ambiguous(await faq_task)
+            logger.debug("Ambiguous route settled by FAQ retrieval: %s", route_name)
+
+        if route_name == 'faq':
+            sql_task.cancel()
+            return await afaq_chain(query, query_embedding, stream=stream, prepared=await faq_task)
+        faq_task.cancel()
+        if route_name == 'sql':
+            return await asql_chain(query, stream=stream, translated=await sql_task)
+        sql_task.cancel()
+        return await achitchat_chain(query, stream=stream)
+    except Exception as e:
+        message = f"I encountered a slight hiccup: {str(e)}"
+        return aas_stream(message) if stream else message
+    finally:
+        for task in (sql_task, faq_task):
+            if task is not None and not task.done():
+                task.cancel()
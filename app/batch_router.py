@@ -0,0 +1,132 @@
+"""
+Batched routing for log replay and offline evaluation.
+
+    python app/batch_router.py eval app/resources/routing_eval.csv
+    python app/batch_router.py replay queries.txt --output routed.csv
+
+eval reads a CSV with query and route columns and prints a confusion matrix,
+accuracy and throughput. replay routes one query per line of a text file.
+"""
+import sys
+import csv
+import time
+import argparse
+import numpy as np
+import embeddings
+from router import get_router, get_route_index
+
+NO_ROUTE = 'none'
+
+
+def route_batch(queries, batch_size=64, top_k=5, threshold=None):
+    """Route many queries at once, as the semantic router would route each one
+
+    Queries are encoded batch_size at a time and each batch is scored against
+    all route utterances with a single matrix multiply, then aggregated the
+    way SemanticRouter does (route_index.router_scores). Returns one dict per
+    query with the route name (None if it does not pass its threshold), its
+    score (the router's similarity_score) and the margin of its mean over the
+    runner-up route. threshold overrides every route's score threshold.
+    """
+    index = get_route_index()
+    router = get_router()
+    route_thresholds = {
+        route.name: router.score_threshold if route.score_threshold is None else route.score_threshold
+        for route in router.routes
+    }
+    thresholds = np.array([
+        route_thresholds[route.name] if threshold is None else threshold
+        for route in index.routes
+    ])
+    results = []
+    for start in range(0, len(queries), batch_size):
+        batch = queries[start:start + batch_size]
+        names, means, maxima = index.router_scores(embeddings.encode(batch, batch_size=batch_size), top_k)
+        ranked = np.where(np.isnan(means), -np.inf, means)
+        order = np.argsort(-ranked, axis=1, kind='stable')
+        for i in range(len(batch)):
+            best = order[i, 0]
+            runner_up = ranked[i, order[i, 1]] if ranked.shape[1] > 1 else -np.inf
+            score = float(maxima[i, best])
+            results.append({
+                'query': batch[i],
+                'route': names[best] if score > thresholds[best] else None,
+                'score': score,
+                'margin': float(ranked[i, best] - runner_up) if np.isfinite(runner_up) else float(ranked[i, best]),
+            })
+    return results
+
+
+def confusion_matrix(expected, predicted):
+    labels = sorted(set(expected) | set(predicted))
+    index = {label: i for i, label in enumerate(labels)}
+    matrix = np.zeros((len(labels), len(labels)), dtype=int)
+    for e, p in zip(expected, predicted):
+        matrix[index[e], index[p]] += 1
+    return labels, matrix
+
+
+def print_confusion_matrix(labels, matrix):
+    width = max(len(label) for label in labels + ['expected'])
+    print(f"{'expected':<{width}} | " + " ".join(f"{label:>{width}}" for label in labels))
+    for label, row in zip(labels, matrix):
+        print(f"{label:<{width}} | " + " ".join(f"{count:>{width}}" for count in row))
+
+
+def evaluate(path, batch_size, top_k):
+    with open(path, newline='', encoding='utf-8') as f:
+        rows = list(csv.DictReader(f))
+    queries = [row['query'] for row in rows]
+    expected = [row['route'] or NO_ROUTE for row in rows]
+
+    start = time.perf_counter()
+    results = route_batch(queries, batch_size=batch_size, top_k=top_k)
+    elapsed = time.perf_counter() - start
+
+    predicted = [r['route'] or NO_ROUTE for r in results]
+    labels, matrix = confusion_matrix(expected, predicted)
+    print_confusion_matrix(labels, matrix)
+    correct = sum(e == p for e, p in zip(expected, predicted))
+    print(f"\nAccuracy: {correct}/{len(rows)} ({correct / max(len(rows), 1):.1%})")
+    print(f"Throughput: {len(rows) / elapsed:.1f} queries/s ({elapsed:.2f}s, batch size {batch_size})")
+
+    misses = [(r, e) for r, e in zip(results, expected) if (r['route'] or NO_ROUTE) != e]
+    if misses:
+        print("\nMisrouted:")
+        for r, e in misses:
+            print(f"  expected {e}, got {r['route'] or NO_ROUTE} "
+                  f"(score {r['score']:.3f}, margin {r['margin']:.3f}): {r['query']}")
+
+
+def replay(path, batch_size, top_k, output=None):
+    with open(path, encoding='utf-8') as f:
+        queries = [line.strip() for line in f if line.strip()]
+
+    start = time.perf_counter()
+    results = route_batch(queries, batch_size=batch_size, top_k=top_k)
+    elapsed = time.perf_counter() - start
+
+    out = open(output, 'w', newline='', encoding='utf-8') if output else sys.stdout
+    writer = csv.writer(out)
+    writer.writerow(['query', 'route', 'score', 'margin'])
+    for r in results:
+        writer.writerow([r['query'], r['route'] or NO_ROUTE, f"{r['score']:.4f}", f"{r['margin']:.4f}"])
+    if output:
+        out.close()
+    print(f"Routed {len(queries)} queries in {elapsed:.2f}s ({len(queries) / elapsed:.1f} queries/s)",
+          file=sys.stderr)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Batched routing: offline evaluation and log replay")
+    parser.add_argument('command', choices=['eval', 'replay'])
+    parser.add_argument('path', help="labelled CSV (query,route) for eval, one query per line for replay")
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--output', help="replay: write CSV here instead of stdout")
+    args = parser.parse_args()
+
+    if args.command == 'eval':
+        evaluate(args.path, args.batch_size, args.top_k)
+    else:
+        replay(args.path, args.batch_size, args.top_k, args.output)
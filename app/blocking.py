@@ -0,0 +1,26 @@
+import os
+import asyncio
+import functools
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Bounded pool for encoder, Chroma and SQLite work called from async code
+executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv('BLOCKING_WORKERS', '8')),
+    thread_name_prefix='blocking'
+)
+
+
+def submit(fn, *args, **kwargs):
+    """executor.submit() in a copy of the caller's context, so spans keep the request's trace id"""
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+async def run_blocking(fn, *args, **kwargs):
+    """Run a blocking call on the shared worker pool without stalling the event loop"""
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(executor, functools.partial(context.run, fn, *args, **kwargs))
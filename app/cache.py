@@ -0,0 +1,197 @@
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import numpy as np
+from pathlib import Path
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Thread-safe exact-match cache with LRU eviction and an optional TTL"""
+
+    def __init__(self, max_size=256, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (value, stored_at)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached value for key, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl is not None and time.monotonic() - entry[1] > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+class SemanticCache:
+    """Answer cache keyed on query embeddings
+
+    A lookup hits when a stored entry was retrieved with the same set of
+    document ids and its query vector has cosine similarity >= threshold.
+    Entries are evicted least-recently-used once max_size is reached, and
+    expire ttl seconds after they were stored.
+    """
+
+    def __init__(self, threshold=0.9, max_size=512, ttl=3600):
+        self.threshold = threshold
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (vector, doc_ids, answer, stored_at)
+        self._next_key = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _expire(self, now):
+        expired = [k for k, (_, _, _, stored_at) in self._entries.items() if now - stored_at > self.ttl]
+        for key in expired:
+            del self._entries[key]
+
+    def get(self, vector, doc_ids):
+        """Return a cached answer for a similar query with the same retrieved ids, or None"""
+        doc_ids = frozenset(doc_ids)
+        vector = self._normalize(vector)
+        with self._lock:
+            self._expire(time.monotonic())
+            keys = [k for k, entry in self._entries.items() if entry[1] == doc_ids]
+            if keys:
+                scores = np.stack([self._entries[k][0] for k in keys]) @ vector
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    self._entries.move_to_end(keys[best])
+                    self.hits += 1
+                    return self._entries[keys[best]][2]
+            self.misses += 1
+            return None
+
+    def put(self, vector, doc_ids, answer):
+        with self._lock:
+            self._entries[self._next_key] = (self._normalize(vector), frozenset(doc_ids), answer, time.monotonic())
+            self._next_key += 1
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+class CompletionCache:
+    """Exact-match LLM completion cache stored in a SQLite file
+
+    Entries are keyed by a hash of the whole request (model, messages,
+    temperature, max_tokens, ...), so every process that opens the same
+    path shares them. Beyond max_entries the least recently used entries
+    are evicted.
+    """
+
+    # Reads refresh last_used at most this often, so hot entries rarely cost a write
+    TOUCH_INTERVAL = 60
+    EVICT_EVERY = 100
+
+    def __init__(self, path, max_entries=20000):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("""CREATE TABLE IF NOT EXISTS completion (
+                key TEXT PRIMARY KEY,
+                model TEXT,
+                content TEXT,
+                created REAL,
+                last_used REAL
+            ) WITHOUT ROWID""")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_completion_last_used ON completion(last_used)")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def key(request):
+        """Content hash of a chat completion request"""
+        canonical = json.dumps(request, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Return the cached completion text for key, or None"""
+        conn = self._connection()
+        row = conn.execute("SELECT content, last_used FROM completion WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        now = time.time()
+        if now - row[1] > self.TOUCH_INTERVAL:
+            conn.execute("UPDATE completion SET last_used = ? WHERE key = ?", (now, key))
+        self.hits += 1
+        return row[0]
+
+    def put(self, key, model, content):
+        now = time.time()
+        conn = self._connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO completion (key, model, content, created, last_used) VALUES (?, ?, ?, ?, ?)",
+            (key, model, content, now, now)
+        )
+        self._puts += 1
+        if self._puts % self.EVICT_EVERY == 1:
+            self.evict()
+
+    def evict(self):
+        """Delete the least recently used entries beyond max_entries"""
+        conn = self._connection()
+        excess = conn.execute("SELECT COUNT(*) FROM completion").fetchone()[0] - self.max_entries
+        if excess > 0:
+            conn.execute("""DELETE FROM completion WHERE key IN
+                            (SELECT key FROM completion ORDER BY last_used LIMIT ?)""", (excess,))
+
+    def clear(self):
+        self._connection().execute("DELETE FROM completion")
+
+    def stats(self):
+        size = self._connection().execute("SELECT COUNT(*) FROM completion").fetchone()[0]
+        return {'size': size, 'hits': self.hits, 'misses': self.misses}
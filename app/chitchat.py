@@ -1,11 +1,15 @@
 import os
-from groq import Groq
 from dotenv import load_dotenv
-from datetime import datetime
+from datetime import datetime, timedelta
+from llm import complete, acomplete, stream_text, as_stream, astream_text, aas_stream
+from singleflight import coalesce
+from telemetry import span, record_usage
 
 load_dotenv()
 
-groq_client = Groq(api_key=os.getenv('GROQ_API_KEY'))
+# The time in the prompt is rounded down to this many minutes, so repeated
+# chitchat within a bucket sends an identical request and hits the LLM cache
+TIME_BUCKET_MINUTES = int(os.getenv('CHITCHAT_TIME_BUCKET_MINUTES', '10'))
 
 chitchat_system_prompt = """You are a friendly and helpful e-commerce shopping assistant. You can:
 
@@ -27,8 +31,12 @@ Remember: You're part of an e-commerce platform, so stay relevant to shopping an
 
 
 def get_current_datetime_info():
-    """Get current date and time information"""
+    """Get current date and time information, with the time rounded down to TIME_BUCKET_MINUTES"""
     now = datetime.now()
+    minutes = now.hour * 60 + now.minute
+    now = now.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(
+        minutes=minutes - minutes % max(TIME_BUCKET_MINUTES, 1)
+    )
     return {
         'date': now.strftime('%A, %B %d, %Y'),
         'time': now.strftime('%I:%M %p'),
@@ -36,35 +44,70 @@ def get_current_datetime_info():
     }
 
 
-def chitchat_chain(query):
+def chitchat_error_message(e):
+    return f"I'm sorry, I encountered an error: {str(e)}. Please try asking something else!"
+
+
+def chitchat_request(query):
+    """Groq chat completion arguments for a chitchat query"""
+    # Add current datetime context
+    datetime_info = get_current_datetime_info()
+    context_note = f"\n\nCurrent date and time: {datetime_info['date']}, around {datetime_info['time']}"
+
+    return dict(
+        model=os.getenv('GROQ_MODEL', 'llama-3.3-70b-versatile'),
+        messages=[
+            {
+                'role': 'system',
+                'content': chitchat_system_prompt + context_note
+            },
+            {
+                'role': 'user',
+                'content': query
+            }
+        ],
+        temperature=0.7,  # Slightly higher for more natural conversation
+        max_tokens=500
+    )
+
+
+@coalesce('chitchat')
+def chitchat_chain(query, stream=False):
     """
     Handle chitchat queries using Groq LLM
+
+    With stream=True, returns a generator of text chunks as they arrive.
     """
-    # Add current datetime context
-    datetime_info = get_current_datetime_info()
-    context_note = f"\n\nCurrent date and time: {datetime_info['date']}, {datetime_info['time']}"
-    
     try:
-        completion = groq_client.chat.completions.create(
-            model=os.getenv('GROQ_MODEL', 'llama-3.3-70b-versatile'),
-            messages=[
-                {
-                    'role': 'system',
-                    'content': chitchat_system_prompt + context_note
-                },
-                {
-                    'role': 'user',
-                    'content': query
-                }
-            ],
-            temperature=0.7,  # Slightly higher for more natural conversation
-            max_tokens=500
-        )
+        with span('chitchat.llm', stream=stream):
+            # Greetings and small talk repeat a lot; the same request within a time bucket reuses the answer
+            completion = complete(chitchat_request(query), 'chitchat.llm', stream, cache=True)
         
+        if stream:
+            return stream_text(completion, chitchat_error_message, stage='chitchat.llm')
+        record_usage('chitchat.llm', completion.usage)
         return completion.choices[0].message.content
     
     except Exception as e:
-        return f"I'm sorry, I encountered an error: {str(e)}. Please try asking something else!"
+        message = chitchat_error_message(e)
+        return as_stream(message) if stream else message
+
+
+@coalesce('chitchat')
+async def achitchat_chain(query, stream=False):
+    """Async version of chitchat_chain using the async Groq client"""
+    try:
+        with span('chitchat.llm', stream=stream):
+            completion = await acomplete(chitchat_request(query), 'chitchat.llm', stream, cache=True)
+
+        if stream:
+            return astream_text(completion, chitchat_error_message, stage='chitchat.llm')
+        record_usage('chitchat.llm', completion.usage)
+        return completion.choices[0].message.content
+
+    except Exception as e:
+        message = chitchat_error_message(e)
+        return aas_stream(message) if stream else message
 
 
 if __name__ == '__main__':
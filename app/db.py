@@ -0,0 +1,159 @@
+import os
+import queue
+import sqlite3
+import threading
+from pathlib import Path
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+class ConnectionPool:
+    """Small thread-safe pool of read-only SQLite connections
+
+    Connections are opened with a mode=ro URI and query_only, so nothing
+    served from the pool can write. They are created lazily up to size and
+    handed out one thread at a time.
+    """
+
+    def __init__(self, path, size=4, cache_size_kb=16384, mmap_size=256 * 1024 * 1024,
+                 cached_statements=256, timeout=30.0):
+        self.path = Path(path)
+        self.size = size
+        self.cache_size_kb = cache_size_kb
+        self.mmap_size = mmap_size
+        self.cached_statements = cached_statements
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        uri = f"{self.path.resolve().as_uri()}?mode=ro"
+        conn = sqlite3.connect(
+            uri,
+            uri=True,
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+            timeout=self.timeout
+        )
+        conn.execute("PRAGMA query_only = ON")
+        conn.execute(f"PRAGMA cache_size = -{int(self.cache_size_kb)}")
+        conn.execute(f"PRAGMA mmap_size = {int(self.mmap_size)}")
+        return conn
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                try:
+                    return self._connect()
+                except Exception:
+                    self._created -= 1
+                    raise
+        return self._idle.get(timeout=self.timeout)
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection for the duration of a with block"""
+        conn = self._acquire()
+        try:
+            yield conn
+        except sqlite3.DatabaseError:
+            # Don't hand a possibly broken connection to the next caller
+            conn.close()
+            with self._lock:
+                self._created -= 1
+            raise
+        except BaseException:
+            self._release(conn)
+            raise
+        else:
+            self._release(conn)
+
+    def _release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    def close_all(self):
+        """Close idle connections, e.g. after the database file was replaced"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+
+class QueryResult:
+    """Rows of a query: sqlite3.Row objects, indexable by position or column name
+
+    complete is False when the query matched more rows than were fetched.
+    """
+    __slots__ = ('columns', 'rows', 'complete')
+
+    def __init__(self, columns, rows, complete=True):
+        self.columns = columns
+        self.rows = rows
+        self.complete = complete
+
+    def __len__(self):
+        return len(self.rows)
+
+    def records(self):
+        """Rows as a list of dicts"""
+        return [dict(zip(self.columns, row)) for row in self.rows]
+
+    def to_dataframe(self):
+        """Rows as a pandas DataFrame; pandas is only imported here"""
+        import pandas as pd
+        return pd.DataFrame.from_records([tuple(row) for row in self.rows], columns=list(self.columns))
+
+
+FETCH_BATCH = 64
+
+
+def fetch(conn, query, params=(), max_rows=None):
+    """Run query on conn and fetch at most max_rows rows, in batches
+
+    One row past max_rows is read to tell whether more matched; the cursor
+    is closed without reading the rest.
+    """
+    cursor = conn.cursor()
+    cursor.row_factory = sqlite3.Row
+    try:
+        cursor.execute(query, tuple(params))
+        columns = tuple(d[0] for d in cursor.description or ())
+        rows = []
+        while max_rows is None or len(rows) <= max_rows:
+            wanted = FETCH_BATCH if max_rows is None else min(FETCH_BATCH, max_rows + 1 - len(rows))
+            batch = cursor.fetchmany(wanted)
+            if not batch:
+                break
+            rows.extend(batch)
+    finally:
+        cursor.close()
+    if max_rows is not None and len(rows) > max_rows:
+        return QueryResult(columns, rows[:max_rows], complete=False)
+    return QueryResult(columns, rows)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(path):
+    """Process-wide pool for a database file"""
+    key = str(Path(path).resolve())
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(path, size=int(os.getenv('SQL_POOL_SIZE', '4')))
+        return _pools[key]
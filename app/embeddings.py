@@ -0,0 +1,123 @@
+import os
+import platform
+import numpy as np
+from pathlib import Path
+from dotenv import load_dotenv
+import registry
+
+load_dotenv()
+
+MODEL_NAME = os.getenv('EMBEDDING_MODEL', 'sentence-transformers/all-MiniLM-L6-v2')
+# 'torch' runs the model through sentence-transformers; 'onnx' runs an int8-quantized
+# ONNX export with ONNX Runtime, without importing torch
+BACKEND = os.getenv('EMBEDDING_BACKEND', 'torch')
+# Quantized exports published with the model on the Hugging Face hub; a local .onnx path also works
+ONNX_MODEL_FILE = os.getenv(
+    'ONNX_MODEL_FILE',
+    'onnx/model_qint8_arm64.onnx' if platform.machine().lower() in ('arm64', 'aarch64')
+    else 'onnx/model_quint8_avx2.onnx'
+)
+ONNX_THREADS = int(os.getenv('ONNX_THREADS', '0'))  # 0 lets ONNX Runtime decide
+MAX_SEQ_LENGTH = 256  # sentence-transformers' limit for all-MiniLM-L6-v2
+
+
+class TorchBackend:
+    """Full-precision sentence-transformers model"""
+
+    def __init__(self, model_name=MODEL_NAME):
+        # torch and sentence-transformers are only imported when the model is first needed
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_name)
+
+    def encode(self, texts, batch_size=32):
+        return self.model.encode(
+            list(texts),
+            batch_size=batch_size,
+            convert_to_numpy=True,
+            show_progress_bar=False
+        )
+
+
+class OnnxBackend:
+    """Quantized ONNX export of the model run with ONNX Runtime
+
+    Reproduces the sentence-transformers pipeline for MiniLM: tokenize,
+    transformer, mean pooling over the attention mask, L2 normalization.
+    """
+
+    def __init__(self, model_name=MODEL_NAME, model_file=ONNX_MODEL_FILE):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+        from huggingface_hub import hf_hub_download
+
+        model_path = model_file if Path(model_file).is_file() else hf_hub_download(model_name, model_file)
+        self.tokenizer = Tokenizer.from_file(hf_hub_download(model_name, 'tokenizer.json'))
+        self.tokenizer.enable_truncation(max_length=MAX_SEQ_LENGTH)
+        pad_id = self.tokenizer.token_to_id('[PAD]') or 0
+        self.tokenizer.enable_padding(pad_id=pad_id, pad_token='[PAD]')
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if ONNX_THREADS:
+            options.intra_op_num_threads = ONNX_THREADS
+        self.session = ort.InferenceSession(model_path, options, providers=['CPUExecutionProvider'])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    def encode(self, texts, batch_size=32):
+        texts = list(texts)
+        out = []
+        for start in range(0, len(texts), batch_size):
+            encodings = self.tokenizer.encode_batch(texts[start:start + batch_size])
+            input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+            mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+            feeds = {'input_ids': input_ids, 'attention_mask': mask}
+            if 'token_type_ids' in self.input_names:
+                feeds['token_type_ids'] = np.array([e.type_ids for e in encodings], dtype=np.int64)
+            hidden = self.session.run(None, feeds)[0]
+
+            weights = mask[:, :, None].astype(np.float32)
+            pooled = (hidden * weights).sum(axis=1) / np.clip(weights.sum(axis=1), 1e-9, None)
+            pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            out.append(pooled)
+        return np.vstack(out)
+
+
+BACKENDS = {'torch': TorchBackend, 'onnx': OnnxBackend}
+
+
+def load_backend(name=BACKEND):
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown EMBEDDING_BACKEND {name!r}; expected one of {', '.join(BACKENDS)}")
+    return BACKENDS[name]()
+
+
+def get_model():
+    """Load the configured embedding backend once per process"""
+    return registry.get('embedding_model', load_backend)
+
+
+def encoder_id():
+    """Identifies the vectors the configured backend produces, for on-disk vector caches"""
+    if BACKEND == 'torch':
+        return MODEL_NAME
+    if BACKEND == 'onnx':
+        return f"{MODEL_NAME}-onnx-{Path(ONNX_MODEL_FILE).stem}"
+    return f"{MODEL_NAME}-{BACKEND}"
+
+
+def encode(texts, batch_size=32):
+    """Encode a list of texts into a float32 matrix, one row per text"""
+    if len(texts) == 0:
+        return np.zeros((0, 0), dtype=np.float32)
+    vectors = get_model().encode(texts, batch_size=batch_size)
+    return vectors.astype(np.float32, copy=False)
+
+
+def encode_query(query):
+    """Encode a single query; the result is reused for routing and retrieval"""
+    return encode([query])[0].tolist()
+
+
+if __name__ == '__main__':
+    vector = encode_query("Is cash on delivery available?")
+    print(f"{encoder_id()} ({BACKEND}): {len(vector)} dimensions")
@@ -1,62 +1,137 @@
 import os
-import chromadb
-from chromadb.utils import embedding_functions
-from groq import Groq
-import pandas as pd
+import csv
+import hashlib
 from dotenv import load_dotenv
 from pathlib import Path
+import embeddings
+import registry
+from cache import SemanticCache
+from llm import complete, acomplete, stream_text, as_stream, astream_text, aas_stream
+from blocking import run_blocking
+from singleflight import coalesce
+from telemetry import logger, span, record_usage, record_cache
 
 load_dotenv()
 
 faqs_path = Path(__file__).parent / "resources/faq_data.csv"
 
-ef = embedding_functions.SentenceTransformerEmbeddingFunction(
-    model_name='sentence-transformers/all-MiniLM-L6-v2'
+
+chroma_path = Path(os.getenv('CHROMA_PATH', Path(__file__).parent / ".cache/chroma"))
+
+# Vectors from different embedding backends are not interchangeable, so each gets its own collection
+collection_name_faq = 'faqs' if embeddings.BACKEND == 'torch' else f'faqs_{embeddings.BACKEND}'
+ingest_batch_size = 1000
+
+answer_cache = SemanticCache(
+    threshold=float(os.getenv('FAQ_CACHE_THRESHOLD', '0.9')),
+    max_size=int(os.getenv('FAQ_CACHE_SIZE', '512')),
+    ttl=float(os.getenv('FAQ_CACHE_TTL', '3600'))
 )
 
-chroma_client = chromadb.Client()
-groq_client = Groq(api_key=os.getenv('GROQ_API_KEY'))
 
-collection_name_faq = 'faqs'
+def faq_id(question, answer):
+    """Content-hashed id, so an edited row gets a new id"""
+    digest = hashlib.sha256(f"{question}\x1f{answer}".encode('utf-8')).hexdigest()
+    return f"faq_{digest[:32]}"
+
+
+def _build_chroma():
+    # chromadb is only imported when the FAQ store is first needed
+    import chromadb
+    from chromadb.api.types import Documents, EmbeddingFunction, Embeddings
+
+    class SharedEmbeddingFunction(EmbeddingFunction[Documents]):
+        """Chroma embedding function backed by the process-wide embedding model"""
+
+        def __call__(self, input: Documents) -> Embeddings:
+            return embeddings.encode(input).tolist()
+
+    return chromadb.PersistentClient(path=str(chroma_path)), SharedEmbeddingFunction()
+
+
+def get_chroma():
+    """(client, embedding function) for the persistent ChromaDB store, created once per process"""
+    return registry.get('chroma', _build_chroma)
+
+
+def open_collection():
+    chroma_client, ef = get_chroma()
+    return chroma_client.get_or_create_collection(
+        name=collection_name_faq,
+        embedding_function=ef,
+        metadata={'hnsw:space': 'cosine'}
+    )
+
+
+def _build_collection():
+    ingest_faq_data(faqs_path)
+    return open_collection()
+
+
+def get_collection():
+    """The FAQ collection, synced with faq_data.csv once per process (on first use or at warm-up)"""
+    return registry.get('faq_collection', _build_collection)
 
 
 def ingest_faq_data(path):
-    """Ingest FAQ data into ChromaDB"""
-    if collection_name_faq not in [c.name for c in chroma_client.list_collections()]:
-        print("Ingesting FAQ data into Chromadb...")
-        collection = chroma_client.create_collection(
-            name=collection_name_faq,
-            embedding_function=ef
-        )
-        df = pd.read_csv(path)
-        docs = df['question'].to_list()
-        metadata = [{'answer': ans} for ans in df['answer'].to_list()]
-        ids = [f"id_{i}" for i in range(len(docs))]
+    """Sync FAQ data into the persistent ChromaDB collection
+
+    Only rows that are new or changed since the last ingest are embedded;
+    rows no longer present in the CSV are deleted. Returns True if the
+    collection was modified, in which case cached answers are dropped.
+    """
+    collection = open_collection()
+    rows = {}
+    with open(path, newline='', encoding='utf-8') as f:
+        for record in csv.DictReader(f):
+            question, answer = record['question'], record['answer']
+            rows.setdefault(faq_id(question, answer), (question, answer))
+
+    stored_ids = set(collection.get(include=[])['ids'])
+    new_ids = [i for i in rows if i not in stored_ids]
+    removed_ids = [i for i in stored_ids if i not in rows]
+
+    if not new_ids and not removed_ids:
+        print(f"Collection: {collection_name_faq} is up to date ({len(rows)} rows)")
+        return False
+
+    print(f"Syncing FAQ data into Chromadb: {len(new_ids)} new/changed, {len(removed_ids)} removed...")
+    for start in range(0, len(removed_ids), ingest_batch_size):
+        collection.delete(ids=removed_ids[start:start + ingest_batch_size])
+    for start in range(0, len(new_ids), ingest_batch_size):
+        batch = new_ids[start:start + ingest_batch_size]
+        docs = [rows[i][0] for i in batch]
         collection.add(
             documents=docs,
-            metadatas=metadata,
-            ids=ids
+            embeddings=embeddings.encode(docs).tolist(),
+            metadatas=[{'answer': rows[i][1]} for i in batch],
+            ids=batch
         )
-        print(f"FAQ Data successfully ingested into Chroma collection: {collection_name_faq}")
-    else:
-        print(f"Collection: {collection_name_faq} already exists")
+    answer_cache.clear()
+    print(f"FAQ Data successfully synced into Chroma collection: {collection_name_faq}")
+    return True
 
 
-def get_relevant_qa(query):
-    """Retrieve relevant Q&A from ChromaDB"""
-    collection = chroma_client.get_collection(
-        name=collection_name_faq,
-        embedding_function=ef
-    )
-    result = collection.query(
-        query_texts=[query],
-        n_results=3  # Increased from 2 to 3 for better context
-    )
+def get_relevant_qa(query, query_embedding=None):
+    """Retrieve relevant Q&A from ChromaDB
+
+    Pass query_embedding when the query has already been encoded (e.g. for
+    routing) so it is not encoded a second time.
+    """
+    collection = get_collection()
+    if query_embedding is None:
+        query_embedding = embeddings.encode_query(query)
+    with span('faq.retrieve') as record:
+        result = collection.query(
+            query_embeddings=[query_embedding],
+            n_results=3  # Increased from 2 to 3 for better context
+        )
+        record['rows'] = len(result['ids'][0]) if result['ids'] else 0
     return result
 
 
-def generate_answer(query, context):
-    """Generate answer using Groq LLM based on context"""
+def answer_request(query, context):
+    """Groq chat completion arguments for an answer grounded in context"""
     prompt = f'''You are a helpful e-commerce customer service assistant. Answer the question based ONLY on the provided context.
 
 CONTEXT: {context}
@@ -71,47 +146,171 @@ INSTRUCTIONS:
 - Keep answers brief (2-4 sentences)
 '''
     
+    return dict(
+        model=os.getenv('GROQ_MODEL', 'llama-3.3-70b-versatile'),
+        messages=[
+            {
+                'role': 'system',
+                'content': 'You are a helpful e-commerce customer service assistant.'
+            },
+            {
+                'role': 'user',
+                'content': prompt
+            }
+        ],
+        temperature=0.3,  # Lower temperature for more focused answers
+        max_tokens=3000
+    )
+
+
+def _complete_answer(query, context, stream=False, on_error=None):
+    """Call the Groq LLM for an answer grounded in context; raises on failure
+
+    With stream=True, returns a generator of text chunks instead of a string.
+    """
+    with span('faq.llm', stream=stream):
+        completion = complete(answer_request(query, context), 'faq.llm', stream, cache=True)
+    if stream:
+        return stream_text(completion, on_error, stage='faq.llm')
+    record_usage('faq.llm', completion.usage)
+    return completion.choices[0].message.content
+
+
+async def _acomplete_answer(query, context, stream=False, on_error=None):
+    """Async version of _complete_answer"""
+    with span('faq.llm', stream=stream):
+        completion = await acomplete(answer_request(query, context), 'faq.llm', stream, cache=True)
+    if stream:
+        return astream_text(completion, on_error, stage='faq.llm')
+    record_usage('faq.llm', completion.usage)
+    return completion.choices[0].message.content
+
+
+def answer_error_message(e):
+    return f"I apologize, but I encountered an error: {str(e)}. Please try asking again."
+
+
+def generate_answer(query, context, stream=False):
+    """Generate answer using Groq LLM based on context"""
     try:
-        completion = groq_client.chat.completions.create(
-            model=os.getenv('GROQ_MODEL', 'llama-3.3-70b-versatile'),
-            messages=[
-                {
-                    'role': 'system',
-                    'content': 'You are a helpful e-commerce customer service assistant.'
-                },
-                {
-                    'role': 'user',
-                    'content': prompt
-                }
-            ],
-            temperature=0.3,  # Lower temperature for more focused answers
-            max_tokens=3000
-        )
-        return completion.choices[0].message.content
-    
+        return _complete_answer(query, context, stream, on_error=answer_error_message)
+    except Exception as e:
+        return as_stream(answer_error_message(e)) if stream else answer_error_message(e)
+
+
+def _stream_and_cache(chunks, query_embedding, doc_ids):
+    """Pass an answer stream through, caching the full answer if it completes"""
+    parts = []
+    try:
+        for chunk in chunks:
+            parts.append(chunk)
+            yield chunk
+    except Exception as e:
+        yield answer_error_message(e)
+        return
+    answer_cache.put(query_embedding, doc_ids, "".join(parts))
+
+
+async def _astream_and_cache(chunks, query_embedding, doc_ids):
+    """Async version of _stream_and_cache"""
+    parts = []
+    try:
+        async for chunk in chunks:
+            parts.append(chunk)
+            yield chunk
     except Exception as e:
-        return f"I apologize, but I encountered an error: {str(e)}. Please try asking again."
+        yield answer_error_message(e)
+        return
+    answer_cache.put(query_embedding, doc_ids, "".join(parts))
 
 
-def faq_chain(query):
-    """Main FAQ chain: retrieve context and generate answer"""
+no_context_message = "I don't have specific information about that. Please contact our support team or try rephrasing your question."
+unavailable_message = "I apologize, but I'm having trouble accessing FAQ information right now. Please try again."
+
+
+def prepare_answer(query, query_embedding=None):
+    """Retrieval half of the FAQ chain
+
+    Returns (query_embedding, context, doc_ids, cached_answer, distance);
+    context is None when nothing relevant was retrieved, and distance is the
+    cosine distance of the closest FAQ.
+    """
+    if query_embedding is None:
+        query_embedding = embeddings.encode_query(query)
+    result = get_relevant_qa(query, query_embedding)
+
+    # Extract context from metadata
+    if result and result['metadatas'] and len(result['metadatas'][0]) > 0:
+        context = " ".join([r.get('answer', '') for r in result['metadatas'][0]])
+        logger.debug("FAQ context found: %s...", context[:100])
+    else:
+        logger.debug("No FAQ context found")
+        return query_embedding, None, [], None, None
+
+    # Paraphrases of an answered question that retrieve the same FAQs reuse its answer
+    doc_ids = result['ids'][0]
+    answer = answer_cache.get(query_embedding, doc_ids)
+    record_cache('faq_answer', answer is not None)
+    distance = result['distances'][0][0] if result.get('distances') else None
+    return query_embedding, context, doc_ids, answer, distance
+
+
+@coalesce('faq')
+def faq_chain(query, query_embedding=None, stream=False, prepared=None):
+    """Main FAQ chain: retrieve context and generate answer
+
+    With stream=True, returns a generator of text chunks. prepared is an
+    optional prepare_answer() result computed ahead of time.
+    """
+    reply = as_stream if stream else str
     try:
-        result = get_relevant_qa(query)
-        
-        # Extract context from metadata
-        if result and result['metadatas'] and len(result['metadatas'][0]) > 0:
-            context = " ".join([r.get('answer', '') for r in result['metadatas'][0]])
-            print(f"[DEBUG] FAQ Context found: {context[:100]}...")
-        else:
-            print("[DEBUG] No FAQ context found")
-            return "I don't have specific information about that. Please contact our support team or try rephrasing your question."
-        
-        answer = generate_answer(query, context)
+        if prepared is None:
+            prepared = prepare_answer(query, query_embedding)
+        query_embedding, context, doc_ids, answer, _ = prepared
+        if context is None:
+            return reply(no_context_message)
+        if answer is not None:
+            return reply(answer)
+
+        try:
+            answer = _complete_answer(query, context, stream)
+        except Exception as e:
+            return reply(answer_error_message(e))
+        if stream:
+            return _stream_and_cache(answer, query_embedding, doc_ids)
+        answer_cache.put(query_embedding, doc_ids, answer)
         return answer
     
     except Exception as e:
-        print(f"[ERROR] FAQ chain error: {str(e)}")
-        return "I apologize, but I'm having trouble accessing FAQ information right now. Please try again."
+        logger.error("FAQ chain error: %s", e)
+        return reply(unavailable_message)
+
+
+@coalesce('faq')
+async def afaq_chain(query, query_embedding=None, stream=False, prepared=None):
+    """Async version of faq_chain; encoding and retrieval run on the blocking pool"""
+    reply = aas_stream if stream else str
+    try:
+        if prepared is None:
+            prepared = await run_blocking(prepare_answer, query, query_embedding)
+        query_embedding, context, doc_ids, answer, _ = prepared
+        if context is None:
+            return reply(no_context_message)
+        if answer is not None:
+            return reply(answer)
+
+        try:
+            answer = await _acomplete_answer(query, context, stream)
+        except Exception as e:
+            return reply(answer_error_message(e))
+        if stream:
+            return _astream_and_cache(answer, query_embedding, doc_ids)
+        answer_cache.put(query_embedding, doc_ids, answer)
+        return answer
+
+    except Exception as e:
+        logger.error("FAQ chain error: %s", e)
+        return reply(unavailable_message)
 
 
 if __name__ == '__main__':
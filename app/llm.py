@@ -0,0 +1,508 @@
+"""
+Gateway for all Groq chat completions.
+
+Every chain calls complete() / acomplete() instead of using a Groq client
+directly. The gateway shares one pooled keep-alive connection pool per
+process and gives each call a deadline (LLM_TIMEOUT). It retries 429, 5xx,
+connection errors and timeouts with exponential backoff and full jitter,
+honouring Retry-After. A circuit breaker fails calls fast while the provider
+keeps failing. With LLM_HEDGE=1, a duplicate request is sent when the first
+has not answered within the recent p95 latency of that stage, and the first
+response wins.
+
+In front of all that sits an exact-match completion cache on disk
+(cache.CompletionCache), shared by every process. It answers repeated
+requests made with temperature 0, or by callers that pass cache=True.
+LLM_CACHE_MODE=record stores every response, and LLM_CACHE_MODE=replay
+serves only from the cache and never calls the provider, for load tests.
+"""
+import os
+import time
+import random
+import asyncio
+import threading
+import contextvars
+from collections import deque
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dotenv import load_dotenv
+import registry
+from cache import CompletionCache
+from blocking import run_blocking
+from telemetry import logger, increment, record_usage, record_cache
+
+load_dotenv()
+
+# Deadline for one call, retries included; a stream must start within it
+TIMEOUT = float(os.getenv('LLM_TIMEOUT', '30'))
+CONNECT_TIMEOUT = float(os.getenv('LLM_CONNECT_TIMEOUT', '5'))
+MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', '3'))
+BACKOFF_BASE = float(os.getenv('LLM_BACKOFF_BASE', '0.25'))
+BACKOFF_MAX = float(os.getenv('LLM_BACKOFF_MAX', '4'))
+POOL_SIZE = int(os.getenv('LLM_POOL_SIZE', '20'))
+KEEPALIVE_EXPIRY = float(os.getenv('LLM_KEEPALIVE_EXPIRY', '60'))
+# Consecutive failed requests that open the breaker, and seconds it stays open
+BREAKER_FAILURES = int(os.getenv('LLM_BREAKER_FAILURES', '5'))
+BREAKER_COOLDOWN = float(os.getenv('LLM_BREAKER_COOLDOWN', '30'))
+HEDGE = os.getenv('LLM_HEDGE', '0') == '1'
+# Latencies kept per stage for the hedge delay; no hedging until HEDGE_MIN_SAMPLES are seen
+HEDGE_WINDOW = 200
+HEDGE_MIN_SAMPLES = int(os.getenv('LLM_HEDGE_MIN_SAMPLES', '20'))
+
+# on: serve and store cacheable requests; off; record: store every response
+# without reading; replay: serve every request from the cache, never calling the API
+CACHE_MODE = os.getenv('LLM_CACHE_MODE', 'on')
+CACHE_PATH = Path(os.getenv('LLM_CACHE_PATH', Path(__file__).parent / ".cache/llm_completions.sqlite"))
+CACHE_SIZE = int(os.getenv('LLM_CACHE_SIZE', '20000'))
+
+RETRY_STATUS = {408, 409, 429}
+
+
+class LLMUnavailable(Exception):
+    """Raised without calling the provider while the circuit breaker is open"""
+
+
+class ReplayMiss(LookupError):
+    """Raised in replay mode for a request that was never recorded"""
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker
+
+    Opens after `failures` failed requests in a row and rejects calls for
+    `cooldown` seconds. Then one trial request is let through (half-open):
+    success closes the breaker, failure opens it again.
+    """
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, failures=BREAKER_FAILURES, cooldown=BREAKER_COOLDOWN):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self._consecutive = 0
+        self._changed_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _set_state(self, state):
+        if state != self.state:
+            self.state = state
+            increment('shopassist_llm_breaker_transitions_total', state=state)
+            if state == self.OPEN:
+                logger.warning("LLM circuit breaker opened after %d failures", self._consecutive)
+        self._changed_at = time.monotonic()
+
+    def allow(self):
+        """True if a request may be sent now"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            # A trial that never reported back (e.g. a cancelled call) does not block forever
+            if time.monotonic() - self._changed_at >= self.cooldown:
+                self._set_state(self.HALF_OPEN)
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._consecutive = 0
+            self._set_state(self.CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self._consecutive += 1
+            if self.state == self.HALF_OPEN or self._consecutive >= self.failures:
+                self._set_state(self.OPEN)
+
+
+breaker = CircuitBreaker()
+completion_cache = CompletionCache(CACHE_PATH, max_entries=CACHE_SIZE)
+_latencies = {}  # (stage, stream) -> recent successful request latencies
+_hedge_pool = ThreadPoolExecutor(max_workers=POOL_SIZE, thread_name_prefix='llm-hedge')
+
+
+def _build_clients():
+    # The Groq SDK (httpx, pydantic models) is only imported when a client is first needed
+    import httpx
+    from groq import Groq, AsyncGroq, DefaultHttpxClient, DefaultAsyncHttpxClient
+    api_key = os.getenv('GROQ_API_KEY')
+    limits = httpx.Limits(
+        max_connections=POOL_SIZE,
+        max_keepalive_connections=POOL_SIZE,
+        keepalive_expiry=KEEPALIVE_EXPIRY
+    )
+    timeout = httpx.Timeout(TIMEOUT, connect=CONNECT_TIMEOUT)
+    # Retries are done here, not by the SDK, so they share the deadline and the breaker
+    return (
+        Groq(api_key=api_key, max_retries=0, timeout=timeout,
+             http_client=DefaultHttpxClient(limits=limits, timeout=timeout)),
+        AsyncGroq(api_key=api_key, max_retries=0, timeout=timeout,
+                  http_client=DefaultAsyncHttpxClient(limits=limits, timeout=timeout)),
+    )
+
+
+def get_clients():
+    """(Groq, AsyncGroq) clients shared by all chains, created once per process"""
+    return registry.get('llm_clients', _build_clients)
+
+
+def client():
+    return get_clients()[0]
+
+
+def async_client():
+    return get_clients()[1]
+
+
+def _is_retryable(e):
+    from groq import APIConnectionError, APIStatusError
+    if isinstance(e, APIStatusError):
+        return e.status_code in RETRY_STATUS or e.status_code >= 500
+    return isinstance(e, APIConnectionError)  # includes APITimeoutError
+
+
+def _retry_reason(e):
+    return str(getattr(e, 'status_code', None) or type(e).__name__)
+
+
+def backoff_delay(attempt, e=None):
+    """Full-jitter exponential backoff, at least the server's Retry-After if it sent one"""
+    delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+    response = getattr(e, 'response', None)
+    retry_after = response.headers.get('retry-after') if response is not None else None
+    try:
+        delay = max(delay, float(retry_after))
+    except (TypeError, ValueError):
+        pass
+    return delay
+
+
+def _attempt_timeout(deadline):
+    import httpx
+    remaining = max(deadline - time.monotonic(), 0.001)
+    return httpx.Timeout(remaining, connect=min(CONNECT_TIMEOUT, remaining))
+
+
+def _record_latency(stage, stream, seconds):
+    samples = _latencies.get((stage, stream))
+    if samples is None:
+        samples = _latencies.setdefault((stage, stream), deque(maxlen=HEDGE_WINDOW))
+    samples.append(seconds)
+
+
+def hedge_delay(stage, stream=False):
+    """Seconds to wait before hedging a request for stage: its recent p95 latency
+
+    None (no hedge) until HEDGE_MIN_SAMPLES requests have succeeded.
+    """
+    samples = sorted(_latencies.get((stage, stream), ()))
+    if len(samples) < HEDGE_MIN_SAMPLES:
+        return None
+    return samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+
+
+def _should_hedge(stage, stream, hedge):
+    if not (HEDGE if hedge is None else hedge) or breaker.state != CircuitBreaker.CLOSED:
+        return None
+    return hedge_delay(stage, stream)
+
+
+def _record_error(e):
+    if _is_retryable(e):
+        breaker.record_failure()
+    else:
+        breaker.record_success()  # The provider answered; the request itself was bad
+
+
+def _request(request, stream, deadline):
+    """(completion, seconds) for one request to the provider"""
+    start = time.perf_counter()
+    try:
+        result = client().chat.completions.create(**request, stream=stream, timeout=_attempt_timeout(deadline))
+    except Exception as e:
+        _record_error(e)
+        raise
+    breaker.record_success()
+    return result, time.perf_counter() - start
+
+
+def _discard(result):
+    close = getattr(result, 'close', None)
+    if close is not None:
+        close()
+
+
+def _hedged_request(request, stage, stream, deadline, delay):
+    """Send the request, and a duplicate if it has not answered after delay; first success wins"""
+    context = contextvars.copy_context()
+    futures = [_hedge_pool.submit(context.copy().run, _request, request, stream, deadline)]
+    done, _ = wait(futures, timeout=delay)
+    if not done:
+        increment('shopassist_llm_hedges_total', stage=stage)
+        futures.append(_hedge_pool.submit(context.copy().run, _request, request, stream, deadline))
+    error = None
+    pending = futures
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                if len(futures) > 1:
+                    increment('shopassist_llm_hedge_wins_total', stage=stage,
+                              winner='hedge' if future is futures[1] else 'primary')
+                # A duplicate that also succeeds is closed so its connection is released
+                for other in futures:
+                    if other is not future:
+                        other.add_done_callback(lambda f: f.exception() is None and _discard(f.result()[0]))
+                return future.result()
+            error = error or future.exception()
+    raise error
+
+
+def _complete(request, stage, stream, hedge):
+    deadline = time.monotonic() + TIMEOUT
+    attempt = 0
+    while True:
+        if not breaker.allow():
+            increment('shopassist_llm_rejected_total', stage=stage)
+            raise LLMUnavailable("The language model service is temporarily unavailable")
+        delay = _should_hedge(stage, stream, hedge)
+        try:
+            if delay is None:
+                result, seconds = _request(request, stream, deadline)
+            else:
+                result, seconds = _hedged_request(request, stage, stream, deadline, delay)
+            # Only the request that answered counts; a hedged request's slow twin would skew the p95
+            _record_latency(stage, stream, seconds)
+            return result
+        except Exception as e:
+            if not _is_retryable(e) or attempt >= MAX_RETRIES:
+                raise
+            wait_for = backoff_delay(attempt, e)
+            if time.monotonic() + wait_for >= deadline:
+                raise
+            increment('shopassist_llm_retries_total', stage=stage, reason=_retry_reason(e))
+            logger.debug("Retrying %s in %.2fs after %s", stage, wait_for, _retry_reason(e))
+            time.sleep(wait_for)
+            attempt += 1
+
+
+async def _arequest(request, stream, deadline):
+    start = time.perf_counter()
+    try:
+        result = await async_client().chat.completions.create(
+            **request, stream=stream, timeout=_attempt_timeout(deadline)
+        )
+    except Exception as e:
+        _record_error(e)
+        raise
+    breaker.record_success()
+    return result, time.perf_counter() - start
+
+
+async def _adiscard(task):
+    if not task.cancelled() and task.exception() is None:
+        close = getattr(task.result()[0], 'close', None)
+        if close is not None:
+            await close()
+
+
+async def _ahedged_request(request, stage, stream, deadline, delay):
+    """Async version of _hedged_request; the losing request is cancelled"""
+    tasks = [asyncio.create_task(_arequest(request, stream, deadline))]
+    done, _ = await asyncio.wait(tasks, timeout=delay)
+    if not done:
+        increment('shopassist_llm_hedges_total', stage=stage)
+        tasks.append(asyncio.create_task(_arequest(request, stream, deadline)))
+    error = None
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if len(tasks) > 1:
+                        increment('shopassist_llm_hedge_wins_total', stage=stage,
+                                  winner='hedge' if task is tasks[1] else 'primary')
+                    for other in done - {task}:
+                        await _adiscard(other)
+                    return task.result()
+                error = error or task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def _acomplete(request, stage, stream, hedge):
+    deadline = time.monotonic() + TIMEOUT
+    attempt = 0
+    while True:
+        if not breaker.allow():
+            increment('shopassist_llm_rejected_total', stage=stage)
+            raise LLMUnavailable("The language model service is temporarily unavailable")
+        delay = _should_hedge(stage, stream, hedge)
+        try:
+            if delay is None:
+                result, seconds = await _arequest(request, stream, deadline)
+            else:
+                result, seconds = await _ahedged_request(request, stage, stream, deadline, delay)
+            _record_latency(stage, stream, seconds)
+            return result
+        except Exception as e:
+            if not _is_retryable(e) or attempt >= MAX_RETRIES:
+                raise
+            wait_for = backoff_delay(attempt, e)
+            if time.monotonic() + wait_for >= deadline:
+                raise
+            increment('shopassist_llm_retries_total', stage=stage, reason=_retry_reason(e))
+            logger.debug("Retrying %s in %.2fs after %s", stage, wait_for, _retry_reason(e))
+            await asyncio.sleep(wait_for)
+            attempt += 1
+
+
+def _cache_key(request, cache):
+    """Cache key for request, or None if it must not be served from or stored in the cache"""
+    if CACHE_MODE == 'off':
+        return None
+    if CACHE_MODE in ('record', 'replay') or cache or (cache is None and request.get('temperature', 1) == 0):
+        return CompletionCache.key(request)
+    return None
+
+
+def _lookup(key, stage):
+    """Cached text for key; raises ReplayMiss in replay mode when there is none"""
+    if key is None or CACHE_MODE == 'record':
+        return None
+    text = completion_cache.get(key)
+    record_cache('llm_completion', text is not None)
+    if text is None and CACHE_MODE == 'replay':
+        raise ReplayMiss(f"No recorded completion for this {stage} request")
+    return text
+
+
+def _cached_completion(request, text, stream):
+    """A Groq completion (or a one-chunk stream) carrying cached text"""
+    from groq.types.chat import ChatCompletion, ChatCompletionChunk
+    fields = {'id': 'cached', 'created': int(time.time()), 'model': request.get('model', '')}
+    if stream:
+        return ChatCompletionChunk.model_validate({
+            **fields, 'object': 'chat.completion.chunk',
+            'choices': [{'index': 0, 'delta': {'content': text}, 'finish_reason': 'stop'}],
+        })
+    return ChatCompletion.model_validate({
+        **fields, 'object': 'chat.completion',
+        'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': text}, 'finish_reason': 'stop'}],
+    })
+
+
+def _chunk_text(chunk):
+    return chunk.choices[0].delta.content if chunk.choices and chunk.choices[0].delta.content else ''
+
+
+def _store_stream(completion, key, model):
+    """Pass a stream through, caching its text once it has been read to the end"""
+    parts = []
+    for chunk in completion:
+        parts.append(_chunk_text(chunk))
+        yield chunk
+    completion_cache.put(key, model, ''.join(parts))
+
+
+async def _astore_stream(completion, key, model):
+    parts = []
+    async for chunk in completion:
+        parts.append(_chunk_text(chunk))
+        yield chunk
+    await run_blocking(completion_cache.put, key, model, ''.join(parts))
+
+
+async def _aone_chunk(chunk):
+    yield chunk
+
+
+def complete(request, stage, stream=False, hedge=None, cache=None):
+    """Create a chat completion for request (Groq create() arguments) through the gateway
+
+    stage names the caller in metrics and keys its hedge delay. Raises the
+    provider's error once retries or the deadline are exhausted, and
+    LLMUnavailable while the circuit breaker is open. hedge overrides
+    LLM_HEDGE. cache=True caches the request whatever its temperature;
+    cache=False never caches it (outside record/replay mode).
+    """
+    key = _cache_key(request, cache)
+    text = _lookup(key, stage)
+    if text is not None:
+        chunk_or_completion = _cached_completion(request, text, stream)
+        return iter([chunk_or_completion]) if stream else chunk_or_completion
+    completion = _complete(request, stage, stream, hedge)
+    if key is None:
+        return completion
+    if stream:
+        return _store_stream(completion, key, request.get('model'))
+    completion_cache.put(key, request.get('model'), completion.choices[0].message.content)
+    return completion
+
+
+async def acomplete(request, stage, stream=False, hedge=None, cache=None):
+    """Async version of complete(); cache reads and writes run on the blocking pool"""
+    key = _cache_key(request, cache)
+    # The SQLite cache can wait on a busy file, which must not stall the event loop
+    text = None if key is None else await run_blocking(_lookup, key, stage)
+    if text is not None:
+        chunk_or_completion = _cached_completion(request, text, stream)
+        return _aone_chunk(chunk_or_completion) if stream else chunk_or_completion
+    completion = await _acomplete(request, stage, stream, hedge)
+    if key is None:
+        return completion
+    if stream:
+        return _astore_stream(completion, key, request.get('model'))
+    await run_blocking(completion_cache.put, key, request.get('model'), completion.choices[0].message.content)
+    return completion
+
+
+def stream_usage(chunk):
+    """Token usage carried by the final chunk of a Groq stream, if any"""
+    x_groq = getattr(chunk, 'x_groq', None)
+    return getattr(x_groq, 'usage', None) if x_groq is not None else None
+
+
+def stream_text(completion, on_error=None, stage=None):
+    """Yield the text deltas of a chat completion created with stream=True
+
+    If the stream fails part-way and on_error is given, the message it
+    returns for the exception is yielded as the final chunk. With a stage
+    name, the token usage reported at the end of the stream is recorded.
+    """
+    try:
+        for chunk in completion:
+            if stage is not None:
+                record_usage(stage, stream_usage(chunk))
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    except Exception as e:
+        if on_error is None:
+            raise
+        yield on_error(e)
+
+
+def as_stream(text):
+    """Wrap a complete answer so it can be consumed like a token stream"""
+    yield text
+
+
+async def astream_text(completion, on_error=None, stage=None):
+    """Async version of stream_text for completions from AsyncGroq"""
+    try:
+        async for chunk in completion:
+            if stage is not None:
+                record_usage(stage, stream_usage(chunk))
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    except Exception as e:
+        if on_error is None:
+            raise
+        yield on_error(e)
+
+
+async def aas_stream(text):
+    """Async version of as_stream"""
+    yield text
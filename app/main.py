@@ -1,10 +1,20 @@
+import os
 import streamlit as st
 import time
-from faq import ingest_faq_data, faq_chain
-from sql import sql_chain
-from chitchat import chitchat_chain
-from pathlib import Path
-from router import router
+
+# With SHOPASSIST_API_URL set, the UI is a thin client of the API in api.py
+if os.getenv('SHOPASSIST_API_URL'):
+    from api_client import ask
+else:
+    import registry
+    from assistant import ask
+    from telemetry import serve_metrics
+
+    # Prometheus metrics on METRICS_PORT, if set (started once per process)
+    serve_metrics()
+    # The embedding model, router and FAQ collection are built once per process on a
+    # background thread, so the page renders right away (see 5. READINESS below)
+    registry.warm_up()
 
 # --- 1. CONFIGURATION ---
 st.set_page_config(
@@ -14,13 +24,6 @@ st.set_page_config(
     initial_sidebar_state="collapsed"
 )
 
-# Initialize Database
-faqs_path = Path(__file__).parent / "resources/faq_data.csv"
-if "db_init" not in st.session_state:
-    with st.spinner("Waking up the database..."):
-        ingest_faq_data(faqs_path)
-    st.session_state["db_init"] = True
-
 # Initialize Chat History
 if "messages" not in st.session_state:
     st.session_state["messages"] = [
@@ -175,37 +178,23 @@ st.markdown("""
 </div >
 """, unsafe_allow_html=True)
 
-# --- 3. LOGIC ---
-def ask(query):
-    """Route the query to appropriate handler"""
-    try:
-        route = router(query)
-        if route is None or route.name is None:
-            return chitchat_chain(query)
-        
-        route_name = route.name
-        if route_name == 'faq':
-            return faq_chain(query)
-        elif route_name == 'sql':
-            return sql_chain(query)
-        elif route_name == 'chitchat':
-            return chitchat_chain(query)
-        else:
-            return chitchat_chain(query)
-    except Exception as e:
-        return f"I encountered a slight hiccup: {str(e)}"
-
-# --- 4. UI RENDER ---
+# --- 3. UI RENDER ---
 
 st.title("🛍️ ShopAssist")
+readiness = st.empty()
 
 # Display Chat History
-for message in st.session_state.messages:
+# A trailing "..." is the pending answer; its bubble is kept so tokens can stream into it
+pending_answer = None
+for i, message in enumerate(st.session_state.messages):
     avatar = "👤" if message['role'] == "user" else "🦄"
     with st.chat_message(message['role'], avatar=avatar):
-        st.markdown(message['content'])
+        if i == len(st.session_state.messages) - 1 and message['content'] == "...":
+            pending_answer = st.empty()
+        else:
+            st.markdown(message['content'])
 
-# --- 5. THE NEW "IN-FLOW" INPUT BOX ---
+# --- 4. THE NEW "IN-FLOW" INPUT BOX ---
 # We use st.text_input instead of chat_input so it sits here, at the bottom of the list
 def submit_query():
     user_input = st.session_state.query_input
@@ -229,12 +218,13 @@ st.text_input(
 )
 
 # Process Response (If the last message is "...")
-if st.session_state.messages and st.session_state.messages[-1]["content"] == "...":
+if pending_answer is not None:
     # Get the actual query from the user (second to last message)
     last_query = st.session_state.messages[-2]["content"]
     
-    # Generate Answer
-    response = ask(last_query)
+    # Generate Answer, rendering tokens as they arrive
+    with pending_answer.container():
+        response = st.write_stream(ask(last_query, stream=True))
     
     # Update the "..." placeholder with the real response
     st.session_state.messages[-1]["content"] = response
@@ -242,6 +232,27 @@ if st.session_state.messages and st.session_state.messages[-1]["content"] == "..
     # Rerun to show the final result
     st.rerun()
 
+# --- 5. READINESS ---
+# While the warm-up runs, report its progress; questions asked meanwhile wait for what they need
+resource_labels = {
+    'embedding_model': "embedding model",
+    'router': "router",
+    'faq_collection': "FAQ collection",
+    'llm_clients': "LLM clients",
+}
+if not os.getenv('SHOPASSIST_API_URL'):
+    while registry.warming_up():
+        progress = ", ".join(f"{resource_labels.get(name, name)}: {state}"
+                             for name, state in registry.status().items())
+        readiness.caption(f"⏳ Warming up ({progress})")
+        time.sleep(0.5)
+    if registry.is_ready():
+        readiness.empty()
+    else:
+        failed = registry.errors()
+        readiness.warning("Some components failed to load and will be retried on the next question: "
+                          + ", ".join(f"{resource_labels.get(n, n)} ({e})" for n, e in failed.items()))
+
 
 
 
@@ -0,0 +1,260 @@
+"""
+Vector index over product titles.
+
+    python app/product_index.py build app/db.sqlite
+    python app/product_index.py search "comfortable shoes for long walks" --max-price 2000
+
+Title embeddings are computed after each catalog ingest (csv_to_sqlite.py
+calls build_index) and stored next to the database in <db>.vectors/<encoder>/
+as memory-mapped .npy files: product ids (sorted), title hashes and unit
+vectors, row i of each belonging to the same product. Rebuilding only
+encodes new or retitled products. search() narrows the catalog with the
+structured filters in SQL (brand, price, discount, rating, all indexed)
+and ranks just those rows by cosine similarity.
+"""
+import os
+import re
+import json
+import time
+import uuid
+import shutil
+import sqlite3
+import hashlib
+import argparse
+import threading
+import numpy as np
+from pathlib import Path
+import embeddings
+from db import get_pool
+from product_query import ProductQuery, filter_conditions
+
+# Hits scoring below this cosine similarity are dropped
+MIN_SCORE = float(os.getenv('PRODUCT_SEARCH_MIN_SCORE', '0.2'))
+# Rows scored per step when there is no filter, bounding the temporary score arrays
+BLOCK_ROWS = 65536
+
+_loaded = {}  # index folder -> (current.json signature, ProductIndex)
+_load_lock = threading.Lock()
+
+
+def index_dir(db_path, encoder_name=None):
+    encoder_name = encoder_name or embeddings.encoder_id()
+    return Path(db_path).with_suffix('.vectors') / re.sub(r'[^A-Za-z0-9_.-]+', '_', encoder_name)
+
+
+def title_hashes(titles):
+    return np.array([
+        int.from_bytes(hashlib.blake2b((t or '').encode('utf-8'), digest_size=8).digest(), 'little')
+        for t in titles
+    ], dtype=np.uint64)
+
+
+class ProductIndex:
+    """Memory-mapped title vectors for one build of the index"""
+
+    def __init__(self, folder):
+        self.folder = Path(folder)
+        self.ids = np.load(self.folder / 'ids.npy', mmap_mode='r')
+        self.hashes = np.load(self.folder / 'hashes.npy', mmap_mode='r')
+        self.vectors = np.load(self.folder / 'vectors.npy', mmap_mode='r')
+
+    def __len__(self):
+        return len(self.ids)
+
+    def rows_for(self, ids):
+        """Row positions of the given product ids; ids not in the index are skipped"""
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(self.ids) == 0 or len(ids) == 0:
+            return np.zeros(0, dtype=np.int64)
+        rows = np.minimum(np.searchsorted(self.ids, ids), len(self.ids) - 1)
+        return rows[self.ids[rows] == ids]
+
+    def search(self, query_vector, candidate_ids=None, k=10, min_score=MIN_SCORE):
+        """[(product id, score)] of the k rows most similar to query_vector
+
+        candidate_ids restricts the search to those products; None searches
+        the whole index block by block.
+        """
+        query = np.asarray(query_vector, dtype=np.float32)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        if candidate_ids is not None:
+            rows = np.sort(self.rows_for(candidate_ids))
+            scores = self.vectors[rows] @ query if len(rows) else np.zeros(0, dtype=np.float32)
+        else:
+            rows = np.arange(len(self.ids))
+            scores = np.empty(len(self.ids), dtype=np.float32)
+            for start in range(0, len(self.ids), BLOCK_ROWS):
+                scores[start:start + BLOCK_ROWS] = self.vectors[start:start + BLOCK_ROWS] @ query
+
+        if len(scores) > k:
+            top = np.argpartition(-scores, k)[:k]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(-scores[top])]
+        return [(int(self.ids[rows[i]]), float(scores[i])) for i in top if scores[i] >= min_score]
+
+
+def _signature(folder):
+    try:
+        stat = (folder / 'current.json').stat()
+        return stat.st_mtime_ns, stat.st_size
+    except FileNotFoundError:
+        return None
+
+
+def load_index(db_path):
+    """The current build of the index for db_path, or None if it has not been built
+
+    Reloaded automatically after a rebuild.
+    """
+    folder = index_dir(db_path)
+    signature = _signature(folder)
+    cached = _loaded.get(folder)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    with _load_lock:
+        index = None
+        if signature is not None:
+            current = json.loads((folder / 'current.json').read_text(encoding='utf-8'))
+            index = ProductIndex(folder / current['version'])
+        _loaded[folder] = (signature, index)
+    return index
+
+
+def build_index(db_path, batch_size=256, read_size=10000):
+    """Embed every product title in db_path into a new build of the index
+
+    Vectors of products whose title is unchanged since the previous build are
+    copied over; only new or retitled products are encoded.
+    """
+    folder = index_dir(db_path)
+    previous = load_index(db_path)
+    start = time.perf_counter()
+
+    # One read transaction, so the row count and the rows come from the same snapshot
+    conn = sqlite3.connect(f"{Path(db_path).resolve().as_uri()}?mode=ro", uri=True, isolation_level=None)
+    conn.execute("BEGIN")
+    count = conn.execute("SELECT COUNT(*) FROM product").fetchone()[0]
+    dim = previous.vectors.shape[1] if previous is not None and len(previous) else embeddings.encode(['probe']).shape[1]
+
+    version = f"{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    target = folder / version
+    target.mkdir(parents=True, exist_ok=True)
+    ids = np.lib.format.open_memmap(target / 'ids.npy', mode='w+', dtype=np.int64, shape=(count,))
+    hashes = np.lib.format.open_memmap(target / 'hashes.npy', mode='w+', dtype=np.uint64, shape=(count,))
+    vectors = np.lib.format.open_memmap(target / 'vectors.npy', mode='w+', dtype=np.float32, shape=(count, dim))
+
+    cursor = conn.execute("SELECT id, title FROM product ORDER BY id")
+    offset = encoded = 0
+    while True:
+        rows = cursor.fetchmany(read_size)
+        if not rows:
+            break
+        chunk_ids = np.array([r[0] for r in rows], dtype=np.int64)
+        titles = [r[1] or '' for r in rows]
+        chunk_hashes = title_hashes(titles)
+        chunk_vectors = np.empty((len(rows), dim), dtype=np.float32)
+
+        todo = np.ones(len(rows), dtype=bool)
+        if previous is not None and len(previous):
+            pos = np.minimum(np.searchsorted(previous.ids, chunk_ids), len(previous) - 1)
+            reuse = (previous.ids[pos] == chunk_ids) & (previous.hashes[pos] == chunk_hashes)
+            chunk_vectors[reuse] = previous.vectors[pos[reuse]]
+            todo = ~reuse
+        if todo.any():
+            new = embeddings.encode([t for t, flag in zip(titles, todo) if flag], batch_size=batch_size)
+            new /= np.clip(np.linalg.norm(new, axis=1, keepdims=True), 1e-12, None)
+            chunk_vectors[todo] = new
+            encoded += int(todo.sum())
+
+        end = offset + len(rows)
+        ids[offset:end], hashes[offset:end], vectors[offset:end] = chunk_ids, chunk_hashes, chunk_vectors
+        offset = end
+    conn.close()
+    for array in (ids, hashes, vectors):
+        array.flush()
+    del ids, hashes, vectors
+
+    # Point readers at the new build, then drop older ones
+    tmp_path = folder / f"current.json.{os.getpid()}.tmp"
+    tmp_path.write_text(json.dumps({
+        'version': version,
+        'count': count,
+        'dim': dim,
+        'encoder': embeddings.encoder_id(),
+    }), encoding='utf-8')
+    os.replace(tmp_path, folder / 'current.json')
+    for old in folder.iterdir():
+        if old.is_dir() and old.name != version:
+            shutil.rmtree(old, ignore_errors=True)  # Still mapped elsewhere on Windows; retried next build
+
+    elapsed = time.perf_counter() - start
+    print(f"Indexed {count} product titles in {elapsed:.2f}s ({encoded} encoded, {count - encoded} reused)")
+    return count
+
+
+def search(text, db_path, filters=None, k=10, query_vector=None):
+    """[(product id, score)] for the products whose titles best match text
+
+    filters is a ProductQuery whose brand, price, discount and rating
+    constraints are applied in SQL before ranking. Returns None when the
+    index has not been built.
+    """
+    index = load_index(db_path)
+    if index is None:
+        return None
+    conditions, params = filter_conditions(filters or ProductQuery())
+    candidate_ids = None
+    if conditions:
+        with get_pool(db_path).connection() as conn:
+            rows = conn.execute("SELECT id FROM product WHERE " + " AND ".join(conditions), params).fetchall()
+        candidate_ids = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+    if query_vector is None:
+        query_vector = embeddings.encode_query(text)
+    return index.search(query_vector, candidate_ids, k)
+
+
+def hits_to_sql(hits, order_by=None):
+    """(sql, params) selecting the hit products (non-empty), in score order unless order_by is given"""
+    ids = [product_id for product_id, _ in hits]
+    placeholders = ", ".join("?" * len(ids))
+    sql = f"SELECT * FROM product WHERE id IN ({placeholders})"
+    if order_by:
+        return f"{sql} ORDER BY {order_by}", tuple(ids)
+    ranks = " ".join("WHEN ? THEN " + str(rank) for rank in range(len(ids)))
+    return f"{sql} ORDER BY CASE id {ranks} END", tuple(ids) * 2
+
+
+if __name__ == '__main__':
+    default_db = Path(__file__).parent / "db.sqlite"
+    parser = argparse.ArgumentParser(description="Build or query the product title vector index")
+    sub = parser.add_subparsers(dest='command', required=True)
+    build_parser = sub.add_parser('build')
+    build_parser.add_argument('db_path', nargs='?', default=str(default_db))
+    search_parser = sub.add_parser('search')
+    search_parser.add_argument('text')
+    search_parser.add_argument('--db', default=str(default_db))
+    search_parser.add_argument('--brand')
+    search_parser.add_argument('--min-price', type=float)
+    search_parser.add_argument('--max-price', type=float)
+    search_parser.add_argument('--min-discount', type=float)
+    search_parser.add_argument('--min-rating', type=float)
+    search_parser.add_argument('-k', type=int, default=10)
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        build_index(args.db_path)
+    else:
+        filters = ProductQuery(brand=args.brand and args.brand.strip().lower(), min_price=args.min_price,
+                               max_price=args.max_price, min_discount=args.min_discount, min_rating=args.min_rating)
+        start = time.perf_counter()
+        hits = search(args.text, args.db, filters, args.k)
+        elapsed = (time.perf_counter() - start) * 1000
+        if hits is None:
+            print(f"No index for {args.db}; run: python app/product_index.py build {args.db}")
+        else:
+            with sqlite3.connect(args.db) as conn:
+                for product_id, score in hits:
+                    title, price = conn.execute("SELECT title, price FROM product WHERE id = ?", (product_id,)).fetchone()
+                    print(f"{score:.3f}  Rs. {price}  {title}")
+            print(f"\n{len(hits)} hits in {elapsed:.1f} ms")
@@ -0,0 +1,266 @@
+"""
+Deterministic parser for the common shapes of product questions (brand,
+price ceiling/range, discount and rating bounds, top-N by rating or price). Questions it cannot fully account for return None and are left to
+the LLM SQL generator, unless free_text is set, in which case the leftover
+words are returned as keywords for semantic title search (product_index.py).
+Leftover negations, comparisons or a second brand always go to the LLM, as
+dropping them would invert the filter ("shoes not from nike").
+"""
+import re
+from dataclasses import dataclass, field
+
+# Words that carry no constraint of their own
+STOPWORDS = {
+    'a', 'an', 'the', 'i', 'me', 'my', 'we', 'us', 'you', 'your', 'show', 'give', 'list', 'display', 'find',
+    'get', 'search', 'want', 'need', 'looking', 'look', 'like', 'would', 'could', 'can', 'please', 'buy',
+    'to', 'for', 'of', 'in', 'on', 'with', 'that', 'which', 'have', 'has', 'having', 'are', 'is', 'there',
+    'do', 'does', 'any', 'some', 'all', 'what', 'whats', 'available', 'options', 'products', 'product',
+    'shoes', 'shoe', 'footwear', 'pair', 'pairs', 'items', 'item', 'and', 'by', 'order', 'price', 'prices',
+    'priced', 'cost', 'costing', 'rs', 'inr', 'rupees', 'discount', 'discounted', 'off', 'rating', 'ratings',
+    'rated', 'sale', 'range', 'from', 'it', 'them', 'those', 'these', 'also', 'only', 'just', 'now',
+    'tell', 'about', 'brand', 'brands', 'at', 'least', 'most', 'than', 'descending', 'ascending',
+}
+
+# Title words the parser understands, mapped to the form used in product titles
+TITLE_TERMS = {
+    'running': 'running', 'walking': 'walking', 'sports': 'sports', 'sport': 'sports', 'casual': 'casual',
+    'formal': 'formal', 'sneakers': 'sneakers', 'sneaker': 'sneakers', 'training': 'training',
+    'gym': 'gym', 'jogging': 'jogging', 'trekking': 'trekking', 'hiking': 'hiking', 'outdoor': 'outdoor',
+    'lightweight': 'lightweight', 'loafers': 'loafers', 'boots': 'boots', 'sandals': 'sandals',
+    'slippers': 'slippers', 'women': 'women', 'woman': 'women', 'womens': 'women', 'ladies': 'women',
+    'girls': 'girls', 'men': 'men', 'man': 'men', 'mens': 'men', 'boys': 'boys', 'kids': 'kids',
+    'white': 'white', 'black': 'black', 'blue': 'blue', 'grey': 'grey', 'gray': 'grey', 'red': 'red',
+    'pink': 'pink', 'green': 'green', 'navy': 'navy', 'brown': 'brown',
+}
+
+# Leftover words that change the meaning of the filters found, so the question needs the LLM
+QUALIFIERS = {
+    'not', 'except', 'excluding', 'without', 'no', 'non', 'less', 'fewer', 'cheaper', 'better', 'worse',
+    'than', 'or', 'vs', 'versus', 'but', 'other', 'instead',
+}
+
+# Questions that need aggregation or columns the fast path does not produce
+UNSUPPORTED = re.compile(
+    r'\b(average|avg|mean|how many|count|number of|total|sum|compare|difference|size|percentage of)\b'
+)
+
+CURRENCY = r'(?:rs\.?|inr|₹)?\s*'
+AMOUNT = r'(\d+(?:\.\d+)?)\s*(k\b)?'
+ABOVE = r'(?:above|over|more than|greater than|at least|minimum|min|>=?)'
+# Words a number can qualify other than the price
+ATTRIBUTE = r'(?:ratings?|rated|reviews?|reviewed|stars?|discounts?|off)'
+BELOW = r'(?:under|below|less than|within|up ?to|upto|at most|maximum|max|cheaper than|<=?)'
+
+
+@dataclass
+class ProductQuery:
+    brand: str = None
+    min_price: float = None
+    max_price: float = None
+    min_discount: float = None
+    max_discount: float = None
+    min_rating: float = None
+    max_rating: float = None
+    title_terms: list = field(default_factory=list)
+    keywords: list = field(default_factory=list)
+    order_by: str = None
+    limit: int = None
+
+
+def _amount(match, group=1):
+    value = float(match.group(group))
+    if match.group(group + 1):
+        value *= 1000
+    return value
+
+
+def parse_product_query(question, brands=(), free_text=False):
+    """Extract product search slots from a question, or return None if it needs the LLM
+
+    With free_text=True, words the parser does not know are collected in
+    keywords instead of rejecting the question.
+    """
+    text = ' ' + question.lower().replace(',', ' ') + ' '
+    if UNSUPPORTED.search(text):
+        return None
+
+    pq = ProductQuery()
+
+    def consume(pattern, handler):
+        nonlocal text
+        match = re.search(pattern, text)
+        if match:
+            handler(match)
+            text = text[:match.start()] + ' ' + text[match.end():]
+        return match
+
+    # Ordering phrases
+    if consume(r'\b(cheapest|lowest price[ds]?|least expensive|most affordable|low to high)\b', lambda m: None):
+        pq.order_by = 'price ASC'
+    elif consume(r'\b(most expensive|costliest|highest price[ds]?|premium|high to low)\b', lambda m: None):
+        pq.order_by = 'price DESC'
+    elif consume(r'\b(biggest|highest|best|maximum|max) discounts?\b', lambda m: None):
+        pq.order_by = 'discount DESC'
+    elif consume(r'\b(most reviewed|most popular|popular)\b', lambda m: None):
+        pq.order_by = 'total_ratings DESC'
+    if consume(r'\b(?:top|best|highest)\s+(\d+)\s+(?:highly\s+|best\s+|top\s+)?rated\b',
+               lambda m: setattr(pq, 'limit', int(m.group(1)))):
+        pq.order_by = pq.order_by or 'avg_rating DESC'
+    if consume(r'\b(highly|high|top|best|well) rated\b|\b(highest|best|top) ratings?\b', lambda m: None):
+        pq.order_by = pq.order_by or 'avg_rating DESC'
+        pq.min_rating = 4.0
+    if consume(r'\b(descending|desc) order of (avg )?rating\b|\border of (avg )?rating\b', lambda m: None):
+        pq.order_by = 'avg_rating DESC'
+    if consume(r'\b(descending|desc) order of price\b', lambda m: None):
+        pq.order_by = 'price DESC'
+    if consume(r'\b(ascending|asc) order of price\b', lambda m: None):
+        pq.order_by = 'price ASC'
+
+    # Rating bounds (before prices, so "rating above 4" is not read as a price)
+    def set_rating(m):
+        pq.min_rating = float(m.group(1))
+
+    def set_max_rating(m):
+        pq.max_rating = float(m.group(1))
+
+    def set_rating_range(m):
+        low, high = float(m.group(1)), float(m.group(2))
+        pq.min_rating, pq.max_rating = min(low, high), max(low, high)
+    consume(r'\b(?:ratings?|rated) (?:of |between |from )?(\d(?:\.\d)?)\s*(?:to|and|-)\s*(\d(?:\.\d)?)\b',
+            set_rating_range) or \
+        consume(r'\b(\d(?:\.\d)?)\s*(?:to|-)\s*(\d(?:\.\d)?)\s*(?:ratings?|stars?)\b', set_rating_range) or \
+        consume(rf'\b(?:ratings?|rated) (?:of )?{BELOW} (\d(?:\.\d)?)\b', set_max_rating) or \
+        consume(rf'\b{BELOW} (\d(?:\.\d)?)\s*stars?\b', set_max_rating) or \
+        consume(rf'\b(?:ratings?|rated) (?:of )?{ABOVE} (\d(?:\.\d)?)\b', set_rating) or \
+        consume(r'\bratings? (?:of )?(\d(?:\.\d)?)\s*(?:\+|and above\b)', set_rating) or \
+        consume(rf'\b(?:{ABOVE} )?(\d(?:\.\d)?)\s*(?:\+\s*)?stars?(?: and above)?\b', set_rating) or \
+        consume(r'\b(\d(?:\.\d)?)\s*\+?\s*(?:and above )?ratings?\b', set_rating)
+
+    # Discount bounds
+    def set_discount(m):
+        pq.min_discount = float(m.group(1)) / 100
+
+    def set_max_discount(m):
+        pq.max_discount = float(m.group(1)) / 100
+    consume(rf'discounts? (?:of )?{BELOW} (\d+)\s*(?:%|percent)?', set_max_discount) or \
+        consume(rf'\b{BELOW} (\d+)\s*(?:%|percent)\s*(?:discount|off)?', set_max_discount) or \
+        consume(rf'discounts? (?:of )?(?:{ABOVE} )?(\d+)\s*(?:%|percent)', set_discount) or \
+        consume(rf'(?:{ABOVE} )?(\d+)\s*(?:%|percent)\s*(?:discount|off)?', set_discount)
+    if pq.min_discount is None and consume(r'\bon (sale|discount)\b|\bdiscounted\b', lambda m: None):
+        pq.min_discount = 0.01
+
+    # A number still next to a rating, review or discount word was not understood above
+    # ("more than 1000 ratings", "rated 3 to 4"); it must not be read as a price below
+    if re.search(rf'\b{ATTRIBUTE}\b(?:\s+[a-z]+){{0,2}}\s+(?:{BELOW}|{ABOVE})?\s*{CURRENCY}\d', text) or \
+            re.search(rf'\d\s*(?:k\b)?\s*\+?\s*(?:and above\s+)?{ATTRIBUTE}\b', text):
+        return None
+
+    # Price range, ceiling and floor
+    def set_range(m):
+        low, high = _amount(m, 1), _amount(m, 3)
+        pq.min_price, pq.max_price = min(low, high), max(low, high)
+    consume(rf'(?:between|from|range(?: of)?)?\s*{CURRENCY}{AMOUNT}\s*(?:to|and|-)\s*{CURRENCY}{AMOUNT}', set_range)
+    if pq.max_price is None:
+        consume(rf'\b{BELOW}\s*{CURRENCY}{AMOUNT}', lambda m: setattr(pq, 'max_price', _amount(m)))
+    if pq.min_price is None:
+        consume(rf'\b{ABOVE}\s*{CURRENCY}{AMOUNT}', lambda m: setattr(pq, 'min_price', _amount(m)))
+
+    # Top-N; "top 5 adidas shoes" with no other ordering means the best rated ones
+    def set_top(m):
+        pq.limit = int(m.group(2))
+        if m.group(1) != 'first':
+            pq.order_by = pq.order_by or 'avg_rating DESC'
+    consume(r'\b(top|first|best)\s+(\d+)\b', set_top)
+
+    # Brand (longest names first so multi-word brands win); a second brand needs the LLM
+    for brand in sorted(brands, key=len, reverse=True):
+        if brand and consume(rf'(?<![a-z0-9]){re.escape(brand)}(?![a-z0-9])', lambda m: None):
+            if pq.brand is not None:
+                return None
+            pq.brand = brand
+
+    # Whatever is left must be stopwords, known title terms or a bare count
+    for word in re.findall(r"[a-z0-9₹%'.+-]+", text):
+        word = word.strip(".'+-")
+        if word in QUALIFIERS:
+            return None
+        if not word or word in STOPWORDS:
+            continue
+        if word in TITLE_TERMS:
+            term = TITLE_TERMS[word]
+            if term not in pq.title_terms:
+                pq.title_terms.append(term)
+        elif word.isdigit() and pq.limit is None and 0 < int(word) <= 100:
+            pq.limit = int(word)
+        elif free_text:
+            if word not in pq.keywords:
+                pq.keywords.append(word)
+        else:
+            return None
+
+    if pq == ProductQuery(limit=pq.limit):
+        return None  # Nothing to search on
+    return pq
+
+
+def filter_conditions(pq):
+    """WHERE conditions and parameters for the structured filters of a parsed query"""
+    conditions = []
+    params = []
+    if pq.brand is not None:
+        conditions.append("brand_norm = ?")
+        params.append(pq.brand)
+    if pq.min_price is not None:
+        conditions.append("price >= ?")
+        params.append(pq.min_price)
+    if pq.max_price is not None:
+        conditions.append("price <= ?")
+        params.append(pq.max_price)
+    if pq.min_discount is not None:
+        conditions.append("discount >= ?")
+        params.append(pq.min_discount)
+    if pq.max_discount is not None:
+        conditions.append("discount <= ?")
+        params.append(pq.max_discount)
+    if pq.min_rating is not None:
+        conditions.append("avg_rating >= ?")
+        params.append(pq.min_rating)
+    if pq.max_rating is not None:
+        conditions.append("avg_rating <= ?")
+        params.append(pq.max_rating)
+    return conditions, params
+
+
+def build_sql(pq):
+    """Parameterized SELECT against the indexed product table for a parsed query"""
+    conditions, params = filter_conditions(pq)
+    if pq.title_terms:
+        # Full-text match on whole title words, so "men" does not match inside "women"
+        conditions.append("id IN (SELECT rowid FROM product_fts WHERE product_fts MATCH ?)")
+        params.append(" ".join(f'"{term}"' for term in pq.title_terms))
+
+    sql = "SELECT * FROM product"
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    if pq.order_by:
+        sql += f" ORDER BY {pq.order_by}"
+        if pq.order_by.startswith('avg_rating'):
+            sql += ", total_ratings DESC"
+    if pq.limit is not None:
+        sql += " LIMIT ?"
+        params.append(pq.limit)
+    return sql, tuple(params)
+
+
+if __name__ == '__main__':
+    from router import sql as sql_route
+
+    brands = ['nike', 'puma', 'adidas', 'campus', 'asian', 'red tape']
+    parsed = 0
+    for utterance in sql_route.utterances:
+        pq = parse_product_query(utterance, brands)
+        parsed += pq is not None
+        print(f"{'rules' if pq else 'llm  '} | {utterance}")
+        if pq:
+            print(f"        {build_sql(pq)}")
+    print(f"\nCoverage: {parsed}/{len(sql_route.utterances)}")
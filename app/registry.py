@@ -0,0 +1,96 @@
+"""
+Process-wide registry of expensive resources.
+
+The embedding model, the router (with its utterance index), the FAQ
+collection and the Groq clients are each built once per process, on first
+use or by warm_up(), which builds them all on a background thread. status()
+reports how far the warm-up has got so the UI and the API can show a
+readiness state instead of blocking on it.
+"""
+import threading
+import importlib
+from telemetry import logger, span
+
+PENDING, LOADING, READY, FAILED = 'pending', 'loading', 'ready', 'failed'
+
+# Built in this order by warm_up(): (resource name, module, getter)
+WARM_UP = (
+    ('embedding_model', 'embeddings', 'get_model'),
+    ('router', 'router', 'get_router'),
+    ('faq_collection', 'faq', 'get_collection'),
+    ('llm_clients', 'llm', 'get_clients'),
+)
+
+_lock = threading.Lock()
+_build_locks = {}
+_resources = {}
+_status = {}
+_errors = {}
+_warm_up_thread = None
+
+
+def get(name, build):
+    """The resource called name, built with build() the first time it is needed
+
+    Concurrent callers wait for a build already in progress. A failed build
+    is retried on the next call.
+    """
+    try:
+        return _resources[name]
+    except KeyError:
+        pass
+    with _lock:
+        build_lock = _build_locks.setdefault(name, threading.Lock())
+    with build_lock:
+        if name not in _resources:
+            _status[name] = LOADING
+            try:
+                with span(f'warm_up.{name}'):
+                    _resources[name] = build()
+            except Exception as e:
+                _status[name] = FAILED
+                _errors[name] = str(e)
+                raise
+            _status[name] = READY
+            _errors.pop(name, None)
+    return _resources[name]
+
+
+def _warm_up():
+    for name, module, getter in WARM_UP:
+        try:
+            getattr(importlib.import_module(module), getter)()
+        except Exception as e:
+            logger.error("Warm-up of %s failed: %s", name, e)
+
+
+def warm_up(wait=False):
+    """Start building every resource in WARM_UP on a background thread (once per process)"""
+    global _warm_up_thread
+    with _lock:
+        if _warm_up_thread is None:
+            for name, _, _ in WARM_UP:
+                _status.setdefault(name, PENDING)
+            _warm_up_thread = threading.Thread(target=_warm_up, name='warm-up', daemon=True)
+            _warm_up_thread.start()
+    if wait:
+        _warm_up_thread.join()
+
+
+def status():
+    """{resource name: pending/loading/ready/failed} for the warm-up resources"""
+    return {name: _status.get(name, PENDING) for name, _, _ in WARM_UP}
+
+
+def errors():
+    """{resource name: error message} for resources whose last build failed"""
+    return dict(_errors)
+
+
+def is_ready():
+    return all(state == READY for state in status().values())
+
+
+def warming_up():
+    """True while the background warm-up thread is still running"""
+    return _warm_up_thread is not None and _warm_up_thread.is_alive()
@@ -0,0 +1,165 @@
+import os
+import re
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Rough prompt budget for the serialized rows (about 4 characters per token)
+CONTEXT_TOKEN_BUDGET = int(os.getenv('SQL_CONTEXT_TOKEN_BUDGET', '1500'))
+CONTEXT_MAX_ROWS = int(os.getenv('SQL_CONTEXT_MAX_ROWS', '25'))
+
+# Columns that never help the answer
+DROP_COLUMNS = {'id', 'brand_norm', 'product_key'}
+MAX_VALUE_CHARS = 120
+
+LINK_REF = re.compile(r'\[(P\d+)\]')
+
+
+def estimate_tokens(text):
+    return len(text) // 4 + 1
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return f"{value:g}"
+    text = str(value).replace("|", "/")  # "|" is the column separator
+    if len(text) > MAX_VALUE_CHARS:
+        text = text[:MAX_VALUE_CHARS - 1] + "…"
+    return text
+
+
+def serialize_rows(rows, token_budget=CONTEXT_TOKEN_BUDGET, max_rows=CONTEXT_MAX_ROWS, complete=True):
+    """Compact, token-budgeted text form of query result rows
+
+    rows are sqlite3.Row objects or dicts. Columns the answer does not need
+    are dropped, long values are shortened and each product_link is replaced
+    with a short reference id like [P1]. complete=False means the query
+    matched more rows than were fetched. Returns (text, links) where links
+    maps reference ids back to full URLs for expand_links().
+    """
+    if not rows:
+        return "No rows", {}
+
+    columns = [c for c in rows[0].keys() if c not in DROP_COLUMNS]
+    lines = [" | ".join('link' if c == 'product_link' else c for c in columns)]
+    links = {}
+    used = estimate_tokens(lines[0])
+    for i, row in enumerate(rows[:max_rows]):
+        values = []
+        for c in columns:
+            if c == 'product_link' and row[c]:
+                ref = f"P{i + 1}"
+                links[ref] = row[c]
+                values.append(f"[{ref}]")
+            else:
+                values.append(_format_value(row[c]))
+        line = " | ".join(values)
+        used += estimate_tokens(line)
+        if used > token_budget and len(lines) > 1:
+            break
+        lines.append(line)
+
+    shown = len(lines) - 1
+    if not complete:
+        lines.append(f"(showing the first {shown} rows; more rows matched)")
+    elif shown < len(rows):
+        lines.append(f"(showing {shown} of {len(rows)} rows)")
+    links = {ref: url for ref, url in links.items() if int(ref[1:]) <= shown}
+    return "\n".join(lines), links
+
+
+def expand_links(text, links):
+    """Replace [P1]-style reference ids in generated text with the full links"""
+    return LINK_REF.sub(lambda m: links.get(m.group(1), m.group(0)), text)
+
+
+def _split_pending(pending):
+    """Index up to which buffered text can be emitted without cutting a [P1] reference"""
+    cut = pending.rfind("[")
+    if cut == -1 or "]" in pending[cut:] or len(pending) - cut > 12:
+        return len(pending)
+    return cut
+
+
+def expand_links_stream(chunks, links):
+    """Streaming version of expand_links
+
+    Text from an unclosed "[" onwards is held back until the reference is
+    complete, so ids split across chunks are still expanded.
+    """
+    pending = ""
+    for chunk in chunks:
+        pending += chunk
+        cut = _split_pending(pending)
+        if cut:
+            yield expand_links(pending[:cut], links)
+            pending = pending[cut:]
+    if pending:
+        yield expand_links(pending, links)
+
+
+async def aexpand_links_stream(chunks, links):
+    """Async version of expand_links_stream"""
+    pending = ""
+    async for chunk in chunks:
+        pending += chunk
+        cut = _split_pending(pending)
+        if cut:
+            yield expand_links(pending[:cut], links)
+            pending = pending[cut:]
+    if pending:
+        yield expand_links(pending, links)
+
+
+# Columns that make a result a product listing rather than an aggregate
+PRODUCT_COLUMNS = {'title', 'price', 'discount', 'avg_rating', 'product_link'}
+RENDER_MAX_ROWS = int(os.getenv('SQL_RENDER_MAX_ROWS', '20'))
+
+
+def _present(value):
+    return value is not None and value == value  # NaN != NaN
+
+
+def _format_number(value):
+    return f"{value:g}" if isinstance(value, float) else str(value)
+
+
+def is_product_list(columns):
+    return PRODUCT_COLUMNS.issubset(columns)
+
+
+def _product_name(row):
+    title = str(row['title']).strip()
+    brand = str((row['brand'] if 'brand' in row.keys() else None) or '').strip()
+    if brand and not title.lower().startswith(brand.lower()):
+        title = f"{brand.title()} {title}"
+    if len(title) > MAX_VALUE_CHARS:
+        title = title[:MAX_VALUE_CHARS - 1] + "…"
+    return title
+
+
+def render_product_list(rows, max_rows=RENDER_MAX_ROWS, complete=True):
+    """Render product rows in the answer format without an LLM call
+
+    1. Campus Alice Running Shoes For Women: Rs. 1063 (24 percent off), Rating: 4.3 <link>
+
+    complete=False means more products matched than the rows given.
+    """
+    if not rows:
+        return "Sorry, I couldn't find any products matching your question."
+
+    lines = []
+    for i, row in enumerate(rows[:max_rows], start=1):
+        line = f"{i}. {_product_name(row)}: Rs. {_format_number(row['price'])}"
+        if _present(row['discount']) and row['discount'] > 0:
+            line += f" ({round(row['discount'] * 100)} percent off)"
+        if _present(row['avg_rating']):
+            line += f", Rating: {_format_number(row['avg_rating'])}"
+        if row['product_link']:
+            line += f" <{row['product_link']}>"
+        lines.append(line)
+    if len(rows) > max_rows and complete:
+        lines.append(f"\n...and {len(rows) - max_rows} more. Narrow your search to see them.")
+    elif len(rows) > max_rows or not complete:
+        lines.append("\n...and more. Narrow your search to see them.")
+    return "\n".join(lines)
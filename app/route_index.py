@@ -0,0 +1,173 @@
+import os
+import re
+import json
+import hashlib
+import numpy as np
+from pathlib import Path
+import embeddings
+
+CACHE_DIR = Path(os.getenv('ROUTE_CACHE_DIR', Path(__file__).parent / ".cache/routes"))
+
+
+def utterances_hash(utterances):
+    """Stable hash of a route's utterance list"""
+    return hashlib.sha256("\n".join(utterances).encode('utf-8')).hexdigest()
+
+
+def _encoder_dir(encoder_name):
+    return CACHE_DIR / re.sub(r'[^A-Za-z0-9_.-]+', '_', encoder_name)
+
+
+def _write_vectors(path, matrix):
+    """Write a .npy file atomically so concurrent workers never see a partial file"""
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, 'wb') as f:
+        np.save(f, matrix)
+    os.replace(tmp_path, path)
+
+
+def _write_manifest(path, manifest):
+    """Write the manifest atomically, like the vectors it points to"""
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp_path.write_text(json.dumps(manifest, indent=2), encoding='utf-8')
+    os.replace(tmp_path, path)
+
+
+def load_route_vectors(route, encoder_name=embeddings.encoder_id()):
+    """Return the utterance vectors of a route, memory-mapped from the on-disk index
+
+    Only utterances that are new since the cached version are encoded; vectors
+    of unchanged utterances are copied over from the previous file.
+    """
+    folder = _encoder_dir(encoder_name)
+    digest = utterances_hash(route.utterances)
+    vectors_path = folder / f"{route.name}-{digest[:16]}.npy"
+    manifest_path = folder / f"{route.name}.json"
+
+    manifest = None
+    if manifest_path.exists():
+        try:
+            manifest = json.loads(manifest_path.read_text(encoding='utf-8'))
+        except ValueError:
+            pass  # Truncated by an older, non-atomic write; rebuilt below
+    if manifest is not None and manifest['hash'] == digest and vectors_path.exists():
+        return np.load(vectors_path, mmap_mode='r')
+
+    previous = {}
+    if manifest is not None:
+        old_path = folder / manifest['file']
+        if old_path.exists():
+            old_vectors = np.load(old_path, mmap_mode='r')
+            previous = {u: old_vectors[i] for i, u in enumerate(manifest['utterances'])}
+
+    missing = [u for u in dict.fromkeys(route.utterances) if u not in previous]
+    if missing:
+        print(f"Encoding {len(missing)} new utterance(s) for route: {route.name}")
+        previous.update(zip(missing, embeddings.encode(missing)))
+    matrix = np.stack([previous[u] for u in route.utterances]).astype(np.float32)
+
+    folder.mkdir(parents=True, exist_ok=True)
+    _write_vectors(vectors_path, matrix)
+    _write_manifest(manifest_path, {
+        'route': route.name,
+        'encoder': encoder_name,
+        'hash': digest,
+        'file': vectors_path.name,
+        'utterances': list(route.utterances),
+    })
+    if manifest is not None and manifest['file'] != vectors_path.name:
+        try:
+            (folder / manifest['file']).unlink(missing_ok=True)
+        except OSError:
+            pass  # Still mapped by another worker; stale files are harmless
+
+    return np.load(vectors_path, mmap_mode='r')
+
+
+def router_scores(similarities, route_ids, n_routes, top_k=5):
+    """SemanticRouter's route scores for many queries at once
+
+    The router takes the top_k utterances closest to a query across all
+    routes and averages the similarities of each route's utterances among
+    them; the route with the highest mean wins if its best similarity is
+    above its threshold. similarities[i, u] is query i against utterance u
+    and route_ids[u] the route column of utterance u. Returns (means, maxima)
+    of shape (queries, n_routes), NaN where a route has no utterance in the
+    top_k.
+    """
+    k = min(top_k, similarities.shape[1])
+    top = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+    top_scores = np.take_along_axis(similarities, top, axis=1)
+    top_routes = route_ids[top]
+    means = np.full((len(similarities), n_routes), np.nan, dtype=np.float32)
+    maxima = np.full((len(similarities), n_routes), np.nan, dtype=np.float32)
+    for j in range(n_routes):
+        in_route = top_routes == j
+        counts = in_route.sum(axis=1)
+        present = counts > 0
+        means[present, j] = np.where(in_route, top_scores, 0).sum(axis=1)[present] / counts[present]
+        maxima[present, j] = np.where(in_route, top_scores, -np.inf).max(axis=1)[present]
+    return means, maxima
+
+
+class RouteIndex:
+    """Cached utterance vectors for a set of routes"""
+
+    def __init__(self, routes, encoder_name=embeddings.encoder_id()):
+        self.encoder_name = encoder_name
+        self.routes = list(routes)
+        self.vectors = {route.name: load_route_vectors(route, encoder_name) for route in self.routes}
+        self._by_utterance = {}
+        for route in self.routes:
+            for i, utterance in enumerate(route.utterances):
+                self._by_utterance[utterance] = self.vectors[route.name][i]
+
+        # Normalized utterance matrix with the row range of each route, for scoring
+        matrix = np.concatenate([self.vectors[route.name] for route in self.routes]).astype(np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        self.matrix = matrix / np.where(norms == 0, 1, norms)
+        self.slices = {}
+        start = 0
+        for route in self.routes:
+            self.slices[route.name] = slice(start, start + len(route.utterances))
+            start += len(route.utterances)
+        self.route_ids = np.concatenate([np.full(len(route.utterances), j) for j, route in enumerate(self.routes)])
+
+    def vector_for(self, utterance):
+        """Cached vector of a known utterance, or None"""
+        return self._by_utterance.get(utterance)
+
+    def similarities(self, vectors):
+        """Cosine similarity of each query vector to every utterance, with one matrix multiply"""
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return (vectors / np.where(norms == 0, 1, norms)) @ self.matrix.T
+
+    def router_scores(self, vectors, top_k=5):
+        """(route_names, means, maxima) as router_scores() computes them, for SemanticRouter parity"""
+        means, maxima = router_scores(self.similarities(vectors), self.route_ids, len(self.routes), top_k)
+        return [route.name for route in self.routes], means, maxima
+
+    def score_batch(self, vectors, top_k=5):
+        """Score many query vectors against every route with one matrix multiply
+
+        Returns (route_names, scores) where scores[i, j] is the mean cosine
+        similarity of route j's top_k closest utterances to query i.
+        """
+        similarities = self.similarities(vectors)
+        names = list(self.slices)
+        scores = np.empty((len(vectors), len(names)), dtype=np.float32)
+        for j, name in enumerate(names):
+            route_similarities = similarities[:, self.slices[name]]
+            k = min(top_k, route_similarities.shape[1])
+            scores[:, j] = np.partition(route_similarities, -k, axis=1)[:, -k:].mean(axis=1)
+        return names, scores
+
+    def rank(self, vector, top_k=5):
+        """Routes ordered by score, as [(name, score), ...]
+
+        A route's score is the mean cosine similarity of its top_k closest
+        utterances to the query vector.
+        """
+        names, scores = self.score_batch(vector, top_k)
+        return sorted(zip(names, scores[0].tolist()), key=lambda item: item[1], reverse=True)
@@ -1,12 +1,44 @@
-from semantic_router import Route
-from semantic_router.routers import SemanticRouter
-from semantic_router.encoders import HuggingFaceEncoder
+from collections import namedtuple
+import embeddings
+import registry
+from route_index import RouteIndex
 
-encoder = HuggingFaceEncoder(
-    name="sentence-transformers/all-MiniLM-L6-v2"
-)
+# Set by build_router(); utterance vectors are served from it
+route_index = None
+
+# Score every route must beat unless it sets its own
+SCORE_THRESHOLD = 0.5
+
+# Route names and utterances; semantic_router Routes are built from them in build_router()
+RouteSpec = namedtuple('RouteSpec', ['name', 'utterances'])
+
+
+def make_encoder():
+    """semantic-router encoder backed by the process-wide embedding model
+
+    Route utterances are looked up in the on-disk route index, so only texts
+    that are not cached there reach the model. semantic_router (and litellm
+    with it) is only imported here, when the router is first built.
+    """
+    from semantic_router.encoders import DenseEncoder
+
+    class SharedEncoder(DenseEncoder):
+        name: str = embeddings.encoder_id()
+        type: str = "huggingface"
+        score_threshold: float = SCORE_THRESHOLD
+
+        def __call__(self, docs):
+            vectors = [route_index.vector_for(d) if route_index else None for d in docs]
+            missing = [d for d, v in zip(docs, vectors) if v is None]
+            if missing:
+                encoded = iter(embeddings.encode(missing))
+                vectors = [next(encoded) if v is None else v for v in vectors]
+            return [[float(x) for x in v] for v in vectors]
+
+    return SharedEncoder()
 
-faq = Route(
+
+faq = RouteSpec(
     name='faq',
     utterances=[
         "What is the return policy of the products?",
@@ -30,7 +62,7 @@ faq = Route(
     ]
 )
 
-sql = Route(
+sql = RouteSpec(
     name='sql',
     utterances=[
         "I want to buy nike shoes that have 50% discount.",
@@ -49,7 +81,7 @@ sql = Route(
     ]
 )
 
-chitchat = Route(
+chitchat = RouteSpec(
     name='chitchat',
     utterances=[
         "Hello, how are you?",
@@ -74,20 +106,42 @@ chitchat = Route(
     ]
 )
 
-# Create router without routes first
-router = SemanticRouter(encoder=encoder)
 
-# Add routes one by one (this builds the index automatically)
-router.add(faq)
-router.add(sql)
-router.add(chitchat)
+def build_router():
+    global route_index
+    from semantic_router import Route
+    from semantic_router.routers import SemanticRouter
+
+    encoder = make_encoder()
+    # Load utterance vectors from disk, encoding only new or changed utterances
+    route_index = RouteIndex([faq, sql, chitchat], encoder.name)
+
+    # Create router without routes first
+    router = SemanticRouter(encoder=encoder)
+
+    # Add routes one by one (vectors come from the route index, not the model)
+    for spec in (faq, sql, chitchat):
+        router.add(Route(name=spec.name, utterances=spec.utterances))
+    return router
+
+
+def get_router():
+    """The process-wide router, built on first use or by the background warm-up"""
+    return registry.get('router', build_router)
+
+
+def get_route_index():
+    get_router()
+    return route_index
 
 
 if __name__ == "__main__":
+    router = get_router()
     print(router("What is your policy on defective product?").name)
     print(router("Pink Puma shoes in price range 1000 to 5000").name)
     print(router("Hi, I'm John").name)
-    print(router("What should I wear today?").name)
+    # Pre-computed query vectors skip the encoder entirely
+    print(router(vector=embeddings.encode_query("What should I wear today?")).name)
 
 
 
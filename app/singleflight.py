@@ -0,0 +1,281 @@
+"""
+Single-flight coalescing of identical in-flight questions.
+
+The chains are wrapped with @coalesce(route): while a call for a question is
+running, identical calls (same route, same normalized question, same stream
+flag) wait for it and get its result instead of repeating the embedding,
+retrieval and LLM work. A streamed answer is shared too: every caller gets
+its own reader over one upstream stream, and callers that join late first
+replay the chunks already received. SINGLE_FLIGHT=0 turns it off.
+"""
+import os
+import re
+import asyncio
+import weakref
+import functools
+import threading
+from dotenv import load_dotenv
+from telemetry import increment
+
+load_dotenv()
+
+ENABLED = os.getenv('SINGLE_FLIGHT', '1') == '1'
+
+_lock = threading.Lock()
+_calls = {}   # key -> _Call, for the sync chains
+_acalls = {}  # key -> asyncio.Future, for the async chains (one event loop per API process)
+saved = {}    # route -> calls answered by another caller's computation
+
+
+def normalize_query(query):
+    """Canonical form of a question: lowercase, single spaces, no trailing punctuation"""
+    return re.sub(r'\s+', ' ', query.strip().lower()).rstrip(' ?.!')
+
+
+def _record_saved(route):
+    with _lock:
+        saved[route] = saved.get(route, 0) + 1
+    increment('shopassist_coalesced_total', route=route)
+
+
+class SharedStream:
+    """One text stream read by several callers
+
+    Whichever reader is furthest ahead pulls the next chunk from the source;
+    the others replay it from the buffer. Only the pull is serialized, so a
+    slow network read never holds up readers replaying buffered chunks.
+    on_finish is called once the source is exhausted or fails.
+    """
+
+    def __init__(self, source, on_finish=None):
+        self._source = iter(source)
+        self._chunks = []
+        self._done = False
+        self._error = None
+        self._fetch_lock = threading.Lock()
+        self._on_finish = on_finish
+
+    def _finish(self, error=None):
+        self._error = error
+        self._done = True
+        if self._on_finish is not None:
+            self._on_finish()
+
+    def _fetch(self, i):
+        with self._fetch_lock:
+            if i < len(self._chunks) or self._done:
+                return  # Another reader fetched it while this one waited
+            try:
+                self._chunks.append(next(self._source))
+            except StopIteration:
+                self._finish()
+            except Exception as e:
+                self._finish(e)
+            except BaseException:
+                # The source is closed now; the other readers get an error rather than a cut-off answer
+                self._finish(RuntimeError("the shared answer stream was interrupted"))
+                raise
+
+    def reader(self):
+        i = 0
+        while True:
+            # Chunks are only appended, and _done is set after the last one, so no lock is needed here
+            if i < len(self._chunks):
+                chunk = self._chunks[i]
+            elif not self._done:
+                self._fetch(i)
+                continue
+            elif self._error is not None:
+                raise self._error
+            else:
+                return
+            i += 1
+            yield chunk
+
+
+class AsyncSharedStream:
+    """Async version of SharedStream"""
+
+    def __init__(self, source, on_finish=None):
+        self._source = source.__aiter__()
+        self._chunks = []
+        self._done = False
+        self._error = None
+        self._fetch_lock = asyncio.Lock()
+        self._on_finish = on_finish
+
+    def _finish(self, error=None):
+        self._error = error
+        self._done = True
+        if self._on_finish is not None:
+            self._on_finish()
+
+    async def _fetch(self, i):
+        async with self._fetch_lock:
+            if i < len(self._chunks) or self._done:
+                return
+            try:
+                self._chunks.append(await self._source.__anext__())
+            except StopAsyncIteration:
+                self._finish()
+            except Exception as e:
+                self._finish(e)
+            except BaseException:
+                self._finish(RuntimeError("the shared answer stream was interrupted"))
+                raise
+
+    async def reader(self):
+        i = 0
+        while True:
+            if i < len(self._chunks):
+                chunk = self._chunks[i]
+            elif not self._done:
+                await self._fetch(i)
+                continue
+            elif self._error is not None:
+                raise self._error
+            else:
+                return
+            i += 1
+            yield chunk
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.interrupted = False
+
+
+def _forget(table, key, call):
+    with _lock:
+        if table.get(key) is call:
+            del table[key]
+
+
+def _leader_reader(shared, forget):
+    try:
+        yield from shared.reader()
+    finally:
+        forget()
+
+
+async def _aleader_reader(shared, forget):
+    try:
+        async for chunk in shared.reader():
+            yield chunk
+    finally:
+        forget()
+
+
+def _leader_stream(reader, forget):
+    # Others can join only while the leader's stream is alive and unfinished, so an
+    # abandoned stream is never replayed to a later, unrelated caller. A reader that
+    # is dropped before it is started (a Streamlit rerun, or a client that disconnects
+    # before the response starts) never runs its finally, hence the finalizer.
+    weakref.finalize(reader, forget)
+    return reader
+
+
+def _do(key, stream, fn):
+    with _lock:
+        call = _calls.get(key)
+        leader = call is None
+        if leader:
+            call = _calls[key] = _Call()
+    if not leader:
+        call.event.wait()
+        if call.interrupted:
+            # The leader was interrupted (e.g. its Streamlit session reran); run it here
+            return _do(key, stream, fn)
+        if call.error is not None:
+            raise call.error
+        _record_saved(key[0])
+        return call.result.reader() if stream else call.result
+
+    try:
+        result = fn()
+    except Exception as e:
+        call.error = e
+        _forget(_calls, key, call)
+        call.event.set()
+        raise
+    except BaseException:
+        # KeyboardInterrupt or a Streamlit rerun/stop belongs to the leader's session alone
+        call.interrupted = True
+        _forget(_calls, key, call)
+        call.event.set()
+        raise
+    if stream:
+        forget = functools.partial(_forget, _calls, key, call)
+        call.result = SharedStream(result, on_finish=forget)
+        call.event.set()
+        return _leader_stream(_leader_reader(call.result, forget), forget)
+    call.result = result
+    _forget(_calls, key, call)
+    call.event.set()
+    return result
+
+
+async def _ado(key, stream, fn):
+    future = _acalls.get(key)
+    if future is not None:
+        try:
+            # shield: a follower that is cancelled must not cancel the result for the others
+            shared = await asyncio.shield(future)
+        except asyncio.CancelledError:
+            if not future.cancelled():
+                raise
+            # The leader was cancelled (e.g. the losing path of speculative routing); run it here
+            return await _ado(key, stream, fn)
+        _record_saved(key[0])
+        return shared.reader() if stream else shared
+
+    future = _acalls[key] = asyncio.get_running_loop().create_future()
+    try:
+        result = await fn()
+    except asyncio.CancelledError:
+        _forget(_acalls, key, future)
+        future.cancel()
+        raise
+    except Exception as e:
+        _forget(_acalls, key, future)
+        future.set_exception(e)
+        future.exception()  # Retrieved here so an unawaited future doesn't log it
+        raise
+    if stream:
+        forget = functools.partial(_forget, _acalls, key, future)
+        shared = AsyncSharedStream(result, on_finish=forget)
+        future.set_result(shared)
+        return _leader_stream(_aleader_reader(shared, forget), forget)
+    _forget(_acalls, key, future)
+    future.set_result(result)
+    return result
+
+
+def coalesce(route):
+    """Decorate a chain taking (query, ..., stream=False, ...) so identical concurrent calls share one run"""
+    def decorator(chain):
+        if asyncio.iscoroutinefunction(chain):
+            @functools.wraps(chain)
+            async def wrapper(query, *args, stream=False, **kwargs):
+                if not ENABLED:
+                    return await chain(query, *args, stream=stream, **kwargs)
+                return await _ado((route, normalize_query(query), stream), stream,
+                                  lambda: chain(query, *args, stream=stream, **kwargs))
+        else:
+            @functools.wraps(chain)
+            def wrapper(query, *args, stream=False, **kwargs):
+                if not ENABLED:
+                    return chain(query, *args, stream=stream, **kwargs)
+                return _do((route, normalize_query(query), stream), stream,
+                           lambda: chain(query, *args, stream=stream, **kwargs))
+        return wrapper
+    return decorator
+
+
+def stats():
+    """{route: calls saved} plus the number of questions currently in flight"""
+    with _lock:
+        return {'saved': dict(saved), 'in_flight': len(_calls) + len(_acalls)}
@@ -1,11 +1,20 @@
-from groq import Groq
 import os
 import re
-import sqlite3
-import pandas as pd
 from pathlib import Path
 from dotenv import load_dotenv
-from pandas import DataFrame
+from collections import Counter
+from cache import LRUCache
+from db import get_pool, fetch
+import sql_guard
+from sql_guard import QueryError
+from product_query import parse_product_query, build_sql, UNSUPPORTED
+import product_index
+from result_format import (serialize_rows, expand_links, expand_links_stream, aexpand_links_stream,
+                           is_product_list, render_product_list, CONTEXT_MAX_ROWS, RENDER_MAX_ROWS)
+from llm import complete, acomplete, stream_text, as_stream, astream_text, aas_stream
+from blocking import run_blocking
+from singleflight import coalesce, normalize_query
+from telemetry import logger, span, increment, record_usage, record_cache
 
 load_dotenv()
 
@@ -13,7 +22,24 @@ GROQ_MODEL = os.getenv('GROQ_MODEL')
 
 db_path = Path(__file__).parent / "db.sqlite"
 
-client_sql = Groq()
+# Normalized question -> SQL extracted from the LLM response
+sql_cache = LRUCache(
+    max_size=int(os.getenv('SQL_CACHE_SIZE', '1024')),
+    ttl=float(os.getenv('SQL_CACHE_TTL', '86400'))
+)
+# (SQL, params, row budget, database signature) -> QueryResult
+result_cache = LRUCache(max_size=int(os.getenv('SQL_RESULT_CACHE_SIZE', '256')))
+# Brand names known to the rule-based parser, refreshed when the database changes
+_brands = {'signature': None, 'names': ()}
+
+# Products returned by semantic title search when the question sets no limit
+SEARCH_RESULTS = int(os.getenv('PRODUCT_SEARCH_RESULTS', '10'))
+
+# Rows fetched for an answer: enough to render a product list or fill the LLM context
+ANSWER_MAX_ROWS = max(RENDER_MAX_ROWS, CONTEXT_MAX_ROWS)
+
+# How each SQL question was translated: 'rules' (fast path), 'vector' (title search) or 'llm'
+sql_path_counts = Counter()
 
 sql_prompt = """You are an expert in understanding the database schema and generating SQL queries for a natural language question asked
 pertaining to the data you have. The schema is provided in the schema tags. 
@@ -21,24 +47,31 @@ pertaining to the data you have. The schema is provided in the schema tags.
 table: product 
 
 fields: 
+id - integer (primary key)
+product_key - string (stable product id taken from the link)
 product_link - string (hyperlink to product)	
 title - string (name of the product)	
-brand - string (brand of the product)	
-price - integer (price of the product in Indian Rupees)	
-discount - float (discount on the product. 10 percent discount is represented as 0.1, 20 percent as 0.2, and such.)	
-avg_rating - float (average rating of the product. Range 0-5, 5 is the highest.)	
+brand - string (brand of the product, as displayed)	
+brand_norm - string (brand of the product in lowercase with no surrounding spaces, indexed)
+price - integer (price of the product in Indian Rupees, indexed)	
+discount - float (discount on the product. 10 percent discount is represented as 0.1, 20 percent as 0.2, and such. Indexed)	
+avg_rating - float (average rating of the product. Range 0-5, 5 is the highest. Indexed)	
 total_ratings - integer (total number of ratings for the product)
 
+table: product_fts (SQLite FTS5 full-text index over product.title; its rowid is product.id)
 </schema>
-Make sure whenever you try to search for the brand name, the name can be in any case. 
-So, make sure to use %LIKE% to find the brand in condition. Never use "ILIKE". 
+To filter by brand, compare the lowercase brand name with brand_norm using "=", e.g. brand_norm = 'nike'. Never use LIKE or "ILIKE" on the brand.
+To search for words in the product title (e.g. "running", "women", "sneakers"), use the full-text index:
+id IN (SELECT rowid FROM product_fts WHERE product_fts MATCH '"running" "women"')
+Every quoted word must appear in the title. Do not use LIKE on the title.
 Create a single SQL query for the question provided. 
-The query should have all the fields in SELECT clause (i.e. SELECT *)
+When the question asks for products, the query should have all the fields in SELECT clause (i.e. SELECT * FROM product).
+When the question asks for a count, average, total, minimum or maximum, select just that aggregate (e.g. SELECT COUNT(*) FROM product WHERE brand_norm = 'puma', or SELECT AVG(avg_rating) FROM product WHERE brand_norm = 'nike').
 
 Just the SQL query is needed, nothing more. Always provide the SQL in between the <SQL></SQL> tags."""
 
 
-comprehension_prompt = """You are an expert in understanding the context of the question and replying based on the data pertaining to the question provided. You will be provided with Question: and Data:. The data will be in the form of an array or a dataframe or dict. Reply based on only the data provided as Data for answering the question asked as Question. Do not write anything like 'Based on the data' or any other technical words. Just a plain simple natural language response.
+comprehension_prompt = """You are an expert in understanding the context of the question and replying based on the data pertaining to the question provided. You will be provided with Question: and Data:. The data will be a table with a header line of column names and one row per line, columns separated by "|". Reply based on only the data provided as Data for answering the question asked as Question. Do not write anything like 'Based on the data' or any other technical words. Just a plain simple natural language response.
 The Data would always be in context to the question asked. For example is the question is “What is the average rating?” and data is “4.3”, then answer should be “The average rating for the product is 4.3”. So make sure the response is curated with the question and data. Make sure to note the column names to have some context, if needed, for your response.
 There can also be cases where you are given an entire dataframe in the Data: field. Always remember that the data field contains the answer of the question asked. All you need to do is to always reply in the following format when asked about a product: 
 Produt title, price in indian rupees, discount, and rating, and then product link. Take care that all the products are listed in list format, one line after the other. Not as a paragraph.
@@ -46,12 +79,14 @@ For example:
 1. Campus Women Running Shoes: Rs. 1104 (35 percent off), Rating: 4.4 <link>
 2. Campus Women Running Shoes: Rs. 1104 (35 percent off), Rating: 4.4 <link>
 3. Campus Women Running Shoes: Rs. 1104 (35 percent off), Rating: 4.4 <link>
+Product links are given as short reference ids in square brackets, like [P1]. Write the reference id exactly as given (including the brackets) in place of <link>.
 
 """
 
 
-def generate_sql_query(question):
-    chat_completion = client_sql.chat.completions.create(
+def sql_request(question):
+    """Groq chat completion arguments for translating a question to SQL"""
+    return dict(
         messages=[
             {
                 "role": "system",
@@ -67,19 +102,256 @@ def generate_sql_query(question):
         max_tokens=3000
     )
 
+
+def generate_sql_query(question):
+    with span('sql.generate'):
+        chat_completion = complete(sql_request(question), 'sql.generate', cache=True)
+    record_usage('sql.generate', chat_completion.usage)
+
+    return chat_completion.choices[0].message.content
+
+
+async def agenerate_sql_query(question):
+    with span('sql.generate'):
+        chat_completion = await acomplete(sql_request(question), 'sql.generate', cache=True)
+    record_usage('sql.generate', chat_completion.usage)
+
     return chat_completion.choices[0].message.content
 
 
+def repair_request(question, sql, error):
+    """sql_request() followed by the refused query and the guard's reason, asking for a fix"""
+    request = sql_request(question)
+    request['messages'] += [
+        {
+            "role": "assistant",
+            "content": f"<SQL>{sql}</SQL>",
+        },
+        {
+            "role": "user",
+            "content": f"That query could not be run: {error.detail}. Write a corrected query for the same question.",
+        }
+    ]
+    return request
+
+
+def repair_sql_query(question, sql, error):
+    """SQL regenerated by the LLM for a query the execution guard refused, or None"""
+    with span('sql.repair', reason=error.reason):
+        chat_completion = complete(repair_request(question, sql, error), 'sql.repair', cache=True)
+    record_usage('sql.repair', chat_completion.usage)
+    return extract_sql(chat_completion.choices[0].message.content)
+
+
+async def arepair_sql_query(question, sql, error):
+    """Async version of repair_sql_query"""
+    with span('sql.repair', reason=error.reason):
+        chat_completion = await acomplete(repair_request(question, sql, error), 'sql.repair', cache=True)
+    record_usage('sql.repair', chat_completion.usage)
+    return extract_sql(chat_completion.choices[0].message.content)
+
+
+def extract_sql(response):
+    """SQL between the <SQL></SQL> tags of an LLM response, or None"""
+    pattern = "<SQL>(.*?)</SQL>"
+    matches = re.findall(pattern, response, re.DOTALL)
+    if len(matches) == 0:
+        return None
+    return matches[0].strip()
+
+
+def normalize_question(question):
+    """Canonical form of a question used as the SQL cache key"""
+    return normalize_query(question)
+
+
+def db_signature():
+    """Cheap change marker for the database: mtime and size of the db and its WAL file"""
+    signature = []
+    for path in (db_path, db_path.with_name(db_path.name + '-wal')):
+        try:
+            stat = path.stat()
+            signature.append((stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            signature.append(None)
+    return tuple(signature)
+
+
+def question_to_sql(question):
+    """SQL for a question, generated by the LLM unless it is already cached"""
+    key = normalize_question(question)
+    sql = sql_cache.get(key)
+    record_cache('sql', sql is not None)
+    if sql is None:
+        sql = extract_sql(generate_sql_query(question))
+        if sql is not None:
+            sql_cache.put(key, sql)
+    return sql
+
+
+async def aquestion_to_sql(question):
+    """Async version of question_to_sql"""
+    key = normalize_question(question)
+    sql = sql_cache.get(key)
+    record_cache('sql', sql is not None)
+    if sql is None:
+        sql = extract_sql(await agenerate_sql_query(question))
+        if sql is not None:
+            sql_cache.put(key, sql)
+    return sql
+
+
+def known_brands():
+    """Distinct normalized brand names in the product table"""
+    signature = db_signature()
+    if _brands['signature'] != signature:
+        names = ()
+        if db_path.exists():
+            with get_pool(db_path).connection() as conn:
+                rows = conn.execute("SELECT DISTINCT brand_norm FROM product").fetchall()
+            names = tuple(r[0] for r in rows if r[0])
+        _brands.update(signature=signature, names=names)
+    return _brands['names']
+
+
+def translate_with_rules(question):
+    """(sql, params) from the rule-based parser, or None if the question needs the LLM"""
+    with span('sql.rules') as record:
+        parsed = parse_product_query(question, known_brands())
+        record['matched'] = parsed is not None
+    if parsed is None:
+        return None
+    return build_sql(parsed)
+
+
+def translate_with_vectors(question):
+    """(sql, params) from semantic title search for descriptive questions, or None
+
+    Used when the rule-based parser only trips over words it does not know
+    ("comfortable", "breathable", ...): the filters it did find narrow the
+    catalog in SQL and the remaining words are ranked against the title
+    embeddings. None if the question needs the LLM, the index is not built
+    or no title scores above PRODUCT_SEARCH_MIN_SCORE: a weak match is no
+    evidence that the catalog has nothing, so the LLM gets to try.
+    """
+    parsed = parse_product_query(question, known_brands(), free_text=True)
+    if parsed is None or not parsed.keywords:
+        return None
+    with span('sql.vector_search') as record:
+        text = " ".join(parsed.title_terms + parsed.keywords)
+        hits = product_index.search(text, db_path, parsed, k=parsed.limit or SEARCH_RESULTS)
+        record['hits'] = None if hits is None else len(hits)
+    if not hits:
+        return None
+    return product_index.hits_to_sql(hits, parsed.order_by)
+
+
+def translate_locally(question):
+    """(sql, params, path) from the rule-based parser or title search, or None"""
+    for path, translate in (('rules', translate_with_rules), ('vector', translate_with_vectors)):
+        translated = translate(question)
+        if translated is not None:
+            sql, params = translated
+            return sql, params, path
+    return None
 
-def run_query(query):
-    if query.strip().upper().startswith('SELECT'):
-        with sqlite3.connect(db_path) as conn:
-            df = pd.read_sql_query(query, conn)
-            return df
 
+def translate_question(question):
+    """Return (sql, params, path) for a question
 
-def data_comprehension(question, context):
-    chat_completion = client_sql.chat.completions.create(
+    Common catalog searches are handled by the rule-based parser, and
+    descriptive ones by semantic title search; only questions neither can
+    account for go to the LLM. path is 'rules', 'vector' or 'llm'.
+    """
+    translated = translate_locally(question)
+    if translated is not None:
+        return translated
+    return question_to_sql(question), (), 'llm'
+
+
+async def atranslate_question(question):
+    """Async version of translate_question"""
+    translated = await run_blocking(translate_locally, question)
+    if translated is not None:
+        return translated
+    return await aquestion_to_sql(question), (), 'llm'
+
+
+def run_query(query, params=(), max_rows=None):
+    """Run a SELECT through the execution guard and return a db.QueryResult
+
+    The query is capped at sql_guard.MAX_ROWS rows, its plan is checked and
+    it runs within a time and VM-step budget. With max_rows, fetching stops
+    once that many rows are read (result.complete tells whether more
+    matched). Raises sql_guard.QueryError if it is refused or stopped.
+    """
+    try:
+        # One row past max_rows shows whether the answer is missing some
+        query = sql_guard.prepare(query, sql_guard.MAX_ROWS if max_rows is None
+                                  else min(sql_guard.MAX_ROWS, max_rows + 1))
+        # Results are cached until the database file changes
+        key = (query, tuple(params), max_rows, db_signature())
+        result = result_cache.get(key)
+        record_cache('sql_result', result is not None)
+        if result is None:
+            with span('sql.run_query') as record:
+                with get_pool(db_path).connection() as conn:
+                    sql_guard.check_plan(conn, query, params)
+                    with sql_guard.budget(conn):
+                        result = fetch(conn, query, params, max_rows)
+                record['rows'] = len(result)
+            increment('shopassist_rows_total', len(result))
+            result_cache.put(key, result)
+        return result
+    except QueryError as e:
+        increment('shopassist_sql_rejected_total', reason=e.reason)
+        logger.warning("SQL refused (%s): %s", e.reason, query)
+        raise
+
+
+def run_translated(question, sql, params, path, max_rows=None):
+    """run_query() for a translated question, or None if no runnable query was found
+
+    SQL written by the LLM that the guard refuses is sent back to the LLM
+    once with the reason; a working fix replaces it in the SQL cache.
+    """
+    try:
+        return run_query(sql, params, max_rows)
+    except QueryError as e:
+        if path != 'llm':
+            return None
+        repaired = repair_sql_query(question, sql, e)
+    if repaired is None:
+        return None
+    try:
+        response = run_query(repaired, (), max_rows)
+    except QueryError:
+        return None
+    sql_cache.put(normalize_question(question), repaired)
+    return response
+
+
+async def arun_translated(question, sql, params, path, max_rows=None):
+    """Async version of run_translated; database work runs on the blocking pool"""
+    try:
+        return await run_blocking(run_query, sql, params, max_rows)
+    except QueryError as e:
+        if path != 'llm':
+            return None
+        repaired = await arepair_sql_query(question, sql, e)
+    if repaired is None:
+        return None
+    try:
+        response = await run_blocking(run_query, repaired, (), max_rows)
+    except QueryError:
+        return None
+    sql_cache.put(normalize_question(question), repaired)
+    return response
+
+
+def comprehension_request(question, context):
+    """Groq chat completion arguments for answering from query results"""
+    return dict(
         messages=[
             {
                 "role": "system",
@@ -95,28 +367,107 @@ def data_comprehension(question, context):
         # max_tokens=3000
     )
 
+
+def comprehension_error_message(e):
+    return f"Sorry, I could not finish the answer: {str(e)}. Please try asking again."
+
+
+def data_comprehension(question, context, stream=False):
+    with span('sql.comprehension', stream=stream):
+        chat_completion = complete(comprehension_request(question, context), 'sql.comprehension', stream, cache=True)
+
+    if stream:
+        return stream_text(chat_completion, comprehension_error_message, stage='sql.comprehension')
+    record_usage('sql.comprehension', chat_completion.usage)
     return chat_completion.choices[0].message.content
 
 
+async def adata_comprehension(question, context, stream=False):
+    with span('sql.comprehension', stream=stream):
+        chat_completion = await acomplete(
+            comprehension_request(question, context), 'sql.comprehension', stream, cache=True
+        )
 
-def sql_chain(question):
-    sql_query = generate_sql_query(question)
-    pattern = "<SQL>(.*?)</SQL>"
-    matches = re.findall(pattern, sql_query, re.DOTALL)
+    if stream:
+        return astream_text(chat_completion, comprehension_error_message, stage='sql.comprehension')
+    record_usage('sql.comprehension', chat_completion.usage)
+    return chat_completion.choices[0].message.content
 
-    if len(matches) == 0:
-        return "Sorry, LLM is not able to generate a query for your question"
 
-    print(matches[0].strip())
+def is_listing(question, columns):
+    """True if a result should be rendered locally as a product list
+
+    Aggregate questions ("how many", "average", ...) are always summarized
+    by the LLM, even if the query returned whole product rows.
+    """
+    return is_product_list(columns) and not UNSUPPORTED.search(question.lower())
+
+
+no_sql_message = "Sorry, LLM is not able to generate a query for your question"
+query_failed_message = "Sorry, there was a problem executing SQL query"
+
+
+def _record_path(sql, params, path):
+    sql_path_counts[path] += 1
+    increment('shopassist_sql_path_total', path=path)
+    if sql is not None:
+        logger.debug("SQL path: %s %s %s", path, sql, params)
+
+
+@coalesce('sql')
+def sql_chain(question, stream=False, translated=None):
+    """Answer a product question from the database
+
+    With stream=True, returns a generator of text chunks. translated is an
+    optional translate_question() result computed ahead of time.
+    """
+    reply = as_stream if stream else str
+    sql, params, path = translated or translate_question(question)
+    _record_path(sql, params, path)
+
+    if sql is None:
+        return reply(no_sql_message)
+
+    result = run_translated(question, sql, params, path, ANSWER_MAX_ROWS)
+    if result is None:
+        return reply(query_failed_message)
+
+    # Product listings are formatted locally; only aggregates need the LLM
+    if is_listing(question, result.columns):
+        return reply(render_product_list(result.rows, complete=result.complete))
+
+    # Compact the rows to a token budget; links travel as [P1]-style ids
+    context, links = serialize_rows(result.rows, complete=result.complete)
+
+    answer = data_comprehension(question, context, stream)
+    if stream:
+        return expand_links_stream(answer, links)
+    return expand_links(answer, links)
+
+
+@coalesce('sql')
+async def asql_chain(question, stream=False, translated=None):
+    """Async version of sql_chain; database work runs on the blocking pool"""
+    reply = aas_stream if stream else str
+    sql, params, path = translated or await atranslate_question(question)
+    _record_path(sql, params, path)
+
+    if sql is None:
+        return reply(no_sql_message)
+
+    result = await arun_translated(question, sql, params, path, ANSWER_MAX_ROWS)
+    if result is None:
+        return reply(query_failed_message)
 
-    response = run_query(matches[0].strip())
-    if response is None:
-        return "Sorry, there was a problem executing SQL query"
+    if is_listing(question, result.columns):
+        return reply(render_product_list(result.rows, complete=result.complete))
 
-    context = response.to_dict(orient='records')
+    context, links = serialize_rows(result.rows, complete=result.complete)
 
-    answer = data_comprehension(question, context)
-    return answer
+    answer = await adata_comprehension(question, context, stream)
+    if stream:
+        return aexpand_links_stream(answer, links)
+    return expand_links(answer, links)
 
 
 if __name__ == "__main__":
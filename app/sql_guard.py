@@ -0,0 +1,136 @@
+"""
+Execution guard for SQL run against the catalog.
+
+The query is generated by an LLM, so run_query passes it through here first:
+
+* prepare() accepts a single SELECT (or WITH ... SELECT) only, and adds
+  LIMIT SQL_MAX_ROWS when the query has no limit or a larger literal one.
+* check_plan() runs EXPLAIN QUERY PLAN and rejects plans that loop a full
+  scan inside another one: joins without a usable join condition, and
+  correlated subqueries that scan a table for every outer row.
+* budget() aborts execution through SQLite's progress handler once the
+  query has run for SQL_TIMEOUT seconds or SQL_MAX_STEPS virtual machine
+  steps.
+
+Connections come from the read-only pool (db.py), so nothing can write.
+Every refusal is a QueryError whose reason tells sql_chain what went wrong.
+"""
+import os
+import re
+import time
+import sqlite3
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+load_dotenv()
+
+MAX_ROWS = int(os.getenv('SQL_MAX_ROWS', '200'))
+TIMEOUT = float(os.getenv('SQL_TIMEOUT', '2'))
+MAX_STEPS = int(os.getenv('SQL_MAX_STEPS', '50000000'))
+PROGRESS_INTERVAL = 1000  # VM steps between budget checks
+
+_trailing_limit = re.compile(
+    r"\blimit\s+(\d+|\?)(?:\s*(?:,|\boffset\b)\s*(?:\d+|\?))?\s*$", re.IGNORECASE
+)
+
+
+class QueryError(Exception):
+    """A query the guard refused or stopped
+
+    reason is one of 'not_select', 'invalid', 'cartesian', 'correlated_scan'
+    or 'budget'; detail is a short explanation that can be shown to the LLM.
+    """
+
+    def __init__(self, reason, detail):
+        super().__init__(f"{reason}: {detail}")
+        self.reason = reason
+        self.detail = detail
+
+
+def prepare(query, max_rows=MAX_ROWS):
+    """The query to run: a single SELECT whose result is capped at max_rows rows"""
+    query = query.strip().rstrip(';').strip()
+    first_word = query.lstrip('(').split(None, 1)[0].upper() if query else ''
+    if first_word not in ('SELECT', 'WITH'):
+        raise QueryError('not_select', "only a single SELECT query can be run")
+
+    limit = _trailing_limit.search(query)
+    if limit is None:
+        # On its own line so a trailing -- comment cannot swallow it
+        return f"{query}\nLIMIT {max_rows}"
+    if limit.group(1).isdigit() and int(limit.group(1)) > max_rows:
+        start, end = limit.span(1)
+        return f"{query[:start]}{max_rows}{query[end:]}"
+    return query
+
+
+def _is_full_scan(detail):
+    # SEARCH uses an index; SCAN reads a whole table or index. FTS lookups
+    # show as SCAN ... VIRTUAL TABLE and constant rows as SCAN CONSTANT ROW.
+    return detail.startswith('SCAN ') and 'VIRTUAL TABLE' not in detail and detail != 'SCAN CONSTANT ROW'
+
+
+def check_plan(conn, query, params=()):
+    """Reject plans that nest a full scan inside another; returns the plan rows
+
+    Also catches queries SQLite cannot prepare, as QueryError('invalid').
+    """
+    try:
+        plan = conn.execute(f"EXPLAIN QUERY PLAN {query}", tuple(params)).fetchall()
+    except sqlite3.Error as e:
+        raise QueryError('invalid', str(e)) from None
+
+    details = {node: detail for node, _, _, detail in plan}
+    parents = {node: parent for node, parent, _, _ in plan}
+    scans_by_parent = {}
+    for node, parent, _, detail in plan:
+        if not _is_full_scan(detail):
+            continue
+        scans_by_parent.setdefault(parent, []).append(detail[5:])
+        ancestor = parent
+        while ancestor in details:
+            if details[ancestor].startswith('CORRELATED'):
+                raise QueryError(
+                    'correlated_scan',
+                    f"a correlated subquery scans all of {detail[5:]} for every outer row; "
+                    "rewrite it as a join or an uncorrelated subquery"
+                )
+            ancestor = parents[ancestor]
+    for tables in scans_by_parent.values():
+        if len(tables) > 1:
+            raise QueryError(
+                'cartesian',
+                f"the query joins {' and '.join(tables)} by scanning each in full (a cartesian product); "
+                "add a join condition on indexed columns"
+            )
+    return plan
+
+
+@contextmanager
+def budget(conn, timeout=TIMEOUT, max_steps=MAX_STEPS):
+    """Abort statements run on conn inside the block after timeout seconds or max_steps VM steps"""
+    deadline = time.monotonic() + timeout
+    state = {'steps': 0, 'tripped': False}
+
+    def progress():
+        state['steps'] += PROGRESS_INTERVAL
+        if state['steps'] > max_steps or time.monotonic() > deadline:
+            state['tripped'] = True
+            return 1  # Non-zero interrupts the running statement
+        return 0
+
+    start = time.monotonic()
+    conn.set_progress_handler(progress, PROGRESS_INTERVAL)
+    try:
+        yield
+    except Exception:
+        # Whatever the caller turned the "interrupted" error into, the flag says why it stopped
+        if state['tripped']:
+            raise QueryError(
+                'budget',
+                f"the query was stopped after {time.monotonic() - start:.1f}s and about {state['steps']} steps; "
+                "filter on indexed columns (brand_norm, price, discount, avg_rating) or use the title search"
+            ) from None
+        raise
+    finally:
+        conn.set_progress_handler(None, 0)
@@ -0,0 +1,202 @@
+"""
+Per-stage tracing and metrics.
+
+Spans time a pipeline stage and feed a latency histogram; counters track
+routes, cache hits, rows and LLM tokens. Metrics are rendered in Prometheus
+text format (served at /metrics by api.py, or on METRICS_PORT by
+serve_metrics()). With TRACE_FILE set, every finished span is also appended
+to that file as one JSON line, tagged with the trace id of the request.
+"""
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger("shopassist")
+# LOG_LEVEL=DEBUG shows per-stage timings, route scores and generated SQL
+if os.getenv('LOG_LEVEL'):
+    logging.basicConfig(format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    logger.setLevel(os.getenv('LOG_LEVEL').upper())
+
+TRACE_FILE = os.getenv('TRACE_FILE')
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_lock = threading.Lock()
+_counters = {}    # (name, labels) -> value
+_histograms = {}  # (name, labels) -> [bucket counts..., +Inf count, sum]
+_help = {
+    'shopassist_stage_seconds': ('histogram', 'Latency of each pipeline stage'),
+    'shopassist_stage_errors_total': ('counter', 'Pipeline stages that raised'),
+    'shopassist_route_total': ('counter', 'Queries per route'),
+    'shopassist_cache_total': ('counter', 'Cache lookups by cache and result'),
+    'shopassist_rows_total': ('counter', 'Rows returned by run_query'),
+    'shopassist_sql_path_total': ('counter', 'SQL questions by translation path (rules or llm)'),
+    'shopassist_sql_rejected_total': ('counter', 'Queries refused or stopped by the SQL execution guard, by reason'),
+    'shopassist_llm_tokens_total': ('counter', 'LLM tokens by stage and kind'),
+    'shopassist_coalesced_total': ('counter', 'Chain calls answered by an identical in-flight call, by route'),
+    'shopassist_llm_retries_total': ('counter', 'LLM requests retried, by stage and status or error'),
+    'shopassist_llm_hedges_total': ('counter', 'Duplicate LLM requests sent after the hedge delay'),
+    'shopassist_llm_hedge_wins_total': ('counter', 'Hedged LLM calls by the request that answered first'),
+    'shopassist_llm_rejected_total': ('counter', 'LLM calls failed fast by the open circuit breaker'),
+    'shopassist_llm_breaker_transitions_total': ('counter', 'LLM circuit breaker state changes'),
+}
+
+_trace_id = contextvars.ContextVar('trace_id', default=None)
+_trace_lock = threading.Lock()
+
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def increment(name, value=1, **labels):
+    """Add value to a counter"""
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, value, **labels):
+    """Record a value in a histogram"""
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.setdefault(key, [0] * (len(BUCKETS) + 2))
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                histogram[i] += 1
+        histogram[len(BUCKETS)] += 1
+        histogram[-1] += value
+
+
+def start_trace():
+    """Start a new trace for the current request; spans inherit its id"""
+    trace_id = uuid.uuid4().hex
+    _trace_id.set(trace_id)
+    return trace_id
+
+
+@contextmanager
+def span(stage, **attributes):
+    """Time a pipeline stage
+
+    Yields a dict; keys set on it (rows, route, score, ...) are recorded
+    with the span in the trace file.
+    """
+    record = dict(attributes)
+    start = time.perf_counter()
+    error = None
+    try:
+        yield record
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        observe('shopassist_stage_seconds', duration, stage=stage)
+        if error is not None:
+            increment('shopassist_stage_errors_total', stage=stage)
+        logger.debug("%s took %.1f ms %s", stage, duration * 1000, record)
+        if TRACE_FILE:
+            _write_trace({
+                'trace_id': _trace_id.get(),
+                'stage': stage,
+                'start': time.time() - duration,
+                'duration_ms': round(duration * 1000, 3),
+                'error': repr(error) if error is not None else None,
+                **record,
+            })
+
+
+def _write_trace(record):
+    line = json.dumps(record, default=str)
+    with _trace_lock:
+        with open(TRACE_FILE, 'a', encoding='utf-8') as f:
+            f.write(line + "\n")
+
+
+def record_usage(stage, usage):
+    """Count prompt and completion tokens from a completion's usage"""
+    if usage is None:
+        return
+    increment('shopassist_llm_tokens_total', usage.prompt_tokens or 0, stage=stage, kind='prompt')
+    increment('shopassist_llm_tokens_total', usage.completion_tokens or 0, stage=stage, kind='completion')
+
+
+def record_cache(cache, hit):
+    increment('shopassist_cache_total', cache=cache, result='hit' if hit else 'miss')
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def render_prometheus():
+    """All metrics in the Prometheus text exposition format"""
+    with _lock:
+        counters = dict(_counters)
+        histograms = {k: list(v) for k, v in _histograms.items()}
+
+    lines = []
+    described = set()
+
+    def describe(name):
+        if name not in described and name in _help:
+            kind, text = _help[name]
+            lines.append(f"# HELP {name} {text}")
+            lines.append(f"# TYPE {name} {kind}")
+            described.add(name)
+
+    for (name, labels), value in sorted(counters.items()):
+        describe(name)
+        lines.append(f"{name}{_format_labels(labels)} {value}")
+    for (name, labels), histogram in sorted(histograms.items()):
+        describe(name)
+        for bound, count in zip(BUCKETS, histogram):
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {count}")
+        lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {histogram[len(BUCKETS)]}")
+        lines.append(f"{name}_count{_format_labels(labels)} {histogram[len(BUCKETS)]}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {histogram[-1]}")
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        body = render_prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+_metrics_server = None
+
+
+def serve_metrics(port=None):
+    """Serve /metrics from a background thread (once per process) when a port is configured"""
+    global _metrics_server
+    port = port or os.getenv('METRICS_PORT')
+    if not port or _metrics_server is not None:
+        return
+    with _lock:
+        if _metrics_server is None:
+            _metrics_server = ThreadingHTTPServer(('0.0.0.0', int(port)), _MetricsHandler)
+            threading.Thread(target=_metrics_server.serve_forever, daemon=True).start()
@@ -0,0 +1,174 @@
+"""
+Accuracy parity and speed of the embedding backends.
+
+    python benchmarks/embedding_backends.py --candidate onnx --reference torch
+
+Encodes the route utterances, the FAQ questions and the routing evaluation
+queries (app/resources/routing_eval.csv) with both backends and reports:
+
+* cosine similarity between the two backends' vectors for the same text,
+* how often both backends pick the same route and the same top FAQ,
+* single-query latency (p50/p95), batch throughput, and the memory each
+  backend adds to a fresh process (measured in a subprocess per backend).
+
+Exits with status 1 if parity falls below --min-cosine or --min-agreement.
+"""
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+import resource
+import subprocess
+from pathlib import Path
+import numpy as np
+
+root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(root / "app"))
+
+import embeddings
+from route_index import router_scores
+
+faqs_path = root / "app/resources/faq_data.csv"
+eval_path = root / "app/resources/routing_eval.csv"
+
+
+def rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+def load_corpus():
+    from router import faq, sql, chitchat
+    routes = {route.name: list(route.utterances) for route in (faq, sql, chitchat)}
+    with open(faqs_path, newline='', encoding='utf-8') as f:
+        faq_questions = [row['question'] for row in csv.DictReader(f)]
+    with open(eval_path, newline='', encoding='utf-8') as f:
+        queries = [row['query'] for row in csv.DictReader(f)]
+    return routes, faq_questions, queries
+
+
+def route_choices(query_vectors, route_vectors, threshold, top_k=5):
+    """Index of the route SemanticRouter would pick for each query, -1 for none"""
+    normalized = [vectors / np.linalg.norm(vectors, axis=1, keepdims=True) for vectors in route_vectors.values()]
+    route_ids = np.concatenate([np.full(len(vectors), j) for j, vectors in enumerate(normalized)])
+    queries = query_vectors / np.linalg.norm(query_vectors, axis=1, keepdims=True)
+    means, maxima = router_scores(queries @ np.vstack(normalized).T, route_ids, len(normalized), top_k)
+    best = np.nanargmax(means, axis=1)
+    passed = maxima[np.arange(len(best)), best] > threshold
+    return np.where(passed, best, -1)
+
+
+def encode_all(backend, routes, faq_questions, queries):
+    return (
+        {name: backend.encode(utterances) for name, utterances in routes.items()},
+        backend.encode(faq_questions),
+        backend.encode(queries),
+    )
+
+
+def parity(reference, candidate, routes, faq_questions, queries):
+    ref_routes, ref_faqs, ref_queries = encode_all(reference, routes, faq_questions, queries)
+    cand_routes, cand_faqs, cand_queries = encode_all(candidate, routes, faq_questions, queries)
+
+    ref_all = np.vstack(list(ref_routes.values()) + [ref_faqs, ref_queries])
+    cand_all = np.vstack(list(cand_routes.values()) + [cand_faqs, cand_queries])
+    cosines = (ref_all * cand_all).sum(axis=1) / (
+        np.linalg.norm(ref_all, axis=1) * np.linalg.norm(cand_all, axis=1))
+
+    # Each backend routes and retrieves with its own vectors, as it would in production
+    from router import SCORE_THRESHOLD
+    ref_route = route_choices(ref_queries, ref_routes, SCORE_THRESHOLD)
+    cand_route = route_choices(cand_queries, cand_routes, SCORE_THRESHOLD)
+    ref_faq = (ref_queries @ ref_faqs.T).argmax(axis=1)
+    cand_faq = (cand_queries @ cand_faqs.T).argmax(axis=1)
+    return {
+        'texts': len(cosines),
+        'cosine_min': float(cosines.min()),
+        'cosine_mean': float(cosines.mean()),
+        'route_agreement': float((ref_route == cand_route).mean()),
+        'faq_top1_agreement': float((ref_faq == cand_faq).mean()),
+    }
+
+
+def speed(backend, queries, repeat):
+    backend.encode(queries[:1])  # warm-up
+    latencies = []
+    for _ in range(repeat):
+        for query in queries:
+            start = time.perf_counter()
+            backend.encode([query])
+            latencies.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        backend.encode(queries, batch_size=64)
+    elapsed = time.perf_counter() - start
+    latencies = np.array(latencies) * 1000
+    return {
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p95_ms': float(np.percentile(latencies, 95)),
+        'batch_texts_per_s': len(queries) * repeat / elapsed,
+    }
+
+
+def measure_memory(name):
+    """Peak RSS of a fresh process that loads the backend and encodes the corpus"""
+    _, faq_questions, queries = load_corpus()
+    before = rss_mb()
+    backend = embeddings.load_backend(name)
+    backend.encode(faq_questions + queries)
+    return {'rss_before_mb': before, 'rss_after_mb': rss_mb()}
+
+
+def memory_in_subprocess(name):
+    output = subprocess.run(
+        [sys.executable, __file__, '--memory-only', name],
+        check=True, capture_output=True, text=True, env=os.environ.copy()
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare embedding backends for accuracy parity and speed")
+    parser.add_argument('--reference', default='torch', choices=list(embeddings.BACKENDS))
+    parser.add_argument('--candidate', default='onnx', choices=list(embeddings.BACKENDS))
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--min-cosine', type=float, default=0.98)
+    parser.add_argument('--min-agreement', type=float, default=0.97)
+    parser.add_argument('--json', help="also write the results to this file")
+    parser.add_argument('--memory-only', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.memory_only:
+        print(json.dumps(measure_memory(args.memory_only)))
+        sys.exit(0)
+
+    routes, faq_questions, queries = load_corpus()
+    reference = embeddings.load_backend(args.reference)
+    candidate = embeddings.load_backend(args.candidate)
+
+    results = {'reference': args.reference, 'candidate': args.candidate}
+    results['parity'] = parity(reference, candidate, routes, faq_questions, queries)
+    p = results['parity']
+    print(f"Parity of {args.candidate} against {args.reference} over {p['texts']} texts")
+    print(f"  cosine min {p['cosine_min']:.4f}, mean {p['cosine_mean']:.4f}")
+    print(f"  same route for {p['route_agreement']:.1%} of eval queries, "
+          f"same top FAQ for {p['faq_top1_agreement']:.1%}")
+
+    print(f"\n{'backend':<10}{'p50 ms':>10}{'p95 ms':>10}{'batch texts/s':>16}{'RSS added MB':>15}")
+    for name, backend in ((args.reference, reference), (args.candidate, candidate)):
+        results[name] = speed(backend, queries, args.repeat)
+        memory = memory_in_subprocess(name)
+        results[name]['rss_added_mb'] = memory['rss_after_mb'] - memory['rss_before_mb']
+        r = results[name]
+        print(f"{name:<10}{r['p50_ms']:>10.2f}{r['p95_ms']:>10.2f}{r['batch_texts_per_s']:>16.0f}"
+              f"{r['rss_added_mb']:>15.0f}")
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2), encoding='utf-8')
+
+    passed = p['cosine_min'] >= args.min_cosine and min(p['route_agreement'], p['faq_top1_agreement']) >= args.min_agreement
+    print(f"\nParity {'OK' if passed else 'FAILED'} (min cosine >= {args.min_cosine}, agreement >= {args.min_agreement})")
+    sys.exit(0 if passed else 1)
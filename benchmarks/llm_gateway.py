@@ -0,0 +1,116 @@
+"""
+Tail latency and error rate of LLM calls through the gateway (app/llm.py).
+
+    python benchmarks/llm_gateway.py --error-rate 0.1 --slow-rate 0.03 --requests 200 --concurrency 8
+
+Starts the local LLM stub with the given fraction of failing (--status-code)
+and slow (--slow-latency) requests, then sends the same calls through
+llm.complete() twice: once as a plain client would (no retries, no hedging)
+and once with retries and hedging on. Reports the share of calls that
+succeeded, p50/p95/p99 latency, and how many retries, hedges and breaker
+rejections the gateway made.
+"""
+import os
+import sys
+import time
+import argparse
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(root / "app"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import stub_server
+
+STAGE = 'benchmark.llm'
+COUNTERS = ('shopassist_llm_retries_total', 'shopassist_llm_hedges_total', 'shopassist_llm_rejected_total')
+
+
+def request():
+    return dict(
+        model=os.environ['GROQ_MODEL'],
+        messages=[{'role': 'user', 'content': 'Do you offer free delivery?'}],
+        temperature=0,
+        max_tokens=100
+    )
+
+
+def counter_totals():
+    import telemetry
+    return {name: sum(v for (n, _), v in telemetry._counters.items() if n == name) for name in COUNTERS}
+
+
+def run(requests, concurrency, retries, hedge):
+    import llm
+    llm.MAX_RETRIES = retries
+    llm.breaker = llm.CircuitBreaker()
+    llm._latencies.clear()
+    # Fill the latency window so the hedge delay is known before measuring
+    for _ in range(llm.HEDGE_MIN_SAMPLES):
+        try:
+            llm.complete(request(), STAGE)
+        except Exception:
+            pass
+
+    def call(_):
+        start = time.perf_counter()
+        try:
+            llm.complete(request(), STAGE, hedge=hedge)
+            ok = True
+        except Exception:
+            ok = False
+        return ok, time.perf_counter() - start
+
+    before = counter_totals()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(call, range(requests)))
+    after = counter_totals()
+    latencies = np.array([seconds for _, seconds in results]) * 1000
+    return {
+        'success': sum(ok for ok, _ in results) / len(results),
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p95_ms': float(np.percentile(latencies, 95)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+        'hedge_delay_ms': (llm.hedge_delay(STAGE) or 0) * 1000,
+        **{name.replace('shopassist_llm_', '').replace('_total', ''): after[name] - before[name] for name in COUNTERS},
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare plain and gateway LLM calls against a flaky local stub")
+    parser.add_argument('--latency', type=float, default=0.2, help="stub time to first token (s)")
+    parser.add_argument('--error-rate', type=float, default=0.1)
+    parser.add_argument('--status-code', type=int, default=503)
+    parser.add_argument('--slow-rate', type=float, default=0.03)
+    parser.add_argument('--slow-latency', type=float, default=2.0)
+    parser.add_argument('--completion-tokens', type=int, default=20)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--retries', type=int, default=3)
+    args = parser.parse_args()
+
+    stub_server.StubConfig.latency = args.latency
+    stub_server.StubConfig.error_rate = args.error_rate
+    stub_server.StubConfig.status_code = args.status_code
+    stub_server.StubConfig.slow_rate = args.slow_rate
+    stub_server.StubConfig.slow_latency = args.slow_latency
+    stub_server.StubConfig.completion_tokens = args.completion_tokens
+    _, base_url = stub_server.start()
+    os.environ['GROQ_BASE_URL'] = base_url
+    os.environ.setdefault('GROQ_API_KEY', 'benchmark')
+    os.environ.setdefault('GROQ_MODEL', 'stub-model')
+    os.environ['LLM_CACHE_MODE'] = 'off'  # Every call must reach the stub
+
+    rows = {
+        'plain': run(args.requests, args.concurrency, retries=0, hedge=False),
+        'gateway': run(args.requests, args.concurrency, retries=args.retries, hedge=True),
+    }
+    print(f"{args.requests} calls, concurrency {args.concurrency}: {args.error_rate:.0%} fail with "
+          f"{args.status_code}, {args.slow_rate:.0%} take {args.slow_latency}s")
+    print(f"{'':<10}{'success':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'hedge at':>10}"
+          f"{'retries':>9}{'hedges':>8}{'rejected':>10}")
+    for name, r in rows.items():
+        print(f"{name:<10}{r['success']:>9.1%}{r['p50_ms']:>9.0f}{r['p95_ms']:>9.0f}{r['p99_ms']:>9.0f}"
+              f"{r['hedge_delay_ms']:>10.0f}{r['retries']:>9.0f}{r['hedges']:>8.0f}{r['rejected']:>10.0f}")
@@ -0,0 +1,190 @@
+"""
+End-to-end latency benchmark for the assistant.
+
+    python benchmarks/run.py --latency 0.3 --tokens-per-second 250 --concurrency 1 8 32
+
+Starts the local LLM stub (benchmarks/stub_server.py) unless --base-url points
+at a running one, then runs the query corpus (app/resources/routing_eval.csv)
+through the individual stages and through ask(), faq_chain and sql_chain, and
+prints p50/p95/p99 per stage, throughput at each concurrency level and peak
+RSS. Requires app/db.sqlite (see web-scrapping/csv_to_sqlite.py).
+"""
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+import resource
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(root / "app"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import stub_server
+
+corpus_path = root / "app/resources/routing_eval.csv"
+
+
+def load_corpus(path=corpus_path):
+    with open(path, newline='', encoding='utf-8') as f:
+        return [(row['query'], row['route']) for row in csv.DictReader(f)]
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+def summarize(samples):
+    values = np.array(samples) * 1000
+    return {
+        'n': len(values),
+        'p50_ms': float(np.percentile(values, 50)),
+        'p95_ms': float(np.percentile(values, 95)),
+        'p99_ms': float(np.percentile(values, 99)),
+        'mean_ms': float(values.mean()),
+    }
+
+
+def timed(samples, fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    samples.append(time.perf_counter() - start)
+    return result
+
+
+def clear_caches():
+    import faq
+    import sql
+    faq.answer_cache.clear()
+    sql.sql_cache.clear()
+    sql.result_cache.clear()
+
+
+def bench_stages(corpus, repeat, warm_caches):
+    """Time each pipeline stage separately"""
+    import embeddings
+    import faq
+    import sql
+    import chitchat
+    from router import get_router
+
+    router = get_router()
+    stages = {name: [] for name in (
+        'encode', 'route', 'faq.retrieve', 'faq.llm', 'sql.translate', 'sql.run_query',
+        'sql.comprehension', 'chitchat.llm', 'faq_chain', 'sql_chain',
+    )}
+    for _ in range(repeat):
+        for query, route in corpus:
+            if not warm_caches:
+                clear_caches()
+            vector = timed(stages['encode'], embeddings.encode_query, query)
+            timed(stages['route'], router, vector=vector)
+            if route == 'faq':
+                result = timed(stages['faq.retrieve'], faq.get_relevant_qa, query, vector)
+                context = " ".join(r.get('answer', '') for r in result['metadatas'][0])
+                timed(stages['faq.llm'], faq.generate_answer, query, context)
+                if not warm_caches:
+                    clear_caches()
+                timed(stages['faq_chain'], faq.faq_chain, query, vector)
+            elif route == 'sql':
+                sql_text, params, _ = timed(stages['sql.translate'], sql.translate_question, query)
+                if sql_text is not None:
+                    response = timed(stages['sql.run_query'], sql.run_query, sql_text, params, sql.ANSWER_MAX_ROWS)
+                    if response is not None:
+                        context, _ = sql.serialize_rows(response.rows, complete=response.complete)
+                        timed(stages['sql.comprehension'], sql.data_comprehension, query, context)
+                if not warm_caches:
+                    clear_caches()
+                timed(stages['sql_chain'], sql.sql_chain, query)
+            else:
+                timed(stages['chitchat.llm'], chitchat.chitchat_chain, query)
+    return {name: summarize(samples) for name, samples in stages.items() if samples}
+
+
+def bench_ask(corpus, concurrency, repeat, warm_caches):
+    """Run ask() over the corpus from concurrent clients"""
+    from assistant import ask
+
+    queries = [query for query, _ in corpus] * repeat
+    latencies = []
+
+    def client(query):
+        if not warm_caches:
+            clear_caches()
+        start = time.perf_counter()
+        ask(query)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies.extend(pool.map(client, queries))
+    elapsed = time.perf_counter() - start
+    summary = summarize(latencies)
+    summary['concurrency'] = concurrency
+    summary['throughput_rps'] = len(queries) / elapsed
+    return summary
+
+
+def print_table(title, rows):
+    print(f"\n{title}")
+    print(f"{'':<22}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'mean ms':>10}")
+    for name, s in rows.items():
+        print(f"{name:<22}{s['n']:>6}{s['p50_ms']:>10.1f}{s['p95_ms']:>10.1f}{s['p99_ms']:>10.1f}{s['mean_ms']:>10.1f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="End-to-end latency benchmark with a local LLM stub")
+    parser.add_argument('--base-url', help="use an already running stub/LLM server instead of starting one")
+    parser.add_argument('--latency', type=float, default=0.3, help="stub time to first token (s)")
+    parser.add_argument('--tokens-per-second', type=float, default=250.0)
+    parser.add_argument('--completion-tokens', type=int, default=60)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--warm-caches', action='store_true', help="keep answer/SQL caches between queries")
+    parser.add_argument('--single-flight', action='store_true',
+                        help="merge identical in-flight questions, as in production")
+    parser.add_argument('--corpus', default=str(corpus_path))
+    parser.add_argument('--json', help="also write the results to this file")
+    args = parser.parse_args()
+
+    base_url = args.base_url
+    if base_url is None:
+        stub_server.StubConfig.latency = args.latency
+        stub_server.StubConfig.tokens_per_second = args.tokens_per_second
+        stub_server.StubConfig.completion_tokens = args.completion_tokens
+        _, base_url = stub_server.start()
+    # Configure the Groq clients before the app creates them
+    os.environ['GROQ_BASE_URL'] = base_url
+    os.environ.setdefault('GROQ_API_KEY', 'benchmark')
+    os.environ.setdefault('GROQ_MODEL', 'stub-model')
+    # The on-disk LLM completion cache would answer repeated queries without a call
+    os.environ.setdefault('LLM_CACHE_MODE', 'on' if args.warm_caches else 'off')
+    # The corpus is replayed `repeat` times concurrently; merged duplicates would inflate throughput
+    os.environ['SINGLE_FLIGHT'] = '1' if args.single_flight else '0'
+
+    import faq
+    faq.ingest_faq_data(faq.faqs_path)
+
+    corpus = load_corpus(args.corpus)
+    results = {'config': vars(args), 'base_url': base_url}
+
+    results['stages'] = bench_stages(corpus, args.repeat, args.warm_caches)
+    print_table("Per-stage latency", results['stages'])
+
+    results['ask'] = [bench_ask(corpus, c, args.repeat, args.warm_caches) for c in args.concurrency]
+    print_table(f"ask() end to end (single-flight {'on' if args.single_flight else 'off'})", {f"concurrency={r['concurrency']}": r for r in results['ask']})
+    print(f"\n{'concurrency':<14}{'throughput (req/s)':>20}")
+    for r in results['ask']:
+        print(f"{r['concurrency']:<14}{r['throughput_rps']:>20.1f}")
+
+    results['peak_rss_mb'] = peak_rss_mb()
+    print(f"\nPeak RSS: {results['peak_rss_mb']:.0f} MB")
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2), encoding='utf-8')
@@ -0,0 +1,176 @@
+"""
+Local stand-in for the Groq (OpenAI-compatible) chat completions API.
+
+    python benchmarks/stub_server.py --port 8765 --latency 0.3 --tokens-per-second 250
+
+Point the app at it with GROQ_BASE_URL=http://127.0.0.1:8765. Each request
+waits --latency seconds (time to first token), then emits --completion-tokens
+tokens at --tokens-per-second, streamed as server-sent events when the
+request asks for stream=true. --error-rate fails that fraction of requests
+with --status-code, and --slow-rate delays that fraction by --slow-latency
+instead, to exercise the gateway's retries and hedging (app/llm.py). Requests whose system prompt asks for <SQL>
+tags get a fixed SQL query back so the SQL chain runs end to end.
+"""
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SQL_RESPONSE = "<SQL>SELECT * FROM product WHERE brand_norm = 'campus' ORDER BY avg_rating DESC LIMIT 5</SQL>"
+WORDS = "Sure! Here is a short and helpful answer about your question from our shopping assistant".split()
+
+
+class StubConfig:
+    latency = 0.3
+    tokens_per_second = 250.0
+    completion_tokens = 60
+    # Fail this fraction of requests with status_code, for exercising retries
+    error_rate = 0.0
+    status_code = 503
+    # Delay this fraction of requests by slow_latency instead of latency, for exercising hedging
+    slow_rate = 0.0
+    slow_latency = 3.0
+
+
+def completion_tokens(messages):
+    system = next((m['content'] for m in messages if m['role'] == 'system'), '')
+    if '<SQL>' in system:
+        return [SQL_RESPONSE]
+    return [WORDS[i % len(WORDS)] + " " for i in range(StubConfig.completion_tokens)]
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    requests_served = 0
+    _counter_lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def handle(self):
+        # Clients hang up on purpose: a hedged request that lost, a cancelled stream
+        try:
+            super().handle()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        request = json.loads(self.rfile.read(length) or b'{}')
+        if not self.path.endswith('/chat/completions'):
+            self._send_json(404, {'error': {'message': f'unknown path {self.path}'}})
+            return
+
+        with StubHandler._counter_lock:
+            StubHandler.requests_served += 1
+            serial = StubHandler.requests_served
+        if StubConfig.error_rate and (serial * StubConfig.error_rate) % 1 < StubConfig.error_rate:
+            self._send_json(StubConfig.status_code, {'error': {'message': 'stub induced failure'}})
+            return
+
+        tokens = completion_tokens(request.get('messages', []))
+        prompt_tokens = sum(len(m.get('content', '')) // 4 for m in request.get('messages', []))
+        usage = {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': len(tokens),
+            'total_tokens': prompt_tokens + len(tokens),
+        }
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        model = request.get('model', 'stub')
+        # Seeded per request so runs are repeatable and slow requests are not the failing ones
+        slow = random.Random(serial).random() < StubConfig.slow_rate
+        time.sleep(StubConfig.slow_latency if slow else StubConfig.latency)
+
+        if not request.get('stream'):
+            time.sleep(len(tokens) / StubConfig.tokens_per_second)
+            self._send_json(200, {
+                'id': completion_id,
+                'object': 'chat.completion',
+                'created': created,
+                'model': model,
+                'choices': [{
+                    'index': 0,
+                    'message': {'role': 'assistant', 'content': "".join(tokens)},
+                    'finish_reason': 'stop',
+                }],
+                'usage': usage,
+            })
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        def send_event(payload):
+            data = f"data: {payload}\n\n".encode('utf-8')
+            self.wfile.write(f"{len(data):X}\r\n".encode('ascii') + data + b"\r\n")
+            self.wfile.flush()
+
+        for i, token in enumerate(tokens):
+            if i:
+                time.sleep(1 / StubConfig.tokens_per_second)
+            send_event(json.dumps({
+                'id': completion_id,
+                'object': 'chat.completion.chunk',
+                'created': created,
+                'model': model,
+                'choices': [{'index': 0, 'delta': {'content': token}, 'finish_reason': None}],
+            }))
+        send_event(json.dumps({
+            'id': completion_id,
+            'object': 'chat.completion.chunk',
+            'created': created,
+            'model': model,
+            'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}],
+            'x_groq': {'usage': usage},
+        }))
+        send_event('[DONE]')
+        self.wfile.write(b"0\r\n\r\n")
+
+
+def start(host='127.0.0.1', port=0):
+    """Start the stub in a background thread; returns (server, base_url)"""
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Local Groq/OpenAI-compatible stub server")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=StubConfig.latency)
+    parser.add_argument('--tokens-per-second', type=float, default=StubConfig.tokens_per_second)
+    parser.add_argument('--completion-tokens', type=int, default=StubConfig.completion_tokens)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--status-code', type=int, default=503)
+    parser.add_argument('--slow-rate', type=float, default=0.0)
+    parser.add_argument('--slow-latency', type=float, default=StubConfig.slow_latency)
+    args = parser.parse_args()
+
+    StubConfig.latency = args.latency
+    StubConfig.tokens_per_second = args.tokens_per_second
+    StubConfig.completion_tokens = args.completion_tokens
+    StubConfig.error_rate = args.error_rate
+    StubConfig.status_code = args.status_code
+    StubConfig.slow_rate = args.slow_rate
+    StubConfig.slow_latency = args.slow_latency
+
+    server = ThreadingHTTPServer((args.host, args.port), StubHandler)
+    server.daemon_threads = True
+    print(f"Stub LLM server on http://{args.host}:{args.port}")
+    server.serve_forever()
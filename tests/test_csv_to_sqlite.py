@@ -0,0 +1,54 @@
+import sys
+import types
+import sqlite3
+from pathlib import Path
+
+root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(root / "web-scrapping"))
+
+import csv_to_sqlite
+
+CATALOG = root / "app" / "resources" / "ecommerce_data_final.csv"
+
+
+def _load(csv_path, db_path, capsys):
+    csv_to_sqlite.main(str(csv_path), str(db_path), chunk_size=200, embed=False)
+    return capsys.readouterr().out.splitlines()[-1]
+
+
+def test_reloading_the_same_csv_changes_nothing(tmp_path, capsys):
+    db_path = tmp_path / "db.sqlite"
+    first = _load(CATALOG, db_path, capsys)
+    assert "885 new or changed" in first
+    before = sqlite3.connect(db_path).execute("SELECT * FROM product ORDER BY id").fetchall()
+
+    second = _load(CATALOG, db_path, capsys)
+    assert "0 new or changed, 0 removed" in second
+    assert sqlite3.connect(db_path).execute("SELECT * FROM product ORDER BY id").fetchall() == before
+
+
+def test_repeated_product_keeps_its_last_row(tmp_path, capsys):
+    csv_path = tmp_path / "catalog.csv"
+    csv_path.write_text(
+        "product_link,title,brand,price,discount,avg_rating,total_ratings\n"
+        "https://example.com/p/itm1?pid=SHOE1,Old title,Nike,1000,0.1,4.0,10\n"
+        "https://example.com/p/itm2?pid=SHOE2,Other shoe,Puma,2000,0.2,4.1,20\n"
+        "https://example.com/p/itm1?pid=SHOE1,New title,Nike,900,0.2,4.2,12\n",
+        encoding='utf-8',
+    )
+    db_path = tmp_path / "db.sqlite"
+    assert "1 repeated products" in _load(csv_path, db_path, capsys)
+    rows = sqlite3.connect(db_path).execute("SELECT product_key, title, price FROM product ORDER BY product_key")
+    assert rows.fetchall() == [('SHOE1', 'New title', 900), ('SHOE2', 'Other shoe', 2000)]
+    assert "0 new or changed" in _load(csv_path, db_path, capsys)
+
+
+def test_title_index_failure_does_not_fail_the_load(monkeypatch, tmp_path, capsys):
+    def build_index(db_path):
+        raise OSError("No space left on device")
+
+    monkeypatch.setitem(sys.modules, 'product_index', types.SimpleNamespace(build_index=build_index))
+    csv_to_sqlite.build_title_index(str(tmp_path / "db.sqlite"))
+    err = capsys.readouterr().err
+    assert "No space left on device" in err
+    assert "python app/product_index.py build" in err
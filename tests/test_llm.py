@@ -0,0 +1,51 @@
+import asyncio
+import threading
+
+import llm
+from cache import CompletionCache
+
+
+def _request():
+    return dict(model='test-model', messages=[{'role': 'user', 'content': 'Do you offer free delivery?'}],
+                temperature=0)
+
+
+def test_async_cache_io_runs_off_the_event_loop(monkeypatch, tmp_path):
+    cache = CompletionCache(tmp_path / "completions.sqlite")
+    threads = []
+
+    def get(key):
+        threads.append(threading.current_thread())
+        return "Yes, delivery is free."
+
+    monkeypatch.setattr(cache, 'get', get)
+    monkeypatch.setattr(llm, 'completion_cache', cache)
+    monkeypatch.setattr(llm, 'CACHE_MODE', 'on')
+
+    async def call():
+        return threading.current_thread(), await llm.acomplete(_request(), 'test.llm')
+
+    loop_thread, completion = asyncio.run(call())
+    assert completion.choices[0].message.content == "Yes, delivery is free."
+    assert threads and loop_thread not in threads
+
+
+def test_async_stream_is_cached_once_read(monkeypatch, tmp_path):
+    cache = CompletionCache(tmp_path / "completions.sqlite")
+    monkeypatch.setattr(llm, 'completion_cache', cache)
+    monkeypatch.setattr(llm, 'CACHE_MODE', 'on')
+
+    async def upstream():
+        for text in ("Yes, ", "delivery is free."):
+            yield llm._cached_completion(_request(), text, stream=True)
+
+    async def _acomplete(request, stage, stream, hedge):
+        return upstream()
+
+    async def read():
+        stream = await llm.acomplete(_request(), 'test.llm', stream=True)
+        return "".join([text async for text in llm.astream_text(stream)])
+
+    monkeypatch.setattr(llm, '_acomplete', _acomplete)
+    assert asyncio.run(read()) == "Yes, delivery is free."
+    assert cache.get(CompletionCache.key(_request())) == "Yes, delivery is free."
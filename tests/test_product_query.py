@@ -0,0 +1,79 @@
+import pytest
+
+from product_query import parse_product_query, build_sql
+
+BRANDS = ('nike', 'puma', 'adidas', 'campus', 'red tape')
+
+
+@pytest.mark.parametrize('question', [
+    "shoes not from nike",
+    "shoes except puma",
+    "is nike better than puma?",
+    "nike or puma running shoes",
+    "sneakers without laces under 2000",
+])
+def test_negations_and_comparisons_go_to_the_llm(question):
+    assert parse_product_query(question, BRANDS) is None
+    assert parse_product_query(question, BRANDS, free_text=True) is None
+
+
+def test_descriptive_words_become_keywords():
+    pq = parse_product_query("comfortable breathable nike shoes under 1500", BRANDS, free_text=True)
+    assert pq.brand == 'nike'
+    assert pq.max_price == 1500
+    assert pq.keywords == ['comfortable', 'breathable']
+
+
+def test_common_search():
+    pq = parse_product_query("red tape running shoes for men under 3000", BRANDS)
+    assert build_sql(pq) == (
+        "SELECT * FROM product WHERE brand_norm = ? AND price <= ? "
+        "AND id IN (SELECT rowid FROM product_fts WHERE product_fts MATCH ?)",
+        ('red tape', 3000.0, '"running" "men"'),
+    )
+
+
+@pytest.mark.parametrize('question, conditions, params', [
+    ("shoes with rating below 3", "avg_rating <= ?", (3.0,)),
+    ("nike shoes with rating under 3.5", "brand_norm = ? AND avg_rating <= ?", ('nike', 3.5)),
+    ("shoes rated below 3", "avg_rating <= ?", (3.0,)),
+    ("below 3 star shoes", "avg_rating <= ?", (3.0,)),
+    ("shoes rated above 4", "avg_rating >= ?", (4.0,)),
+    ("shoes with discount less than 20%", "discount <= ?", (0.2,)),
+    ("shoes under 20% off", "discount <= ?", (0.2,)),
+    ("shoes with rating above 4 under 2000", "price <= ? AND avg_rating >= ?", (2000.0, 4.0)),
+    ("shoes rated 3 to 4", "avg_rating >= ? AND avg_rating <= ?", (3.0, 4.0)),
+    ("shoes in the range 4 to 5 rating", "avg_rating >= ? AND avg_rating <= ?", (4.0, 5.0)),
+    ("shoes with rating between 3.5 and 4.5 under 3000",
+     "price <= ? AND avg_rating >= ? AND avg_rating <= ?", (3000.0, 3.5, 4.5)),
+    ("shoes 4 stars and above", "avg_rating >= ?", (4.0,)),
+    ("nike shoes with discount under 10 percent and price under 3000",
+     "brand_norm = ? AND price <= ? AND discount <= ?", ('nike', 3000.0, 0.1)),
+])
+def test_bounds_bind_to_their_attribute(question, conditions, params):
+    assert build_sql(parse_product_query(question, BRANDS)) == (f"SELECT * FROM product WHERE {conditions}", params)
+
+
+@pytest.mark.parametrize('question', [
+    "shoes with rating is less than 3",
+    "nike shoes where the discount is under 15",
+    "shoes with more than 1000 ratings",
+    "nike shoes with at least 100 ratings",
+    "shoes under 2000 with more than 500 ratings",
+    "nike shoes with 100 reviews",
+])
+def test_unparsed_rating_or_discount_bound_is_never_a_price(question):
+    assert parse_product_query(question, BRANDS) is None
+    assert parse_product_query(question, BRANDS, free_text=True) is None
+
+
+@pytest.mark.parametrize('question, sql, params', [
+    ("top 3 rated nike shoes",
+     "SELECT * FROM product WHERE brand_norm = ? ORDER BY avg_rating DESC, total_ratings DESC LIMIT ?", ('nike', 3)),
+    ("top 5 adidas shoes",
+     "SELECT * FROM product WHERE brand_norm = ? ORDER BY avg_rating DESC, total_ratings DESC LIMIT ?", ('adidas', 5)),
+    ("top 5 cheapest shoes", "SELECT * FROM product ORDER BY price ASC LIMIT ?", (5,)),
+    ("first 5 nike shoes", "SELECT * FROM product WHERE brand_norm = ? LIMIT ?", ('nike', 5)),
+])
+def test_top_n_has_an_ordering(question, sql, params):
+    assert build_sql(parse_product_query(question, BRANDS)) == (sql, params)
@@ -0,0 +1,49 @@
+from types import SimpleNamespace
+
+import numpy as np
+
+import embeddings
+import route_index
+
+
+def _fake_encode(texts, **kwargs):
+    return np.array([[float(len(t)), 1.0] for t in texts], dtype=np.float32)
+
+
+def test_truncated_manifest_is_rebuilt(monkeypatch, tmp_path):
+    monkeypatch.setattr(route_index, 'CACHE_DIR', tmp_path)
+    monkeypatch.setattr(embeddings, 'encode', _fake_encode)
+    route = SimpleNamespace(name='faq', utterances=["Do you ship?", "What is the return policy?"])
+
+    vectors = route_index.load_route_vectors(route, 'test-encoder')
+    manifest_path = route_index._encoder_dir('test-encoder') / "faq.json"
+    manifest_path.write_text(manifest_path.read_text()[:20])
+
+    assert np.array_equal(route_index.load_route_vectors(route, 'test-encoder'), vectors)
+    assert not list(manifest_path.parent.glob("*.tmp"))
+
+
+def _router_reference(similarities, route_ids, top_k):
+    # SemanticRouter: top_k utterances overall, grouped by route
+    top = sorted(range(len(similarities)), key=lambda u: -similarities[u])[:top_k]
+    scores = {}
+    for u in top:
+        scores.setdefault(route_ids[u], []).append(similarities[u])
+    return {route: (sum(s) / len(s), max(s)) for route, s in scores.items()}
+
+
+def test_router_scores_match_the_semantic_router_aggregation():
+    rng = np.random.default_rng(0)
+    similarities = rng.uniform(-1, 1, size=(20, 12)).astype(np.float32)
+    route_ids = np.array([0, 0, 0, 0, 0, 0, 0, 0, 1, 1, 2, 2])
+
+    means, maxima = route_index.router_scores(similarities, route_ids, 3, top_k=5)
+
+    for i in range(len(similarities)):
+        expected = _router_reference(list(similarities[i]), list(route_ids), 5)
+        for j in range(3):
+            if j in expected:
+                assert np.isclose(means[i, j], expected[j][0])
+                assert np.isclose(maxima[i, j], expected[j][1])
+            else:
+                assert np.isnan(means[i, j]) and np.isnan(maxima[i, j])
@@ -0,0 +1,33 @@
+import csv
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+pytest.importorskip('semantic_router')
+pytest.importorskip('sentence_transformers')
+
+import assistant
+import batch_router
+from router import get_router
+
+EVAL_CSV = Path(__file__).resolve().parent.parent / "app" / "resources" / "routing_eval.csv"
+
+
+def test_speculative_routing_matches_the_router():
+    with open(EVAL_CSV, newline='', encoding='utf-8') as f:
+        queries = [row['query'] for row in csv.DictReader(f)]
+    for query in queries:
+        route_name, query_embedding = assistant.route_query(query)
+        assert assistant.choose_route(query_embedding)[0] == route_name, query
+
+
+def test_batch_routing_matches_the_router():
+    with open(EVAL_CSV, newline='', encoding='utf-8') as f:
+        queries = [row['query'] for row in csv.DictReader(f)]
+    router = get_router()
+    for result in batch_router.route_batch(queries):
+        choice = router(result['query'])
+        assert result['route'] == choice.name, result['query']
+        if choice.name is not None:
+            assert np.isclose(result['score'], choice.similarity_score, atol=1e-4), result['query']
@@ -0,0 +1,172 @@
+import asyncio
+import threading
+
+import singleflight
+
+
+class Rerun(BaseException):
+    """Stands in for Streamlit's RerunException"""
+
+
+def _run_with_follower(monkeypatch, leader_fn, follower_fn):
+    """Run one leader call and one identical follower call that joins it while it runs"""
+    monkeypatch.setattr(singleflight, 'ENABLED', True)
+    started = threading.Event()
+    joined = threading.Event()
+    outcome = {}
+
+    class Call(singleflight._Call):
+        def __init__(self):
+            super().__init__()
+            wait = self.event.wait
+
+            def wait_joined(*args):
+                joined.set()
+                return wait(*args)
+            self.event.wait = wait_joined
+
+    monkeypatch.setattr(singleflight, '_Call', Call)
+
+    @singleflight.coalesce('test')
+    def chain(query, stream=False, role='leader'):
+        if role == 'leader':
+            started.set()
+            joined.wait(5)
+            return leader_fn()
+        return follower_fn()
+
+    def run(role, name):
+        try:
+            outcome[name] = chain("Same question?" if role == 'follower' else "same question", role=role)
+        except BaseException as e:
+            outcome[name] = e
+
+    leader = threading.Thread(target=run, args=('leader', 'leader'))
+    follower = threading.Thread(target=run, args=('follower', 'follower'))
+    leader.start()
+    started.wait(5)
+    follower.start()
+    leader.join(5)
+    follower.join(5)
+    return outcome
+
+
+def test_follower_shares_the_leader_result(monkeypatch):
+    outcome = _run_with_follower(monkeypatch, lambda: "answer", lambda: "follower ran")
+    assert outcome == {'leader': "answer", 'follower': "answer"}
+
+
+def test_follower_shares_the_leader_error(monkeypatch):
+    error = ValueError("provider down")
+
+    def fail():
+        raise error
+    outcome = _run_with_follower(monkeypatch, fail, lambda: "follower ran")
+    assert outcome == {'leader': error, 'follower': error}
+
+
+def test_leader_interrupt_is_not_raised_in_followers(monkeypatch):
+    def rerun():
+        raise Rerun()
+    outcome = _run_with_follower(monkeypatch, rerun, lambda: "follower ran")
+    assert isinstance(outcome['leader'], Rerun)
+    assert outcome['follower'] == "follower ran"
+    assert not singleflight._calls
+
+
+def test_buffered_chunks_replay_while_the_next_one_is_fetched():
+    unblock = threading.Event()
+
+    def source():
+        yield "Hello"
+        unblock.wait(5)
+        yield " there"
+
+    shared = singleflight.SharedStream(source())
+    ahead = shared.reader()
+    assert next(ahead) == "Hello"
+    rest = []
+    fetching = threading.Thread(target=lambda: rest.extend(ahead))
+    fetching.start()  # Blocks in the source waiting for the second chunk
+
+    late = shared.reader()
+    replayed = []
+    replay = threading.Thread(target=lambda: replayed.append(next(late)))
+    replay.start()
+    replay.join(1)
+    assert replayed == ["Hello"]
+
+    unblock.set()
+    fetching.join(5)
+    assert rest == [" there"]
+    assert list(late) == [" there"]
+
+
+def test_shared_stream_error_reaches_every_reader():
+    def source():
+        yield "Hello"
+        raise ValueError("stream broke")
+
+    shared = singleflight.SharedStream(source())
+    for reader in (shared.reader(), shared.reader()):
+        assert next(reader) == "Hello"
+        try:
+            next(reader)
+        except ValueError as e:
+            assert str(e) == "stream broke"
+        else:
+            raise AssertionError("the error was not raised")
+
+
+def _counting_chain(monkeypatch):
+    monkeypatch.setattr(singleflight, 'ENABLED', True)
+    upstream = []
+
+    @singleflight.coalesce('test')
+    def chain(query, stream=False):
+        upstream.append(query)
+        return iter(["Hello", " there"])
+    return chain, upstream
+
+
+def test_abandoned_leader_stream_is_not_replayed(monkeypatch):
+    chain, upstream = _counting_chain(monkeypatch)
+    answer = chain("same question", stream=True)
+    assert singleflight.stats()['in_flight'] == 1
+    del answer  # e.g. a Streamlit rerun before st.write_stream started reading it
+    assert singleflight.stats()['in_flight'] == 0
+
+    assert list(chain("same question", stream=True)) == ["Hello", " there"]
+    assert len(upstream) == 2
+
+
+def test_finished_stream_is_forgotten_while_the_leader_is_alive(monkeypatch):
+    chain, upstream = _counting_chain(monkeypatch)
+    leader = chain("same question", stream=True)
+    follower = chain("same question", stream=True)
+    assert list(follower) == ["Hello", " there"]
+    assert singleflight.stats()['in_flight'] == 0
+    assert list(leader) == ["Hello", " there"]
+    assert len(upstream) == 1
+
+
+def test_abandoned_async_leader_stream_is_not_replayed(monkeypatch):
+    monkeypatch.setattr(singleflight, 'ENABLED', True)
+    upstream = []
+
+    async def source():
+        yield "Hello"
+
+    @singleflight.coalesce('test')
+    async def chain(query, stream=False):
+        upstream.append(query)
+        return source()
+
+    async def run():
+        answer = await chain("same question", stream=True)
+        del answer
+        in_flight = singleflight.stats()['in_flight']
+        return in_flight, [chunk async for chunk in await chain("same question", stream=True)]
+
+    assert asyncio.run(run()) == (0, ["Hello"])
+    assert len(upstream) == 2
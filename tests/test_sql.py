@@ -0,0 +1,85 @@
+import asyncio
+import sqlite3
+from types import SimpleNamespace
+
+import httpx
+
+import sql
+import product_index
+from db import fetch
+
+
+def test_vector_search_without_hits_falls_back_to_llm(monkeypatch):
+    monkeypatch.setattr(sql, 'known_brands', lambda: ('nike',))
+    monkeypatch.setattr(product_index, 'search', lambda *args, **kwargs: [])
+    assert sql.translate_with_vectors("comfortable breathable nike shoes") is None
+    assert sql.translate_locally("comfortable breathable nike shoes") is None
+
+
+def test_vector_search_hits_select_products_in_score_order(monkeypatch):
+    monkeypatch.setattr(sql, 'known_brands', lambda: ('nike',))
+    monkeypatch.setattr(product_index, 'search', lambda *args, **kwargs: [(7, 0.8), (3, 0.6)])
+    query, params = sql.translate_with_vectors("comfortable breathable nike shoes")
+    assert query == "SELECT * FROM product WHERE id IN (?, ?) ORDER BY CASE id WHEN ? THEN 0 WHEN ? THEN 1 END"
+    assert params == (7, 3, 7, 3)
+
+
+def _chunk(text):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+
+
+def _failing_stream():
+    yield _chunk("The average rating ")
+    raise httpx.ReadTimeout("read timed out")
+
+
+async def _afailing_stream():
+    for chunk in _failing_stream():
+        yield chunk
+
+
+def test_comprehension_stream_failing_partway_ends_with_message(monkeypatch):
+    monkeypatch.setenv('GROQ_MODEL', 'test-model')
+    monkeypatch.setattr(sql, 'complete', lambda *args, **kwargs: _failing_stream())
+    chunks = list(sql.data_comprehension("What is the average rating?", "avg\n4.1", stream=True))
+    assert chunks[0] == "The average rating "
+    assert chunks[-1] == sql.comprehension_error_message(httpx.ReadTimeout("read timed out"))
+
+
+def test_async_comprehension_stream_failing_partway_ends_with_message(monkeypatch):
+    async def acomplete(*args, **kwargs):
+        return _afailing_stream()
+
+    async def collect():
+        answer = await sql.adata_comprehension("What is the average rating?", "avg\n4.1", stream=True)
+        return [chunk async for chunk in answer]
+
+    monkeypatch.setenv('GROQ_MODEL', 'test-model')
+    monkeypatch.setattr(sql, 'acomplete', acomplete)
+    chunks = asyncio.run(collect())
+    assert chunks[0] == "The average rating "
+    assert "read timed out" in chunks[-1]
+
+
+
+def _puma_result():
+    conn = sqlite3.connect(":memory:")
+    return fetch(conn, "SELECT 1 AS id, 'K1' AS product_key, 'https://example.com/p?pid=K1' AS product_link, "
+                       "'Puma Runner' AS title, 'Puma' AS brand, 'puma' AS brand_norm, 1999 AS price, "
+                       "0.2 AS discount, 4.1 AS avg_rating, 50 AS total_ratings")
+
+
+def _answer(monkeypatch, question):
+    result = _puma_result()
+    monkeypatch.setattr(sql, 'translate_question', lambda q: ("SELECT * FROM product", (), 'llm'))
+    monkeypatch.setattr(sql, 'run_translated', lambda *args: result)
+    monkeypatch.setattr(sql, 'data_comprehension', lambda q, context, stream=False: f"summary of {context}")
+    return sql.sql_chain(question)
+
+
+def test_aggregate_question_is_summarized_even_with_product_rows(monkeypatch):
+    assert _answer(monkeypatch, "How many Puma shoes are there?").startswith("summary of ")
+
+
+def test_product_rows_are_rendered_as_a_list(monkeypatch):
+    assert _answer(monkeypatch, "Show me puma running shoes").startswith("1. Puma Runner: Rs. 1999")
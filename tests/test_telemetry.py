@@ -0,0 +1,42 @@
+import json
+import asyncio
+import contextvars
+
+import telemetry
+from blocking import submit, run_blocking
+
+
+def _pooled_stage():
+    with telemetry.span('test.pooled'):
+        pass
+
+
+def _traced_spans(path):
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+def test_spans_on_the_worker_pool_keep_the_trace_id(monkeypatch, tmp_path):
+    trace_file = tmp_path / "trace.jsonl"
+    monkeypatch.setattr(telemetry, 'TRACE_FILE', str(trace_file))
+
+    async def request():
+        trace_id = telemetry.start_trace()
+        await run_blocking(_pooled_stage)
+        return trace_id
+
+    trace_id = asyncio.run(request())
+    assert [s['trace_id'] for s in _traced_spans(trace_file)] == [trace_id]
+
+
+def test_submitted_spans_keep_the_trace_id(monkeypatch, tmp_path):
+    trace_file = tmp_path / "trace.jsonl"
+    monkeypatch.setattr(telemetry, 'TRACE_FILE', str(trace_file))
+
+    def request():
+        trace_id = telemetry.start_trace()
+        submit(_pooled_stage).result()
+        return trace_id
+
+    # A fresh context, as a Streamlit script run or API request would have
+    trace_id = contextvars.Context().run(request)
+    assert [s['trace_id'] for s in _traced_spans(trace_file)] == [trace_id]
@@ -1,37 +1,289 @@
-import pandas as pd
+"""
+Load the scraped product catalog into SQLite.
+
+    python csv_to_sqlite.py <csv_path> <db_path> [--chunk-size 5000] [--unavailable unavailable_products.csv]
+
+The CSV is streamed in chunks into a temporary staging table keyed by the
+product id (the pid= parameter of product_link), where a product listed more
+than once keeps its last row. The staged products are then upserted in one
+transaction per chunk. Re-running the script updates changed products, leaves
+unchanged ones alone and removes products that are no longer in the CSV (or
+are listed in the unavailable file), so a reload never duplicates the catalog
+and a reload of an unchanged CSV writes nothing. The database stays in WAL mode, so the
+app keeps reading while a reload runs. Afterwards the title embeddings used
+by semantic product search are brought up to date (app/product_index.py);
+--no-embeddings skips that step.
+"""
+import sys
+import csv
+import time
 import sqlite3
+import argparse
+from pathlib import Path
+from itertools import islice
+from urllib.parse import urlparse, parse_qs
 
-# Database and CSV file paths
+# Default database and CSV file paths
 db_path = 'db.sqlite'
 csv_path = 'flipkart_product_data.csv'
 
-# Connect to SQLite database (creates one if not exists)
-conn = sqlite3.connect(db_path)
-cursor = conn.cursor()
+columns = ['product_link', 'title', 'brand', 'price', 'discount', 'avg_rating', 'total_ratings']
 
-# Create the product table if it does not exist
-cursor.execute('''
+schema = '''
 CREATE TABLE IF NOT EXISTS product (
+    id INTEGER PRIMARY KEY,
+    product_key TEXT,
     product_link TEXT,
     title TEXT,
     brand TEXT,
+    brand_norm TEXT,
     price INTEGER,
     discount FLOAT,
     avg_rating FLOAT,
     total_ratings INTEGER
 );
-''')
 
-# Commit the table creation
-conn.commit()
+CREATE INDEX IF NOT EXISTS idx_product_brand_norm ON product(brand_norm);
+CREATE INDEX IF NOT EXISTS idx_product_price ON product(price);
+CREATE INDEX IF NOT EXISTS idx_product_discount ON product(discount);
+CREATE INDEX IF NOT EXISTS idx_product_avg_rating ON product(avg_rating);
+
+-- Full-text index over titles ("running", "women", "sneakers", ...), kept in sync by triggers
+CREATE VIRTUAL TABLE IF NOT EXISTS product_fts USING fts5(
+    title,
+    content='product',
+    content_rowid='id',
+    tokenize='porter unicode61'
+);
+
+CREATE TRIGGER IF NOT EXISTS product_ai AFTER INSERT ON product BEGIN
+    INSERT INTO product_fts(rowid, title) VALUES (new.id, new.title);
+END;
+CREATE TRIGGER IF NOT EXISTS product_ad AFTER DELETE ON product BEGIN
+    INSERT INTO product_fts(product_fts, rowid, title) VALUES ('delete', old.id, old.title);
+END;
+CREATE TRIGGER IF NOT EXISTS product_au AFTER UPDATE OF title ON product BEGIN
+    INSERT INTO product_fts(product_fts, rowid, title) VALUES ('delete', old.id, old.title);
+    INSERT INTO product_fts(rowid, title) VALUES (new.id, new.title);
+END;
+'''
+
+key_index = 'CREATE UNIQUE INDEX IF NOT EXISTS idx_product_key ON product(product_key);'
+
+# This load's rows, one per product key: a later row for the same product replaces the earlier one
+staging = '''
+CREATE TEMP TABLE staged (
+    product_key TEXT PRIMARY KEY,
+    product_link TEXT, title TEXT, brand TEXT, brand_norm TEXT,
+    price INTEGER, discount FLOAT, avg_rating FLOAT, total_ratings INTEGER
+)
+'''
+stage = 'INSERT OR REPLACE INTO temp.staged VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)'
+
+# Upsert the staged rows with rowid in (?, ?]. Only rows whose values changed
+# are rewritten, so a reload of an unchanged catalog touches no pages and
+# fires no FTS triggers
+upsert = '''
+INSERT INTO product (product_key, product_link, title, brand, brand_norm, price, discount, avg_rating, total_ratings)
+SELECT product_key, product_link, title, brand, brand_norm, price, discount, avg_rating, total_ratings
+FROM temp.staged WHERE rowid > ? AND rowid <= ?
+ON CONFLICT(product_key) DO UPDATE SET
+    product_link = excluded.product_link,
+    title = excluded.title,
+    brand = excluded.brand,
+    brand_norm = excluded.brand_norm,
+    price = excluded.price,
+    discount = excluded.discount,
+    avg_rating = excluded.avg_rating,
+    total_ratings = excluded.total_ratings
+WHERE (product_link, title, brand, price, discount, avg_rating, total_ratings)
+    IS NOT (excluded.product_link, excluded.title, excluded.brand, excluded.price,
+            excluded.discount, excluded.avg_rating, excluded.total_ratings)
+'''
+
+
+def product_key(link):
+    """Stable product id: the pid= parameter of the link, else the link path"""
+    if not link:
+        return None
+    parsed = urlparse(link.strip())
+    pid = parse_qs(parsed.query).get('pid')
+    if pid and pid[0]:
+        return pid[0]
+    return parsed.path.rstrip('/') or None
+
+
+def normalize_brand(brand):
+    """Lowercase, whitespace-trimmed brand used for exact, indexed lookups"""
+    return brand.strip().lower() if isinstance(brand, str) and brand.strip() else None
+
+
+def _number(value, kind):
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return kind(value)
+    value = value.strip()
+    if not value:
+        return None
+    try:
+        return kind(float(value))
+    except ValueError:
+        return None
+
+
+def product_row(link, title, brand, price, discount, avg_rating, total_ratings):
+    """Parameters for the upsert statement, or None if the row has no usable link"""
+    key = product_key(link)
+    if key is None:
+        return None
+    brand = brand.strip() if isinstance(brand, str) else brand
+    return (
+        key, link.strip(), title, brand, normalize_brand(brand),
+        _number(price, int), _number(discount, float), _number(avg_rating, float), _number(total_ratings, int),
+    )
+
+
+def read_chunks(path, chunk_size):
+    """Yield lists of raw CSV rows (in `columns` order), chunk_size at a time"""
+    with open(path, newline='', encoding='utf-8') as f:
+        reader = csv.DictReader(f)
+        missing = set(columns) - set(reader.fieldnames or ())
+        if missing:
+            raise ValueError(f"{path} is missing columns: {', '.join(sorted(missing))}")
+        rows = (tuple(record[c] or None for c in columns) for record in reader)
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                return
+            yield chunk
+
+
+def read_unavailable(path):
+    """Product keys listed in the scraper's unavailable_products.csv (column: link)"""
+    with open(path, newline='', encoding='utf-8') as f:
+        return {key for key in (product_key(r.get('link')) for r in csv.DictReader(f)) if key}
+
+
+def migrate_legacy_table(conn):
+    """Rebuild a product table created by older versions of this script (no id, no brand_norm)"""
+    existing = [row[1] for row in conn.execute("PRAGMA table_info(product)")]
+    if not existing or 'brand_norm' in existing:
+        return
+    print("Migrating existing product table to the indexed schema...")
+    conn.execute("ALTER TABLE product RENAME TO product_legacy")
+    conn.executescript(schema)
+    rows = conn.execute(f"SELECT {', '.join(columns)} FROM product_legacy").fetchall()
+    conn.executemany("""INSERT INTO product (product_key, product_link, title, brand, brand_norm, price, discount,
+                        avg_rating, total_ratings) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                     filter(None, (product_row(*row) for row in rows)))
+    conn.execute("DROP TABLE product_legacy")
+
+
+def migrate_product_key(conn):
+    """Key tables that predate product_key, dropping the duplicates earlier appends created"""
+    existing = [row[1] for row in conn.execute("PRAGMA table_info(product)")]
+    if 'product_key' not in existing:
+        conn.execute("ALTER TABLE product ADD COLUMN product_key TEXT")
+        conn.create_function('product_key', 1, product_key, deterministic=True)
+        conn.execute("UPDATE product SET product_key = product_key(product_link)")
+    indexed = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_product_key'").fetchone()
+    if not indexed:
+        # Keep the most recently loaded copy of each product
+        removed = conn.execute("""DELETE FROM product WHERE product_key IS NULL OR id NOT IN
+                                  (SELECT MAX(id) FROM product GROUP BY product_key)""").rowcount
+        if removed:
+            print(f"Removed {removed} duplicate products left by earlier loads")
+        conn.execute(key_index)
+
+
+def build_title_index(db_path):
+    """Embed new or retitled products for semantic search, using the app's embedding backend"""
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'app'))
+    try:
+        import product_index
+        product_index.build_index(db_path)
+    except Exception as e:
+        # The catalog is already committed; a missing model or a full disk must not fail the load
+        print(f"Warning: title embeddings not updated ({e!r}); "
+              f"build them later with: python app/product_index.py build {db_path}", file=sys.stderr)
+
+
+def main(csv_path, db_path, chunk_size=5000, unavailable_path=None, keep_missing=False, embed=True):
+    conn = sqlite3.connect(db_path)
+    # WAL lets the app's read-only connections keep reading while the catalog reloads
+    conn.execute('PRAGMA journal_mode=WAL;')
+    conn.execute('PRAGMA synchronous=NORMAL;')
+
+    with conn:
+        migrate_legacy_table(conn)
+        # Create the product table, its indexes and the title search index if they do not exist
+        conn.executescript(schema)
+        migrate_product_key(conn)
+
+    # Products in this load; anything else is removed at the end
+    conn.execute(staging)
+
+    start = time.perf_counter()
+    read = skipped = 0
+    for chunk in read_chunks(csv_path, chunk_size):
+        rows = [row for row in (product_row(*raw) for raw in chunk) if row is not None]
+        skipped += len(chunk) - len(rows)
+        with conn:
+            conn.executemany(stage, rows)
+        read += len(chunk)
+        elapsed = time.perf_counter() - start
+        print(f"  {read} rows read ({read / elapsed:.0f} rows/s)")
+    staged = conn.execute("SELECT COUNT(*) FROM temp.staged").fetchone()[0]
+
+    written = upserted = 0
+    last = 0
+    while True:
+        bound = conn.execute("SELECT MAX(rowid) FROM (SELECT rowid FROM temp.staged WHERE rowid > ? "
+                             "ORDER BY rowid LIMIT ?)", (last, chunk_size)).fetchone()[0]
+        if bound is None:
+            break
+        with conn:
+            written += conn.execute(upsert, (last, bound)).rowcount
+        upserted += conn.execute("SELECT COUNT(*) FROM temp.staged WHERE rowid > ? AND rowid <= ?",
+                                 (last, bound)).fetchone()[0]
+        last = bound
+        print(f"  {upserted}/{staged} products upserted, {written} written")
+
+    removed = 0
+    with conn:
+        if not keep_missing:
+            removed += conn.execute(
+                "DELETE FROM product WHERE product_key NOT IN (SELECT product_key FROM temp.staged)"
+            ).rowcount
+        if unavailable_path:
+            unavailable = read_unavailable(unavailable_path)
+            removed += conn.executemany(
+                "DELETE FROM product WHERE product_key = ?", ((key,) for key in unavailable)
+            ).rowcount
+    elapsed = time.perf_counter() - start
+
+    conn.execute("ANALYZE;")
+    total = conn.execute("SELECT COUNT(*) FROM product").fetchone()[0]
+    conn.close()
 
-# Read CSV file using pandas
-df = pd.read_csv(csv_path)
+    print(f"Loaded {read} rows in {elapsed:.2f}s ({read / max(elapsed, 1e-9):.0f} rows/s): "
+          f"{written} new or changed, {removed} removed, {skipped} skipped without a product link, "
+          f"{read - skipped - staged} repeated products (last row kept); "
+          f"{total} products in {db_path}")
 
-# Insert data into the product table
-df.to_sql('product', conn, if_exists='append', index=False)
+    if embed:
+        build_title_index(db_path)
 
-# Close the connection
-conn.close()
 
-print("Data inserted successfully!")
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Stream a product CSV into the SQLite catalog (idempotent upsert)")
+    parser.add_argument('csv_path', nargs='?', default=csv_path)
+    parser.add_argument('db_path', nargs='?', default=db_path)
+    parser.add_argument('--chunk-size', type=int, default=5000, help="rows per transaction")
+    parser.add_argument('--unavailable', help="CSV of unavailable product links (column: link) to remove")
+    parser.add_argument('--keep-missing', action='store_true',
+                        help="keep products that are not in the CSV (for partial loads)")
+    parser.add_argument('--no-embeddings', action='store_true', help="do not update the title vector index")
+    args = parser.parse_args()
+    main(args.csv_path, args.db_path, args.chunk_size, args.unavailable, args.keep_missing, not args.no_embeddings)